@@ -0,0 +1,43 @@
+import os
+
+from a2wsgi import WSGIMiddleware
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import auth
+import booking
+import database
+from booking import JWT_SECRET
+
+# Асинхронный режим сервиса бронирований (ASGI): `python3 async_booking.py` или `uvicorn async_booking:app`.
+# Список бронирований пользователя читается через asyncio-движок,
+# остальные маршруты обслуживает то же Flask-приложение booking.app в пуле потоков
+
+database.init_async()
+
+
+@auth.requires_auth_async(JWT_SECRET)
+async def get_all_books(request):
+    user_id = request.path_params["user_id"]
+    async with database.AsyncReadSession(request) as s:
+        car_bookings = (await s.scalars(booking.user_bookings_query(user_id))).all()
+    return JSONResponse(booking.user_bookings(car_bookings))
+
+
+app = Starlette(routes=[
+    Route("/booking/user/{user_id:int}", get_all_books, methods=["GET"]),
+    Mount("/", WSGIMiddleware(booking.app)),
+])
+
+
+if __name__ == '__main__':
+    database.create_schema()
+
+    PORT = os.environ.get("PORT")
+    if not PORT:
+        print("USING DEFAULT PORT 7777, не задан $PORT")
+        PORT = 7777
+    # log_config=None: журнал доступа uvicorn идёт через logger, а не свои обработчики
+    uvicorn.run(app, host="0.0.0.0", port=int(PORT), log_config=None)
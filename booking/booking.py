@@ -10,15 +10,19 @@ from flask import Flask
 from flask import request as flask_request, _request_ctx_stack, jsonify
 from jose import jwt
 from jose.exceptions import JWTError
-from sqlalchemy import Column, Integer, Text
+from sqlalchemy import Column, Index, Integer, Text, select
 
 import database
 import auth
+import logger
 
 
+log = logger.setup("booking")
+
 # Экземпляр приложения
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
+database.instrument(app)
 CLIENT_ID = "booking_service"
 JWT_SECRET = auth.KNOWN_CLIENTS["booking_service"]
 
@@ -47,9 +51,19 @@ class CarBooking(database.Base):
     end_office = Column(Integer, nullable=False)
     status = Column(Text, nullable=False)
 
+    __table_args__ = (
+        # бронирования пользователя, новые первыми
+        Index("ix_car_booking_user_start", "user_id", "booking_start"),
+    )
+
+
+@database.migration(1, "car_booking indexes")
+def add_car_booking_indexes(connection):
+    database.create_indexes(connection, CarBooking)
+
 
 def strip_headers(headers):
-    allowed_headers = ["Authorization", "Cookie", "Content-Type", "User-Id", "Is-Admin", "Is-Service"]
+    allowed_headers = ["Authorization", "Cookie", "Content-Type", "User-Id", "Is-Admin", "Is-Service", "X-Last-Write"]
     return {k: v for k, v in headers.items() if k in allowed_headers}
 
 
@@ -81,6 +95,27 @@ def get_token():
     return {"token": token, "expire": expire}, 200
 
 
+@app.route('/token/cache', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_token_cache_stats():
+    return auth.verified_tokens.stats(), 200
+
+
+@app.route('/db/stats', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_db_stats():
+    return database.pool_stats(), 200
+
+
+@app.route('/client/stats', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_client_stats():
+    return auth.service_client.stats(), 200
+
+
 @app.route("/booking", methods=["POST"])
 @auth.requires_auth(JWT_SECRET)
 def new_booking():
@@ -96,7 +131,7 @@ def new_booking():
     except Exception as e:
         return {"error": "bad body", "details": str(e)}, 400
 
-    print("BOOKING:", booking_start, "-", booking_end)
+    log.info("booking", car_uuid=car_uuid, user_id=user_id, start=booking_start, end=booking_end)
 
     # Сходить в payment_service и заплатить
     if not MINIMAL_MODE:
@@ -115,14 +150,7 @@ def new_booking():
     else:
         payment_id = 0
 
-    print("adding nedostupnost")
-    print(len(flask_request.headers))
-    print("PUT",  f"http://{OFFICE_SERVICE_URL}/offices/cars/{car_uuid}", {
-            "start_time": booking_start,
-            "end_time": booking_end,
-            "taken_from": start_office,
-            "taken_to": end_office,
-        })
+    log.request(flask_request.path, "taking car", car_uuid=car_uuid, taken_from=start_office, taken_to=end_office)
 
     # Добавить в расписание машины недоступность
     api_call_result = make_authorized_request(
@@ -136,11 +164,9 @@ def new_booking():
         headers=strip_headers(flask_request.headers)
     )
     if not api_call_result.ok:
-        print("NOT OK!!!!", str(api_call_result))
+        log.warning("office service refused booking", car_uuid=car_uuid, status=api_call_result.status_code)
         return {"error": "bad api request", "details": api_call_result.text}, 500
 
-    print("creating_object")
-
     # Создать объект в базе
     with database.Session() as s:
         car_booking = CarBooking(
@@ -168,11 +194,20 @@ def new_booking():
             headers=strip_headers(flask_request.headers)
         )
         if not api_call_result.ok:
-            print("ошибка при запросе сервиса статистики:", api_call_result.status_code, api_call_result.text)
+            log.warning("statistics service error", status=api_call_result.status_code, details=api_call_result.text)
 
     return {"booking_id": booking_id}, 201
 
 
+def set_booking_status(s, booking_id, current, new):
+    # одним UPDATE, без повторной загрузки строки: меняется только букинг, который всё ещё в статусе current
+    return (
+        s.query(CarBooking)
+        .filter(CarBooking.id == booking_id, CarBooking.status == current)
+        .update({CarBooking.status: new}, synchronize_session=False)
+    )
+
+
 @app.route("/booking/<int:booking_id>", methods=["DELETE"])
 @auth.requires_auth(JWT_SECRET)
 def cancel_booking(booking_id):
@@ -187,15 +222,29 @@ def cancel_booking(booking_id):
         start_time = car_booking.booking_start
         payment_id = car_booking.payment_id
 
+    # Сначала одним условным UPDATE переводим букинг в cancelled и только потом возвращаем деньги:
+    # из параллельных отмен статус сменит одна, и платёж будет возвращён ровно один раз
+    with database.Session() as s:
+        if not set_booking_status(s, booking_id, "NEW", "CANCELLED"):
+            return {"error": "this booking is not new"}, 400
+
     # Вернуть деньги
     if not MINIMAL_MODE:
-        api_call_result = make_authorized_request(
-            CLIENT_ID, JWT_SECRET,
-            "POST",
-            f"http://{PAYMENT_SERVICE_URL}/payment/{payment_id}/reverse",
-            headers=strip_headers(flask_request.headers)
-        )
-        if not api_call_result.ok:
+        refunded = False
+        try:
+            api_call_result = make_authorized_request(
+                CLIENT_ID, JWT_SECRET,
+                "POST",
+                f"http://{PAYMENT_SERVICE_URL}/payment/{payment_id}/reverse",
+                headers=strip_headers(flask_request.headers)
+            )
+            refunded = api_call_result.ok
+        finally:
+            if not refunded:
+                # деньги не вернулись - букинг снова активен, отмену можно повторить
+                with database.Session() as s:
+                    set_booking_status(s, booking_id, "CANCELLED", "NEW")
+        if not refunded:
             return {"error": "bad api request", "details": api_call_result.text}, 500
 
     # # Удалить в расписании машины доступность
@@ -209,13 +258,6 @@ def cancel_booking(booking_id):
     # if not api_call_result.ok:
     #     return {"error": "bad api request", "details": api_call_result.text}, 500
 
-    # Устанавливаем статус cancelled на этот букинг
-    with database.Session() as s:
-        car_booking = s.query(CarBooking).filter(CarBooking.id == booking_id).one()
-        if not car_booking:
-            return {"error": "car booking not found"}, 404
-        car_booking.status = "CANCELLED"
-
     return {}, 200
 
 
@@ -252,45 +294,40 @@ def end_booking(booking_id):
     return {}, 200
 
 
+def booking_json(c):
+    return {
+        "id": c.id,
+        "car_uuid": c.car_uuid,
+        "booking_start": c.booking_start,
+        "booking_end": c.booking_end,
+        "start_office": c.start_office,
+        "end_office": c.end_office,
+        "status": c.status,
+    }
+
+
+def user_bookings(car_bookings):
+    # общий ответ для get_all_books и async_booking.get_all_books
+    return {
+        "active": [booking_json(c) for c in car_bookings if c.status == "NEW"],
+        "done": [booking_json(c) for c in car_bookings if c.status != "NEW"],
+    }
+
+
+def user_bookings_query(user_id):
+    return (
+        select(CarBooking)
+        .where(CarBooking.user_id == user_id)
+        .order_by(CarBooking.booking_start.desc())
+    )
+
+
 @app.route("/booking/user/<int:user_id>", methods=["GET"])
 @auth.requires_auth(JWT_SECRET)
 def get_all_books(user_id):
-    with database.Session() as s:
-        car_bookings = (
-            s.query(CarBooking)
-            .filter(CarBooking.user_id == user_id)
-            .order_by(CarBooking.booking_start.desc())
-            .all()
-        )
-        result = {
-            "active": [
-                {
-                    "id": c.id,
-                    "car_uuid": c.car_uuid,
-                    "booking_start": c.booking_start,
-                    "booking_end": c.booking_end,
-                    "start_office": c.start_office,
-                    "end_office": c.end_office,
-                    "status": c.status,
-                }
-                for c in car_bookings
-                if c.status == "NEW"
-            ],
-            "done": [
-                {
-                    "id": c.id,
-                    "car_uuid": c.car_uuid,
-                    "booking_start": c.booking_start,
-                    "booking_end": c.booking_end,
-                    "start_office": c.start_office,
-                    "end_office": c.end_office,
-                    "status": c.status,
-                }
-                for c in car_bookings
-                if c.status != "NEW"
-            ]
-        }
-        return result, 200
+    with database.ReadSession() as s:
+        car_bookings = s.scalars(user_bookings_query(user_id)).all()
+        return user_bookings(car_bookings), 200
 
 
 if __name__ == '__main__':
@@ -0,0 +1,168 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import sha256
+from time import time
+import binascii
+import hmac
+import json
+import os
+
+# Все токены системы - HS256. Реализация выбирается через JWT_BACKEND:
+# jose - python-jose (по умолчанию), hs256 - встроенная (hmac + compare_digest), pyjwt - PyJWT.
+# Сравнить их на наших токенах: python3 jwt_bench.py (лежит в gateway)
+#
+# hs256 включается только явно. Из claims она, как python-jose без audience/issuer/subject,
+# проверяет exp, nbf, тип iat, строковые sub и jti и отклоняет любой токен с aud.
+# В отличие от python-jose она не проверяет at_hash, не поддерживает ключи по kid и
+# принимает только заголовок с alg HS256; typ, как и python-jose, не проверяет
+
+JWT_BACKEND = os.environ.get("JWT_BACKEND", "jose")
+ALGORITHM = "HS256"
+# Сколько подготовленных hmac по секретам держит hs256. Секретов в системе единицы,
+# предел защищает от роста, если секрет приходит извне
+MAC_CACHE_SIZE = 64
+
+
+class JWTError(Exception):
+    pass
+
+
+class ExpiredSignatureError(JWTError):
+    pass
+
+
+def _b64encode(data):
+    return urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data):
+    return urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def _int_claim(claims, name, title):
+    try:
+        return int(claims[name])
+    except (TypeError, ValueError):
+        raise JWTError(f"{title} claim ({name}) must be an integer.") from None
+
+
+class HS256Backend:
+    name = "hs256"
+    header = _b64encode(_dumps({"alg": ALGORITHM, "typ": "JWT"}))
+
+    def __init__(self):
+        # hmac с уже обработанным ключом: на токен остаётся copy() и update()
+        self.macs = {}
+
+    def _mac(self, secret):
+        mac = self.macs.get(secret)
+        if mac is None:
+            if len(self.macs) >= MAC_CACHE_SIZE:
+                self.macs.clear()
+            mac = self.macs[secret] = hmac.new(secret.encode(), digestmod=sha256)
+        return mac.copy()
+
+    def encode(self, claims, secret):
+        signing_input = self.header + b"." + _b64encode(_dumps(claims))
+        mac = self._mac(secret)
+        mac.update(signing_input)
+        return (signing_input + b"." + _b64encode(mac.digest())).decode()
+
+    def decode(self, token, secret):
+        if not isinstance(token, str) or token.count(".") != 2:
+            raise JWTError("Not enough segments")
+        try:
+            signing_input, _, signature = token.encode().rpartition(b".")
+            header, _, payload = signing_input.partition(b".")
+            if header != self.header and json.loads(_b64decode(header)).get("alg") != ALGORITHM:
+                raise JWTError("The specified alg value is not allowed")
+            signature = _b64decode(signature)
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, binascii.Error, AttributeError) as e:
+            raise JWTError(f"Error decoding token: {e}") from None
+
+        mac = self._mac(secret)
+        mac.update(signing_input)
+        if not hmac.compare_digest(mac.digest(), signature):
+            raise JWTError("Signature verification failed.")
+        if not isinstance(claims, dict):
+            raise JWTError("Invalid payload string: must be a json object")
+
+        # как в python-jose: целые секунды, exp == now ещё действует
+        now = int(time())
+        if "iat" in claims:
+            _int_claim(claims, "iat", "Issued At")
+        if "exp" in claims and _int_claim(claims, "exp", "Expiration Time") < now:
+            raise ExpiredSignatureError("Signature has expired.")
+        if "nbf" in claims and _int_claim(claims, "nbf", "Not Before") > now:
+            raise JWTError("The token is not yet valid (nbf)")
+        # audience сервисы не задают, поэтому токен, выпущенный для кого-то, не подходит никому
+        if "aud" in claims:
+            raise JWTError("Invalid audience")
+        for name, title in (("sub", "Subject"), ("jti", "JWT ID")):
+            if name in claims and not isinstance(claims[name], str):
+                raise JWTError(f"{title} must be a string.")
+        return claims
+
+
+class JoseBackend:
+    name = "jose"
+
+    def __init__(self):
+        from jose import jwt
+        from jose import exceptions
+        self.jwt = jwt
+        self.exceptions = exceptions
+
+    def encode(self, claims, secret):
+        return self.jwt.encode(claims, secret, algorithm=ALGORITHM)
+
+    def decode(self, token, secret):
+        try:
+            return self.jwt.decode(token, secret, algorithms=[ALGORITHM])
+        except self.exceptions.ExpiredSignatureError as e:
+            raise ExpiredSignatureError(str(e)) from None
+        except self.exceptions.JOSEError as e:
+            raise JWTError(str(e)) from None
+
+
+class PyJWTBackend:
+    name = "pyjwt"
+
+    def __init__(self):
+        import jwt
+        self.jwt = jwt
+
+    def encode(self, claims, secret):
+        return self.jwt.encode(claims, secret, algorithm=ALGORITHM)
+
+    def decode(self, token, secret):
+        try:
+            return self.jwt.decode(token, secret, algorithms=[ALGORITHM])
+        except self.jwt.ExpiredSignatureError as e:
+            raise ExpiredSignatureError(str(e)) from None
+        except self.jwt.InvalidTokenError as e:
+            raise JWTError(str(e)) from None
+
+
+BACKENDS = {backend.name: backend for backend in (HS256Backend, JoseBackend, PyJWTBackend)}
+
+
+def get_backend(name):
+    if name not in BACKENDS:
+        raise ValueError(f"unknown JWT backend {name!r}, expected one of {list(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+backend = get_backend(JWT_BACKEND)
+
+
+def encode(claims, secret):
+    return backend.encode(claims, secret)
+
+
+def decode(token, secret):
+    return backend.decode(token, secret)
@@ -0,0 +1,207 @@
+from threading import Barrier, Event, Thread
+from time import time
+
+import pytest
+
+import auth
+from auth import TokenManager
+
+
+class Clock:
+    # начинается с настоящего времени: jwt_backend проверяет exp по своим часам
+    def __init__(self):
+        self.now = float(int(time()))
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth, "time", clock)
+    return clock
+
+
+class FakeTokens(TokenManager):
+    """TokenManager, который вместо POST /token выдаёт token-1, token-2, ..."""
+
+    def __init__(self, refresh_margin, clock, lifetime=3600):
+        super().__init__(refresh_margin)
+        self.clock = clock
+        self.lifetime = lifetime
+        self.fetches = 0
+        self.fetched = Event()
+        self.release = Event()
+        self.release.set()
+
+    def _fetch(self, client_id, client_secret, domain):
+        self.release.wait(1)
+        self.fetches += 1
+        token = f"token-{self.fetches}"
+        self.tokens[domain] = (token, int(self.clock()) + self.lifetime)
+        self.fetched.set()
+        return token
+
+
+def test_token_fetched_once_per_domain(clock):
+    tokens = FakeTokens(refresh_margin=300, clock=clock)
+    assert tokens.get("booking_service", "secret", "car:7774") == "token-1"
+    assert tokens.get("booking_service", "secret", "car:7774") == "token-1"
+    assert tokens.get("booking_service", "secret", "office:7775") == "token-2"
+    assert tokens.fetches == 2
+
+
+def test_token_refreshed_in_background_before_expiry(clock):
+    tokens = FakeTokens(refresh_margin=300, clock=clock)
+    tokens.get("booking_service", "secret", "car:7774")
+    tokens.fetched.clear()
+    clock.now += 3600 - 299
+    # пока идёт обновление, запросы получают ещё действующий старый токен
+    assert tokens.get("booking_service", "secret", "car:7774") == "token-1"
+    assert tokens.fetched.wait(1)
+    assert tokens.get("booking_service", "secret", "car:7774") == "token-2"
+    assert tokens.fetches == 2
+
+
+def test_expired_token_fetched_synchronously(clock):
+    tokens = FakeTokens(refresh_margin=300, clock=clock)
+    tokens.get("booking_service", "secret", "car:7774")
+    clock.now += 3600
+    assert tokens.get("booking_service", "secret", "car:7774") == "token-2"
+
+
+def test_concurrent_refresh_of_stale_token_fetches_once(clock):
+    tokens = FakeTokens(refresh_margin=300, clock=clock)
+    stale = tokens.get("booking_service", "secret", "car:7774")
+    tokens.release.clear()
+    start = Barrier(5)
+    results = []
+
+    def refresh():
+        start.wait()
+        results.append(tokens.refresh("booking_service", "secret", "car:7774", stale))
+
+    threads = [Thread(target=refresh) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    tokens.release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["token-2"] * 5
+    assert tokens.fetches == 2
+
+
+# Кэш проверенных сервисных токенов ##########
+
+SECRET = auth.KNOWN_CLIENTS["car_service"]
+
+
+class CountingDecode:
+    def __init__(self):
+        self.calls = 0
+        self.decode = auth.jwt_backend.decode
+
+    def __call__(self, token, secret):
+        self.calls += 1
+        return self.decode(token, secret)
+
+
+@pytest.fixture
+def decode(monkeypatch):
+    decode = CountingDecode()
+    monkeypatch.setattr(auth.jwt_backend, "decode", decode)
+    return decode
+
+
+def service_token(client_id, issued, lifetime=3600):
+    return auth.jwt_backend.encode({"client_id": client_id, "iat": issued, "exp": issued + lifetime}, SECRET)
+
+
+def test_verified_token_decoded_once(clock, decode):
+    cache = auth.VerifiedTokenCache(max_size=10)
+    token = service_token("booking_service", int(clock()))
+    assert cache.decode(token, SECRET)["client_id"] == "booking_service"
+    assert cache.decode(token, SECRET)["client_id"] == "booking_service"
+    assert decode.calls == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_cache_key_includes_secret(clock, decode):
+    cache = auth.VerifiedTokenCache(max_size=10)
+    token = service_token("booking_service", int(clock()))
+    cache.decode(token, SECRET)
+    with pytest.raises(auth.JWTError):
+        cache.decode(token, SECRET + "x")
+
+
+def test_entry_dropped_at_token_exp(clock, decode):
+    cache = auth.VerifiedTokenCache(max_size=10)
+    token = service_token("booking_service", int(clock()), lifetime=60)
+    cache.decode(token, SECRET)
+    clock.now += 59
+    cache.decode(token, SECRET)
+    assert decode.calls == 1
+    clock.now += 1
+    cache.decode(token, SECRET)
+    assert decode.calls == 2
+
+
+def test_least_recently_used_evicted(clock, decode):
+    cache = auth.VerifiedTokenCache(max_size=2)
+    first, second, third = (service_token(f"client_{i}", int(clock())) for i in range(3))
+    cache.decode(first, SECRET)
+    cache.decode(second, SECRET)
+    cache.decode(first, SECRET)
+    cache.decode(third, SECRET)
+    assert cache.stats()["evictions"] == 1
+    cache.decode(first, SECRET)
+    assert decode.calls == 3
+
+
+def test_revoked_client_tokens_rejected(clock, decode):
+    cache = auth.VerifiedTokenCache(max_size=10)
+    old = service_token("booking_service", int(clock()) - 1)
+    other = service_token("office_service", int(clock()) - 1)
+    cache.decode(old, SECRET)
+    cache.decode(other, SECRET)
+    cache.revoke_client("booking_service")
+    # выданный раньше отзыва не принимается даже из кэша, токены других клиентов остаются
+    with pytest.raises(auth.JWTError, match="revoked"):
+        cache.decode(old, SECRET)
+    assert cache.decode(other, SECRET)["client_id"] == "office_service"
+    clock.now += 1
+    fresh = service_token("booking_service", int(clock()))
+    assert cache.decode(fresh, SECRET)["client_id"] == "booking_service"
+    assert cache.stats()["revocations"] == 1
+
+
+@pytest.mark.parametrize("header, details", [
+    (None, "Authorization header missing"),
+    ("Basic abc", "only bearer auth supported"),
+    ("Bearer garbage", "bad token"),
+])
+def test_verify_authorization_errors(header, details):
+    claims, (body, code) = auth.verify_authorization(header, SECRET)
+    assert claims is None and code == 401 and body["error"] == details
+
+
+def test_verify_authorization_accepts_service_token():
+    token, _ = auth.create_jwt_token("booking_service", SECRET)
+    claims, error = auth.verify_authorization(f"Bearer {token}", SECRET)
+    assert error is None and claims["client_id"] == "booking_service"
+
+
+def test_secret_rotation_revokes_cached_verification(clock, decode, monkeypatch):
+    monkeypatch.setitem(auth.KNOWN_CLIENTS, "booking_service", auth.KNOWN_CLIENTS["booking_service"])
+    monkeypatch.setattr(auth, "verified_tokens", auth.VerifiedTokenCache(max_size=10))
+    old = service_token("booking_service", int(clock()) - 1)
+    assert auth.verify_authorization(f"Bearer {old}", SECRET)[1] is None
+
+    auth.set_client_secret("booking_service", "rotated_12345")
+    assert auth.KNOWN_CLIENTS["booking_service"] == "rotated_12345"
+    claims, (body, code) = auth.verify_authorization(f"Bearer {old}", SECRET)
+    assert claims is None and code == 401 and "revoked" in body["details"]
+    clock.now += 1
+    fresh = service_token("booking_service", int(clock()))
+    assert auth.verify_authorization(f"Bearer {fresh}", SECRET)[1] is None
@@ -0,0 +1,95 @@
+import os
+import tempfile
+
+# модуль database подключается к базе при импорте: только к временной, не к temp.db
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+
+import pytest
+
+import auth
+import booking
+import database
+
+
+class Reversals:
+    """Подмена вызова POST /payment/<id>/reverse"""
+
+    def __init__(self, ok=True, during=None):
+        self.ok = ok
+        self.during = during
+        self.calls = 0
+
+    def __call__(self, client_id, secret, method, url, **kwargs):
+        assert method == "POST" and url.endswith("/reverse")
+        self.calls += 1
+        if self.during:
+            self.during()
+        return type("Response", (), {"ok": self.ok, "text": "payment service error"})()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    database.Base.metadata.create_all(database.engine)
+    monkeypatch.setattr(booking, "MINIMAL_MODE", 0)
+    return booking.app.test_client()
+
+
+@pytest.fixture
+def booking_id():
+    with database.Session() as s:
+        car_booking = booking.CarBooking(car_uuid=1, user_id=1, payment_id=5, booking_start=0, booking_end=1,
+                                         start_office=1, end_office=1, status="NEW")
+        s.add(car_booking)
+        s.flush()
+        return car_booking.id
+
+
+def cancel(client, booking_id):
+    token, _ = auth.create_jwt_token("gateway_service", booking.JWT_SECRET)
+    return client.delete(f"/booking/{booking_id}", headers={"Authorization": f"Bearer {token}"})
+
+
+def status(booking_id):
+    with database.Session() as s:
+        return s.get(booking.CarBooking, booking_id).status
+
+
+def test_cancel_reverses_payment_once(client, booking_id, monkeypatch):
+    reversals = Reversals()
+    monkeypatch.setattr(booking, "make_authorized_request", reversals)
+    assert cancel(client, booking_id).status_code == 200
+    assert cancel(client, booking_id).status_code == 400
+    assert reversals.calls == 1
+    assert status(booking_id) == "CANCELLED"
+
+
+def test_concurrent_cancel_does_not_refund_twice(client, booking_id, monkeypatch):
+    # вторая отмена приходит, пока первая ждёт ответа платёжного сервиса
+    second = []
+    reversals = Reversals(during=lambda: second.append(cancel(client, booking_id).status_code))
+    monkeypatch.setattr(booking, "make_authorized_request", reversals)
+    assert cancel(client, booking_id).status_code == 200
+    assert second == [400]
+    assert reversals.calls == 1
+
+
+def test_failed_reversal_restores_booking(client, booking_id, monkeypatch):
+    monkeypatch.setattr(booking, "make_authorized_request", Reversals(ok=False))
+    response = cancel(client, booking_id)
+    assert response.status_code == 500 and response.json["details"] == "payment service error"
+    assert status(booking_id) == "NEW"
+    monkeypatch.setattr(booking, "make_authorized_request", Reversals())
+    assert cancel(client, booking_id).status_code == 200
+
+
+def test_unreachable_payment_service_restores_booking(client, booking_id, monkeypatch):
+    def unreachable(*args, **kwargs):
+        raise booking.RequestException("connection refused")
+
+    monkeypatch.setattr(booking, "make_authorized_request", unreachable)
+    assert cancel(client, booking_id).status_code == 500
+    assert status(booking_id) == "NEW"
+
+
+def test_cancel_unknown_booking(client):
+    assert cancel(client, 10 ** 9).status_code == 404
@@ -0,0 +1,318 @@
+from time import sleep, time
+import os
+import tempfile
+
+# модуль database подключается к базе при импорте: только к временной, не к temp.db
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+
+import pytest
+from sqlalchemy import Column, Index, Integer, Text, event, inspect
+from sqlalchemy.orm import declarative_base
+
+import booking
+import database
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    # новый файл SQLite с теми же настройками, что у основного движка
+    engine = database.create_pooled_engine(f"sqlite:///{tmp_path / 'fresh.db'}", database.PoolMetrics(), 1)
+    event.listen(engine, "connect", database.sqlite_pragmas(read_only=False))
+    event.listen(engine, "begin", database.sqlite_begin("BEGIN IMMEDIATE"))
+    monkeypatch.setattr(database, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def migrations(monkeypatch):
+    monkeypatch.setattr(database, "MIGRATIONS", [])
+    return database.MIGRATIONS
+
+
+def applied_versions(engine):
+    with engine.connect() as connection:
+        return [row[0] for row in connection.exec_driver_sql("SELECT version FROM schema_migrations ORDER BY version")]
+
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_migrations_applied_once_in_version_order(engine, migrations):
+    order = []
+    database.migration(2, "second")(lambda connection: order.append(2))
+    database.migration(1, "first")(lambda connection: order.append(1))
+    assert database.migrate() == [(1, "first"), (2, "second")]
+    assert order == [1, 2]
+    assert database.migrate() == []
+    assert order == [1, 2]
+    assert applied_versions(engine) == [1, 2]
+
+
+def test_duplicate_version_rejected(migrations):
+    database.migration(1, "first")(lambda connection: None)
+    with pytest.raises(ValueError):
+        database.migration(1, "again")(lambda connection: None)
+
+
+def test_failed_migration_rolls_back_the_run(engine, migrations):
+    @database.migration(1, "create table")
+    def create(connection):
+        connection.exec_driver_sql("CREATE TABLE scratch (id INTEGER PRIMARY KEY)")
+
+    @database.migration(2, "broken")
+    def broken(connection):
+        connection.exec_driver_sql("ALTER TABLE missing ADD COLUMN x INTEGER")
+
+    with pytest.raises(Exception):
+        database.migrate()
+    assert "scratch" not in inspect(engine).get_table_names()
+    migrations.pop()
+    assert database.migrate() == [(1, "create table")]
+
+
+def test_add_column_and_indexes_are_idempotent(engine, migrations):
+    Base = declarative_base()
+
+    class Item(Base):
+        __tablename__ = "item"
+        id = Column(Integer, primary_key=True)
+        name = Column(Text, nullable=False, server_default="")
+        __table_args__ = (Index("ix_item_name", "name"),)
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE item (id INTEGER PRIMARY KEY)")
+        connection.exec_driver_sql("INSERT INTO item (id) VALUES (1)")
+
+    @database.migration(1, "item name")
+    def add_name(connection):
+        database.add_column(connection, Item, "name")
+        database.create_indexes(connection, Item)
+
+    database.migrate()
+    with engine.begin() as connection:
+        database.add_column(connection, Item, "name")
+        database.create_indexes(connection, Item)
+        assert connection.exec_driver_sql("SELECT name FROM item WHERE id = 1").scalar() == ""
+    assert index_names(engine, "item") == {"ix_item_name"}
+
+
+def test_booking_schema_on_fresh_file(engine):
+    database.create_schema()
+    assert "ix_car_booking_user_start" in index_names(engine, "car_booking")
+    assert applied_versions(engine) == [1]
+    assert database.create_schema() == []
+
+
+def test_booking_indexes_added_to_existing_database(engine):
+    # база, созданная до появления индексов
+    booking.CarBooking.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_car_booking_user_start")
+    assert database.migrate() == [(1, "car_booking indexes")]
+    assert "ix_car_booking_user_start" in index_names(engine, "car_booking")
+
+
+# Read-your-writes ##########
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_recent_write_expires_after_window(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(database, "monotonic", clock)
+    writes = database.ReadYourWrites(window=5, max_keys=10)
+    assert not writes.wrote_recently("user-1")
+    writes.on_write("user-1")
+    clock.now += 5
+    assert writes.wrote_recently("user-1")
+    assert not writes.wrote_recently("user-2")
+    clock.now += 0.1
+    assert not writes.wrote_recently("user-1")
+    assert "user-1" not in writes.writes
+    assert writes.primary_reads == 1
+
+
+def test_recent_writes_keep_newest_keys():
+    writes = database.ReadYourWrites(window=5, max_keys=2)
+    for key in ("a", "b", "a", "c"):
+        writes.on_write(key)
+    assert list(writes.writes) == ["a", "c"]
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    database.Base.metadata.create_all(database.engine)
+    factories = [lambda: "replica-0", lambda: "replica-1"]
+    monkeypatch.setattr(database, "replica_session_factories", factories)
+    monkeypatch.setattr(database, "recent_writes", database.ReadYourWrites(window=60, max_keys=10))
+    return factories
+
+
+def read_target(user_id, **headers):
+    with booking.app.test_request_context(headers={"user_id": user_id, **headers}):
+        factory = database.read_session_factory_for_request()
+    return factory if factory is database.read_session_factory else factory()
+
+
+def new_booking(user_id):
+    return booking.CarBooking(car_uuid=1, user_id=user_id, payment_id=1, booking_start=0, booking_end=1,
+                              start_office=1, end_office=1, status="NEW")
+
+
+def test_reads_spread_over_replicas(replicas):
+    assert {read_target("1"), read_target("1")} == {"replica-0", "replica-1"}
+
+
+def test_reads_after_write_go_to_primary(replicas):
+    with booking.app.test_request_context(headers={"user_id": "7"}):
+        with database.Session() as s:
+            s.add(new_booking(7))
+    assert read_target("7") is database.read_session_factory
+    # чужие цепочки запросов по-прежнему читают с реплик
+    assert read_target("8") in ("replica-0", "replica-1")
+
+
+def test_bulk_update_counts_as_write(replicas):
+    with booking.app.test_request_context(headers={"user_id": "9"}):
+        with database.Session() as s:
+            s.query(booking.CarBooking).filter(booking.CarBooking.user_id == 9).update(
+                {booking.CarBooking.status: "CANCELLED"}, synchronize_session=False
+            )
+    assert read_target("9") is database.read_session_factory
+
+
+def test_read_only_session_keeps_replicas(replicas):
+    with booking.app.test_request_context(headers={"user_id": "10"}):
+        with database.Session() as s:
+            s.query(booking.CarBooking).all()
+    assert read_target("10") in ("replica-0", "replica-1")
+
+
+def test_failed_write_does_not_pin_primary(replicas):
+    with booking.app.test_request_context(headers={"user_id": "11"}):
+        with pytest.raises(RuntimeError):
+            with database.Session() as s:
+                s.add(new_booking(11))
+                s.flush()
+                raise RuntimeError("handler failed")
+    assert read_target("11") in ("replica-0", "replica-1")
+
+
+def test_write_in_another_process_reads_primary(replicas):
+    # этот процесс записи не видел, о ней говорит только метка, пришедшая с цепочкой
+    assert read_target("12", **{"X-Last-Write": f"{time() - 1:.3f}"}) is database.read_session_factory
+    assert read_target("12", **{"X-Last-Write": f"{time() - 61:.3f}"}) in ("replica-0", "replica-1")
+    assert read_target("12", **{"X-Last-Write": "garbage"}) in ("replica-0", "replica-1")
+
+
+def test_write_response_carries_marker(replicas):
+    from flask import Flask
+
+    app = Flask("read_your_writes")
+
+    @app.route("/write", methods=["POST"])
+    def write():
+        with database.Session() as s:
+            s.add(new_booking(13))
+        with database.Session() as s:
+            s.add(new_booking(13))
+        return {}
+
+    @app.route("/read")
+    def read():
+        with database.ReadSession() as s:
+            s.query(booking.CarBooking).all()
+        return {}
+
+    client = app.test_client()
+    before = time()
+    last_write = client.post("/write").headers.get_all("X-Last-Write")
+    assert len(last_write) == 1 and before <= float(last_write[0]) <= time()
+    assert "X-Last-Write" not in client.get("/read").headers
+
+
+# Учёт SQL на запрос ##########
+
+def test_statement_shape_ignores_literals_and_list_length():
+    assert database.statement_shape("SELECT * FROM t WHERE id = 42 AND name = 'it''s'") == \
+        "SELECT * FROM t WHERE id = ? AND name = ?"
+    assert database.statement_shape("SELECT *\n  FROM t WHERE id IN (?, ?, ?)") == \
+        database.statement_shape("SELECT * FROM t WHERE id IN (?, ?)") == "SELECT * FROM t WHERE id IN (...)"
+    assert database.statement_shape("SELECT * FROM t WHERE id IN (%(id_1)s, %(id_2)s)") == \
+        "SELECT * FROM t WHERE id IN (...)"
+    assert database.statement_shape("SELECT * FROM t2 WHERE id = ?") == "SELECT * FROM t2 WHERE id = ?"
+
+
+class LogRecorder:
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, event, **fields):
+        self.warnings.append((event, fields))
+
+    def request(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def sql_app(monkeypatch):
+    from flask import Flask
+
+    database.Base.metadata.create_all(database.engine)
+    monkeypatch.setattr(database, "log", LogRecorder())
+    app = Flask("sql_accounting")
+    database.instrument(app)
+
+    @app.route("/one-by-one")
+    def one_by_one():
+        with database.ReadSession() as s:
+            for user_id in range(3):
+                s.query(booking.CarBooking).filter(booking.CarBooking.user_id == user_id).all()
+        return {}
+
+    @app.route("/batched")
+    def batched():
+        with database.ReadSession() as s:
+            s.query(booking.CarBooking).filter(booking.CarBooking.user_id.in_([0, 1, 2])).all()
+        return {}
+
+    @app.route("/idle")
+    def idle():
+        with database.Session() as s:
+            s.query(booking.CarBooking).all()
+            # здесь обработчик ходил бы по сети, держа транзакцию
+            sleep(0.06)
+            s.query(booking.CarBooking).filter(booking.CarBooking.user_id == 1).all()
+        return {}
+
+    return app
+
+
+def test_repeated_statement_reported(sql_app):
+    response = sql_app.test_client().get("/one-by-one")
+    assert 'desc="3 queries' in response.headers["Server-Timing"]
+    [(event, fields)] = database.log.warnings
+    assert event == "sql pattern" and fields["endpoint"] == "one_by_one"
+    [repeated] = fields["repeated"]
+    assert repeated["count"] == 3 and "car_booking.user_id = ?" in repeated["statement"]
+
+
+def test_single_statement_not_reported(sql_app):
+    response = sql_app.test_client().get("/batched")
+    assert 'desc="1 queries' in response.headers["Server-Timing"]
+    assert database.log.warnings == []
+
+
+def test_idle_transaction_reported(sql_app, monkeypatch):
+    monkeypatch.setattr(database, "SQL_IDLE_IN_TRANSACTION", 0.05)
+    sql_app.test_client().get("/idle")
+    [(event, fields)] = database.log.warnings
+    assert fields["repeated"] == []
+    assert fields["idle_in_transaction"] and fields["idle_in_transaction"][0] >= 0.05
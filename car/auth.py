@@ -1,16 +1,39 @@
 from base64 import b64encode, b64decode
+from collections import OrderedDict
 from functools import wraps
 from urllib.parse import urlparse
-from time import time
+from time import sleep, time
 from hashlib import sha224
-from functools import wraps
-from requests import request
+from http.cookiejar import DefaultCookiePolicy
+from threading import Lock, Thread
+from requests import Session, RequestException
+from requests.adapters import HTTPAdapter
+import os
+import random
 
 from flask import request as flask_request, _request_ctx_stack
-from jose import jwt
-from jose.exceptions import JWTError
+
+from jwt_backend import JWTError
+import jwt_backend
+import logger
 
 TOKEN_EXPIRE = 60 * 60 * 1  # 1 hour
+# За сколько секунд до exp сервисный токен обновляется в фоне
+TOKEN_REFRESH_MARGIN = int(os.environ.get("TOKEN_REFRESH_MARGIN", 5 * 60))
+# Сколько проверенных сервисных токенов держать в памяти
+VERIFIED_TOKEN_CACHE_SIZE = int(os.environ.get("VERIFIED_TOKEN_CACHE_SIZE", 1024))
+
+# Межсервисные вызовы: keep-alive соединения на каждый домен, таймауты (connect, read)
+# и SERVICE_RETRIES повторов со случайной паузой для методов без побочных эффектов
+SERVICE_POOL_SIZE = int(os.environ.get("SERVICE_POOL_SIZE", 20))
+SERVICE_CONNECT_TIMEOUT = float(os.environ.get("SERVICE_CONNECT_TIMEOUT", 2))
+SERVICE_READ_TIMEOUT = float(os.environ.get("SERVICE_READ_TIMEOUT", 10))
+SERVICE_RETRIES = int(os.environ.get("SERVICE_RETRIES", 2))
+SERVICE_RETRY_BACKOFF = float(os.environ.get("SERVICE_RETRY_BACKOFF", 0.05))
+# PUT и DELETE здесь не повторяются: PUT /offices/cars/... добавляет запись, а не заменяет
+RETRY_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+log = logger.get("auth")
 
 KNOWN_CLIENTS = {
     "gateway_service": "gateway_12345",
@@ -21,30 +44,108 @@ KNOWN_CLIENTS = {
     "statistics_service": "statistics_12345"
 }
 
-current_token = {}
-
 
 def create_jwt_token(client_id, jwt_secret):
-    expire = int(time()) + TOKEN_EXPIRE
-    token = jwt.encode({'client_id': client_id, 'exp': expire}, jwt_secret, algorithm='HS256')
+    issued = int(time())
+    expire = issued + TOKEN_EXPIRE
+    token = jwt_backend.encode({'client_id': client_id, 'iat': issued, 'exp': expire}, jwt_secret)
     return token, expire
 
 
+class VerifiedTokenCache:
+    """LRU проверенных сервисных токенов -> claims, запись живёт до exp токена.
+
+    Один и тот же токен вызывающий сервис шлёт весь час его жизни,
+    так что HMAC проверяется один раз на токен, а не на каждый запрос
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # (jwt_secret, token) -> (exp, claims)
+        self.revoked = {}  # client_id -> токены, выданные раньше, не принимаются
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revocations = 0
+
+    def decode(self, token, jwt_secret):
+        key = (jwt_secret, token)
+        now = time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+            self.misses += 1
+
+        claims = jwt_backend.decode(token, jwt_secret)
+        revoked_at = self.revoked.get(claims.get("client_id"))
+        if revoked_at is not None and claims.get("iat", 0) < revoked_at:
+            raise JWTError("token revoked")
+
+        with self.lock:
+            self.entries[key] = (claims.get("exp", now + TOKEN_EXPIRE), claims)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return claims
+
+    def revoke_client(self, client_id):
+        # iat в целых секундах: токен, выданный в ту же секунду, что и отзыв, остаётся в силе
+        with self.lock:
+            self.revoked[client_id] = int(time())
+            for key in [key for key, (_, claims) in self.entries.items() if claims.get("client_id") == client_id]:
+                del self.entries[key]
+            self.revocations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "revocations": self.revocations,
+            }
+
+
+verified_tokens = VerifiedTokenCache(VERIFIED_TOKEN_CACHE_SIZE)
+
+
+def set_client_secret(client_id, client_secret):
+    # Единственный способ сменить секрет клиента: выданные ему раньше токены перестают
+    # приниматься, даже если их проверка уже лежит в verified_tokens, а новый токен
+    # он получит через /token уже с новым секретом
+    KNOWN_CLIENTS[client_id] = client_secret
+    verified_tokens.revoke_client(client_id)
+
+
+def verify_authorization(auth_data, jwt_secret):
+    # (claims, None) или (None, (ошибка, код))
+    if not auth_data:
+        return None, ({"error": "Authorization header missing"}, 401)
+    if not auth_data.lower().startswith("bearer"):
+        return None, ({"error": "only bearer auth supported"}, 401)
+    auth_data = auth_data[len("bearer"):].strip()
+
+    try:
+        return verified_tokens.decode(auth_data, jwt_secret), None
+    except JWTError as e:
+        return None, ({"error": "bad token", "details": str(e)}, 401)
+
+
 def requires_auth(jwt_secret):
     def _requires_auth(f):
         @wraps(f)
         def _func(*args, **kwargs):
-            auth_data = flask_request.headers.get("Authorization")
-            if not auth_data:
-                return {"error": "Authorization header missing"}, 401
-            if not auth_data.lower().startswith("bearer"):
-                return {"error": "only bearer auth supported"}, 401
-            auth_data = auth_data[len("bearer"):].strip()
-
-            try:
-                jwt_claims = jwt.decode(auth_data, jwt_secret, algorithms=['HS256'])
-            except JWTError as e:
-                return {"error": "bad token", "details": str(e)}, 401
+            jwt_claims, error = verify_authorization(flask_request.headers.get("Authorization"), jwt_secret)
+            if error:
+                return error
 
             _request_ctx_stack.top.jwt_claims = jwt_claims
             return f(*args, **kwargs)
@@ -52,6 +153,23 @@ def requires_auth(jwt_secret):
     return _requires_auth
 
 
+def requires_auth_async(jwt_secret):
+    # то же для обработчиков Starlette (async_*.py), claims - в request.state.jwt_claims
+    from starlette.responses import JSONResponse
+
+    def _requires_auth(f):
+        @wraps(f)
+        async def _func(request):
+            jwt_claims, error = verify_authorization(request.headers.get("Authorization"), jwt_secret)
+            if error:
+                return JSONResponse(*error)
+
+            request.state.jwt_claims = jwt_claims
+            return await f(request)
+        return _func
+    return _requires_auth
+
+
 def check_for_admin(f):
     @wraps(f)
     def _inner(*args, **kwargs):
@@ -73,25 +191,169 @@ def check_for_service(f):
     return _inner
 
 
-def authorized_request(client_id, client_secret, *args, **kwargs):
-    global current_token
+class ServiceClient:
+    """Замена requests.request() для вызовов между сервисами: у каждого домена
+    своя Session с пулом соединений, по умолчанию таймаут (connect, read)"""
+
+    def __init__(self, pool_size, timeout, retries, backoff):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.sessions = {}
+        self.counters = {}
+        self.lock = Lock()
+
+    def _session(self, domain):
+        session = self.sessions.get(domain)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(domain)
+                if session is None:
+                    session = Session()
+                    # cookie ответов не должны уходить в чужие запросы
+                    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                    self.counters[domain] = {"requests": 0, "retries": 0, "errors": 0, "in_flight": 0}
+                    self.sessions[domain] = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        domain = urlparse(url).netloc
+        session = self._session(domain)
+        counters = self.counters[domain]
+        kwargs.setdefault("timeout", self.timeout)
+        tries = 1 + self.retries if method.upper() in RETRY_METHODS else 1
+        for attempt in range(tries):
+            with self.lock:
+                counters["requests"] += 1
+                counters["retries"] += attempt > 0
+                counters["in_flight"] += 1
+            try:
+                return session.request(method, url, **kwargs)
+            except RequestException as e:
+                with self.lock:
+                    counters["errors"] += 1
+                if attempt == tries - 1:
+                    raise
+                log.warning("service request retry", method=method, url=url, attempt=attempt + 1, error=str(e))
+                # full jitter: повторы разных потоков не приходят пачкой
+                sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            finally:
+                with self.lock:
+                    counters["in_flight"] -= 1
+
+    def stats(self):
+        result = {}
+        with self.lock:
+            sessions = list(self.sessions.items())
+            counters = {domain: dict(c) for domain, c in self.counters.items()}
+        for domain, session in sessions:
+            pools = session.get_adapter("http://").poolmanager.pools
+            pools = [pools[key] for key in pools.keys()]
+            result[domain] = {
+                **counters[domain],
+                "pool_size": self.pool_size,
+                "utilization": round(counters[domain]["in_flight"] / self.pool_size, 3),
+                "connections_opened": sum(pool.num_connections for pool in pools),
+                # очередь пула заполнена None до pool_size, живые соединения - остальное
+                "idle_connections": sum(conn is not None for pool in pools if pool.pool for conn in list(pool.pool.queue)),
+            }
+        return result
+
+
+service_client = ServiceClient(
+    SERVICE_POOL_SIZE, (SERVICE_CONNECT_TIMEOUT, SERVICE_READ_TIMEOUT), SERVICE_RETRIES, SERVICE_RETRY_BACKOFF
+)
+
+
+class TokenManager:
+    """Сервисные токены по доменам вместе с expire из ответа /token.
 
+    За refresh_margin секунд до истечения токен обновляет фоновый поток, а запросы
+    идут со старым, так что в обычном режиме никто не ловит 401. Обновление одного
+    домена выполняет один поток, остальные ждут его результат
+    """
+
+    def __init__(self, refresh_margin):
+        self.refresh_margin = refresh_margin
+        self.tokens = {}  # domain -> (token, expire)
+        self.domain_locks = {}
+        self.refreshing = set()
+        self.lock = Lock()
+
+    def _domain_lock(self, domain):
+        with self.lock:
+            return self.domain_locks.setdefault(domain, Lock())
+
+    def _fetch(self, client_id, client_secret, domain):
+        credentials = {"client_id": client_id, "client_secret": client_secret}
+        token_response = service_client.request("POST", f"http://{domain}/token", json=credentials)
+        body = token_response.json()
+        token = body["token"]
+        self.tokens[domain] = (token, body.get("expire") or int(time()) + TOKEN_EXPIRE)
+        return token
+
+    def get(self, client_id, client_secret, domain):
+        current = self.tokens.get(domain)
+        now = time()
+        if current is None or current[1] <= now:
+            return self.refresh(client_id, client_secret, domain, current and current[0])
+        if current[1] - now < self.refresh_margin:
+            self._refresh_in_background(client_id, client_secret, domain)
+        return current[0]
+
+    def refresh(self, client_id, client_secret, domain, stale_token=None):
+        # stale_token - токен, с которым пришёл 401 (или истёкший);
+        # если его уже заменил другой поток, второй раз в /token не ходим
+        with self._domain_lock(domain):
+            current = self.tokens.get(domain)
+            if current is not None and current[0] != stale_token and current[1] > time():
+                return current[0]
+            log.info("re-auth", domain=domain)
+            return self._fetch(client_id, client_secret, domain)
+
+    def _refresh_in_background(self, client_id, client_secret, domain):
+        with self.lock:
+            if domain in self.refreshing:
+                return
+            self.refreshing.add(domain)
+        Thread(target=self._background_refresh, args=(client_id, client_secret, domain), daemon=True).start()
+
+    def _background_refresh(self, client_id, client_secret, domain):
+        try:
+            with self._domain_lock(domain):
+                current = self.tokens.get(domain)
+                if current is not None and current[1] - time() >= self.refresh_margin:
+                    return
+                log.info("token refresh", domain=domain)
+                self._fetch(client_id, client_secret, domain)
+        except (RequestException, ValueError, KeyError) as e:
+            # старый токен ещё действует, следующий запрос попробует снова
+            log.warning("token refresh failed", domain=domain, error=str(e))
+        finally:
+            with self.lock:
+                self.refreshing.discard(domain)
+
+
+service_tokens = TokenManager(TOKEN_REFRESH_MARGIN)
+
+
+def authorized_request(client_id, client_secret, *args, **kwargs):
     domain = urlparse(args[1]).netloc
+    token = service_tokens.get(client_id, client_secret, domain)
 
     kwargs["headers"] = {
         **kwargs.get('headers', {}),
-        "Authorization": f"Bearer {current_token.get(domain)}",
+        "Authorization": f"Bearer {token}",
         "is_service": "1",
     }
 
-    result = request(*args, **kwargs)
+    result = service_client.request(*args, **kwargs)
     if result.status_code != 401:
         return result
 
-    print("re-auth in domain", domain)
-    credentials = {"client_id": client_id, "client_secret": client_secret}
-    token_response = request("POST", f"http://{domain}/token", json=credentials)
-    current_token[domain] = token_response.json()["token"]
-
-    kwargs["headers"]["Authorization"] = f"Bearer {current_token.get(domain)}"
-    return request(*args, **kwargs)
+    # токен отозван раньше срока (например, у сервиса сменился секрет)
+    token = service_tokens.refresh(client_id, client_secret, domain, token)
+    kwargs["headers"]["Authorization"] = f"Bearer {token}"
+    return service_client.request(*args, **kwargs)
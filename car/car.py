@@ -9,10 +9,14 @@ from sqlalchemy import Column, Integer, Text
 
 import database
 import auth
+import logger
+
+log = logger.setup("car")
 
 # Экземпляр приложения
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
+database.instrument(app)
 JWT_SECRET = auth.KNOWN_CLIENTS["car_service"]
 
 
@@ -35,11 +39,25 @@ def get_token():
     return {"token": token, "expire": expire}, 200
 
 
+@app.route('/token/cache', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_token_cache_stats():
+    return auth.verified_tokens.stats(), 200
+
+
+@app.route('/db/stats', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_db_stats():
+    return database.pool_stats(), 200
+
+
 @app.route('/cars', methods=["GET"])
 @auth.requires_auth(JWT_SECRET)
 def get_cars_list():
     result = []
-    with database.Session() as s:
+    with database.ReadSession() as s:
         cars = s.query(Car).all()
         for car in cars:
             result.append({
@@ -55,7 +73,7 @@ def get_cars_list():
 @app.route('/cars/<string:car_uuid>', methods=["GET"])
 @auth.requires_auth(JWT_SECRET)
 def get_car(car_uuid):
-    with database.Session() as s:
+    with database.ReadSession() as s:
         car = s.query(Car).filter(Car.uuid == car_uuid).one_or_none()
         if not car:
             return {"error": "car not found"}, 404
@@ -3,11 +3,15 @@ from collections import defaultdict
 import os
 
 from requests import request, RequestException
-from flask import Flask, redirect
+from flask import Flask, Response, redirect
 from flask import request as flask_request, jsonify, render_template
 from flask_cors import CORS, cross_origin
 from sqlalchemy import Column, Integer, Text
 
+import logger
+
+
+log = logger.setup("front")
 
 # Экземпляр приложения
 app = Flask(__name__, template_folder='template')
@@ -27,6 +31,7 @@ context = {
     "cars_list_endpoint": f"/gateway_proxy/cars",
     "book_endpoint": f"/gateway_proxy/booking",
     "offices_endpoint": f"/gateway_proxy/offices",
+    "events_endpoint": f"/events",
 }
 
 
@@ -35,6 +40,23 @@ def strip_headers(headers):
     return {k: v for k, v in headers.items() if k in allowed_headers}
 
 
+def gateway_aggregate(**paths):
+    headers = strip_headers(flask_request.headers)
+    headers.pop("Content-Type", None)
+    response = request(
+        "POST", f"https://{GATEWAY_URL}/aggregate",
+        json={"requests": {name: {"path": path} for name, path in paths.items()}},
+        headers=headers,
+    )
+    if not response.ok:
+        raise RequestException(f"status_code={response.status_code}")
+    return response.json()["responses"]
+
+
+def part_ok(part):
+    return 200 <= part.get("status", 0) < 300 and "body" in part
+
+
 def context_with_user():
     return {
         **context,
@@ -126,18 +148,39 @@ def car_page(car_uuid):
     'OPTIONS', 'HEAD', 'GET', 'POST', 'DELETE', 'PUT', 'PATCH'
 ])
 def gateway_proxy(url):
-    print("headers:", strip_headers(flask_request.headers))
+    log.request(flask_request.path, "proxy to gateway", method=flask_request.method, has_token="token" in flask_request.cookies)
     resp = request(flask_request.method, f"http://{GATEWAY_URL}/{url}",
                    json=flask_request.json,
                    headers=strip_headers(flask_request.headers))
     return resp.text, resp.status_code, resp.headers.items()
 
 
+@app.route('/events', methods=["GET"])
+def availability_events():
+    # SSE из гейтвея: вместо того чтобы обновлять страницу, браузер ждёт изменений доступности
+    headers = strip_headers(flask_request.headers)
+    if flask_request.headers.get("Last-Event-ID"):
+        headers["Last-Event-ID"] = flask_request.headers.get("Last-Event-ID")
+    try:
+        resp = request("GET", f"http://{GATEWAY_URL}/events", params=flask_request.args,
+                       headers=headers, stream=True)
+    except RequestException as e:
+        return {"error": "gateway is unavailable", "details": str(e)}, 503
+    if not resp.ok:
+        return resp.text, resp.status_code
+
+    def stream():
+        # read1 отдаёт то, что уже пришло, не дожидаясь полного буфера
+        with resp:
+            yield from iter(lambda: resp.raw.read1(64 * 1024), b"")
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @app.route('/session_proxy/<path:url>', methods=[
     'OPTIONS', 'HEAD', 'GET', 'POST', 'DELETE', 'PUT', 'PATCH'
 ])
 def auth_proxy(url):
-    print("headers:", strip_headers(flask_request.headers))
+    log.request(flask_request.path, "proxy to session", method=flask_request.method)
     resp = request(flask_request.method, f"http://{SESSION_URL}/{url}",
                    json=flask_request.json,
                    headers=strip_headers(flask_request.headers))
@@ -196,26 +239,22 @@ def book_page():
     office_id = int(flask_request.args.get("office_id"))
     car_uuid = flask_request.args.get("car_uuid")
 
+    try:
+        responses = gateway_aggregate(car=f"/cars/{car_uuid}", offices="/offices")
+    except RequestException:
+        responses = {}
+    car_response = responses.get("car", {})
+    office_response = responses.get("offices", {})
+
     car_name = None
-    car_error = False
-    car_response = request(
-        "GET", f"https://{GATEWAY_URL}/cars/{car_uuid}",
-        headers=strip_headers(flask_request.headers)
-    )
-    if not car_response.ok:
-        car_error = True
-    else:
-        car_name = f"{car_response.json()['brand']} - {car_response.json()['model']}"
+    car_error = not part_ok(car_response)
+    if not car_error:
+        car_name = f"{car_response['body']['brand']} - {car_response['body']['model']}"
 
     office_name = None
-    office_error = False
-    office_response = request(
-        "GET", f"https://{GATEWAY_URL}/offices", headers=strip_headers(flask_request.headers)
-    )
-    if not office_response.ok:
-        office_error = True
-    else:
-        for office in office_response.json():
+    office_error = not part_ok(office_response)
+    if not office_error:
+        for office in office_response["body"]:
             if office["id"] == office_id:
                 office_name = office["location"]
 
@@ -226,7 +265,7 @@ def book_page():
         params_info={"office_id": office_id, "car_uuid": car_uuid},
         office_error=office_error,
         car_error=car_error,
-        office_data=office_response.json() if office_response.ok else None,
+        office_data=office_response["body"] if not office_error else None,
         current_office_name=office_name,
         current_car_name=car_name,
     ), 200
@@ -265,48 +304,39 @@ def my_books():
 
 @app.route('/stats', methods=["GET"])
 def stats():
+    # Все четыре запроса уходят одним POST /aggregate, гейтвей выполняет их параллельно
     try:
-        stats_by_offices_response = request(
-            "GET", f"https://{GATEWAY_URL}/reports/booking-by-offices",
-            headers=strip_headers(flask_request.headers)
-        )
-        if not stats_by_offices_response.ok:
-            raise RequestException(f"status_code={stats_by_offices_response.status_code}")
-
-        stats_by_uuids_response = request(
-            "GET", f"https://{GATEWAY_URL}/reports/booking-by-uuids",
-            headers=strip_headers(flask_request.headers)
+        responses = gateway_aggregate(
+            by_offices="/reports/booking-by-offices",
+            by_uuids="/reports/booking-by-uuids",
+            cars="/cars",
+            offices="/offices",
         )
-        if not stats_by_offices_response.ok:
-            raise RequestException(f"status_code={stats_by_offices_response.status_code}")
+        for name in ("by_offices", "by_uuids"):
+            if not part_ok(responses[name]):
+                raise RequestException(f"status_code={responses[name]['status']}")
     except RequestException as e:
         return "stats service unavailable: " + str(e), 200
 
-    office_stats = stats_by_offices_response.json()
-    car_stats = stats_by_uuids_response.json()
+    office_stats = responses["by_offices"]["body"]
+    car_stats = responses["by_uuids"]["body"]
 
     message = ""
-    car_service_response = request(
-        "GET", f"https://{GATEWAY_URL}/cars", headers=strip_headers(flask_request.headers)
-    )
-    if not car_service_response.ok:
+    if not part_ok(responses["cars"]):
         message = "Недоступен сервис машин, поэтому вместо статистики по моделям" \
                   " - статистика по уникальным машинам"
     else:
         res = defaultdict(lambda: 0)
-        models = {c["uuid"]: c["model"] for c in car_service_response.json()}
+        models = {c["uuid"]: c["model"] for c in responses["cars"]["body"]}
         for uuid, count in car_stats.items():
             res[models[uuid]] += count
         car_stats = res
 
 
-    office_service_response = request(
-        "GET", f"https://{GATEWAY_URL}/offices", headers=strip_headers(flask_request.headers)
-    )
-    if not office_service_response.ok:
+    if not part_ok(responses["offices"]):
         message += "\nНедоступен сервис офисов, вместо расположений офисов будут отображены их id"
     else:
-        offices = {o["id"]: o["location"] for o in office_service_response.json()}
+        offices = {o["id"]: o["location"] for o in responses["offices"]["body"]}
         office_stats = {offices[int(k)]: v for k, v in office_stats.items() if offices.get(int(k))}
 
     return render_template(
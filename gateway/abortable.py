@@ -0,0 +1,84 @@
+from threading import Lock, local
+import socket
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool
+
+# Запрос в потоке не прервать, но можно закрыть его сокет: блокирующее чтение сразу
+# завершится ошибкой. Так хеджирование гасит проигравший запрос
+
+
+class Attempt:
+    """Один запрос к апстриму, который другой поток может оборвать через abort()"""
+
+    def __init__(self):
+        self.conn = None
+        self.aborted = False
+        self.lock = Lock()
+
+    def attach(self, conn):
+        with self.lock:
+            self.conn = conn
+            conn.attempt = self
+            if self.aborted:
+                _shutdown(conn)
+
+    def detach(self, conn):
+        with self.lock:
+            if self.conn is conn:
+                self.conn = None
+            conn.attempt = None
+
+    def abort(self):
+        with self.lock:
+            self.aborted = True
+            if self.conn is not None:
+                _shutdown(self.conn)
+
+
+def _shutdown(conn):
+    sock = getattr(conn, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+_current = local()
+
+
+def current():
+    return getattr(_current, "attempt", None)
+
+
+def run(attempt, fn, *args, **kwargs):
+    # соединения, взятые из пула внутри fn, привязываются к attempt
+    previous = current()
+    _current.attempt = attempt
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _current.attempt = previous
+
+
+class AbortablePool(HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        attempt = current()
+        if attempt is not None:
+            attempt.attach(conn)
+        return conn
+
+    def _put_conn(self, conn):
+        # вернувшееся в пул соединение достанется другому запросу, обрывать его уже нельзя
+        attempt = getattr(conn, "attempt", None)
+        if attempt is not None:
+            attempt.detach(conn)
+        super()._put_conn(conn)
+
+
+class AbortableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {**self.poolmanager.pool_classes_by_scheme, "http": AbortablePool}
@@ -0,0 +1,45 @@
+import json
+
+from compression import decode_body, header
+from config import AGGREGATE_MAX_PARTS
+
+# Тело запроса /aggregate:
+#   {"requests": {"cars": {"path": "/cars"}, "offices": "/offices"}}
+# Ответ:
+#   {"responses": {"cars": {"status": 200, "body": [...]},
+#                  "offices": {"status": 503, "error": "...", "details": "..."}}}
+
+
+class AggregateError(ValueError):
+    pass
+
+
+def parse_parts(payload):
+    if not isinstance(payload, dict) or not isinstance(payload.get("requests"), dict):
+        raise AggregateError('expected {"requests": {"<name>": {"path": "/..."}}}')
+    if len(payload["requests"]) > AGGREGATE_MAX_PARTS:
+        raise AggregateError(f"no more than {AGGREGATE_MAX_PARTS} requests allowed")
+
+    parts = {}
+    for name, spec in payload["requests"].items():
+        if isinstance(spec, str):
+            spec = {"path": spec}
+        if not isinstance(spec, dict) or not isinstance(spec.get("path"), str):
+            raise AggregateError(f"request {name!r} has no path")
+        path, _, query = spec["path"].lstrip("/").partition("?")
+        parts[name] = (str(spec.get("method", "GET")).upper(), path, query)
+    return parts
+
+
+def part_error(status, error, details=""):
+    return {"status": status, "error": error, "details": details}
+
+
+def part_result(status, headers, body):
+    body = decode_body(headers, body)
+    if "json" in (header(headers, "Content-Type") or ""):
+        try:
+            return {"status": status, "body": json.loads(body)}
+        except ValueError:
+            pass
+    return {"status": status, "text": body.decode("utf-8", "replace")}
@@ -0,0 +1,586 @@
+from contextlib import asynccontextmanager
+import asyncio
+from functools import partial
+from time import perf_counter
+import json
+import os
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from config import CLIENT_ID, JWT_SECRET, UPSTREAM_POOL_SIZE, UPSTREAM_KEEPALIVE, UPSTREAM_ACCEPT_ENCODING
+from config import HEALTH_CHECK_INTERVAL, HEALTH_CHECK_PATH, HEALTH_CHECK_TIMEOUT
+from config import EVENTS_UPSTREAM_PATH, EVENTS_QUEUE_SIZE, EVENTS_HEARTBEAT, EVENTS_READ_TIMEOUT, EVENTS_MAX_BACKOFF
+from config import STREAM_PROXY, STREAM_CHUNK_SIZE, STREAM_BODY_BUFFER
+from jwt_backend import JWTError
+from singleflight import AsyncSingleFlight
+import aggregation
+import compression
+import events
+import logger
+import proxy
+
+# Асинхронный режим гейтвея (ASGI): запускается как `python3 async_gateway.py`
+# или `uvicorn async_gateway:app`. Поведение совпадает с gateway.py
+
+log = logger.setup("gateway")
+
+PROXY_METHODS = ['GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'PATCH', 'OPTIONS']
+
+current_token = {}
+upstream_clients = {}
+coalescer = AsyncSingleFlight()
+event_readers = []
+proxy.register_stats("gateway_coalescing", "Single-flight upstream calls and saved calls", coalescer.stats)
+
+
+def create_upstream_client():
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_POOL_SIZE,
+            max_keepalive_connections=UPSTREAM_KEEPALIVE,
+        ),
+        timeout=None,
+        headers={"Accept-Encoding": UPSTREAM_ACCEPT_ENCODING},
+    )
+
+
+def upstream_client(domain):
+    client = upstream_clients.get(domain)
+    if client is None:
+        client = upstream_clients[domain] = create_upstream_client()
+    return client
+
+
+async def refresh_token(client, domain, address):
+    # токен общий для всех реплик сервиса
+    log.info("re-auth", domain=domain, replica=address)
+    proxy.reauth_total.inc(domain)
+    credentials = {"client_id": CLIENT_ID, "client_secret": JWT_SECRET}
+    token_response = await client.request("POST", f"http://{address}/token", json=credentials)
+    current_token[domain] = token_response.json()["token"]
+
+
+async def authorized_request(domain, address, method, path, stream=False, **kwargs):
+    client = upstream_client(domain)
+    url = f"http://{address}{path}"
+
+    # Потоковое тело нельзя отправить второй раз, поэтому токен получаем заранее
+    replayable = proxy.is_replayable(kwargs.get("content"))
+    if not replayable and domain not in current_token:
+        await refresh_token(client, domain, address)
+
+    kwargs["headers"] = {
+        **kwargs.get('headers', {}),
+        "Authorization": f"Bearer {current_token.get(domain)}"
+    }
+
+    result = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+    if result.status_code != 401:
+        return result
+
+    await refresh_token(client, domain, address)
+    if not replayable:
+        return result
+    await result.aclose()
+
+    kwargs["headers"]["Authorization"] = f"Bearer {current_token.get(domain)}"
+    return await client.send(client.build_request(method, url, **kwargs), stream=stream)
+
+
+async def guarded_request(policy, method, path, **kwargs):
+    guard = proxy.upstream_guards.get(policy.service)
+    guard.enter()
+    pool = proxy.balancer.get(policy.service)
+    replica = pool.acquire()
+    started = perf_counter()
+    try:
+        result = await authorized_request(
+            policy.service, replica.address, method, path, timeout=policy.timeout, **kwargs
+        )
+    except asyncio.CancelledError:
+        # клиент ушёл или хедж проиграл: ни успехом, ни ошибкой реплики это не считается
+        pool.release(replica, failed=None)
+        guard.exit(failed=None)
+        raise
+    except Exception as e:
+        # реплику выводит из ротации только невозможность соединиться
+        pool.release(replica, failed=isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)), error=e)
+        guard.exit(failed=True)
+        proxy.observe_upstream(policy.service, "error", started)
+        raise
+    # потоковый ответ ещё читается, но заголовки получены и реплика ответила
+    pool.release(replica)
+    guard.exit(failed=proxy.is_upstream_failure(result.status_code))
+    proxy.observe_upstream(policy.service, result.status_code, started)
+    return result
+
+
+async def proxy_request(policy, method, path, **kwargs):
+    tries = proxy.attempts(policy, method, kwargs.get("content"))
+    for attempt in range(tries):
+        try:
+            return await guarded_request(policy, method, path, **kwargs)
+        except httpx.TransportError as e:
+            if attempt == tries - 1:
+                raise
+            log.warning("upstream retry", method=method, path=path, attempt=attempt + 1, error=str(e))
+
+
+async def read_body(result, timeout, raw):
+    # Тело читается целиком, но не дольше timeout маршрута: апстрим, который шлёт данные
+    # понемногу, но бесконечно, иначе занял бы запрос навсегда
+    try:
+        if proxy.is_event_stream(result.headers):
+            raise httpx.RemoteProtocolError("upstream returned an event stream to a buffered GET", request=result.request)
+        chunks = result.aiter_raw() if raw else result.aiter_bytes()
+        async with asyncio.timeout(max(timeout, 0)):
+            return b"".join([chunk async for chunk in chunks])
+    except TimeoutError:
+        raise httpx.ReadTimeout("upstream response body was not read in time", request=result.request) from None
+    finally:
+        await result.aclose()
+
+
+async def read_upstream(policy, path, headers):
+    started = perf_counter()
+    result = await proxy_request(policy, "GET", path, headers=headers, stream=True)
+    # в потоковом режиме сжатое апстримом тело не распаковывается
+    body = await read_body(result, policy.timeout - (perf_counter() - started), raw=STREAM_PROXY)
+    if STREAM_PROXY:
+        response_headers = proxy.response_headers(result.headers)
+    else:
+        response_headers = proxy.decoded_response_headers(result.headers)
+    if policy.hedge:
+        proxy.hedger.observe(policy, perf_counter() - started)
+    return result.status_code, response_headers, body
+
+
+async def hedged_read(policy, path, headers):
+    if not policy.hedge:
+        return await read_upstream(policy, path, headers)
+    delay = proxy.hedger.delay(policy)
+    first = asyncio.ensure_future(read_upstream(policy, path, headers))
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done or not proxy.hedger.try_hedge():
+            return await first
+
+        second = asyncio.ensure_future(read_upstream(policy, path, headers))
+        pending.add(second)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        proxy.hedger.on_hedge_win()
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        # проигравший запрос отменяется
+        for task in pending:
+            task.cancel()
+
+
+async def fetch_buffered(policy, path, headers, cache_key, generation):
+    status, response_headers, body = await hedged_read(policy, path, headers)
+    if cache_key and status == 200:
+        proxy.response_cache.put(
+            cache_key, policy.prefix, policy.cache_ttl, generation, status, response_headers, body
+        )
+    return status, response_headers, body
+
+
+async def buffered_get(policy, path, query, user, headers):
+    # после недавней записи ответ не берётся из кэша и не делится с чужими запросами
+    fresh = proxy.LAST_WRITE_HEADER in headers
+    cache_key = None if fresh else proxy.cache_key(policy, "GET", path, user)
+    if cache_key:
+        cached = proxy.response_cache.get(cache_key)
+        if cached:
+            return cached.status, {**cached.headers, "X-Cache": "HIT"}, cached.body
+    generation = proxy.response_cache.generation
+    coalesce_key = None if fresh else proxy.coalesce_key(policy, "GET", path, query, user)
+
+    fetch = partial(fetch_buffered, policy, f"/{path}", headers, cache_key, generation)
+    if coalesce_key:
+        status, response_headers, body = await coalescer.do(coalesce_key, fetch)
+    else:
+        status, response_headers, body = await fetch()
+    if cache_key:
+        response_headers = {**response_headers, "X-Cache": "MISS"}
+    return status, response_headers, body
+
+
+def upstream_error(e):
+    if isinstance(e, proxy.UpstreamUnavailable):
+        return {"error": "service is unavailable", "details": str(e)}, 503, {"Retry-After": str(e.retry_after)}
+    if isinstance(e, httpx.TimeoutException):
+        return {"error": "service timeout", "details": str(e)}, 504, {}
+    return {"error": "service is unavailable", "details": str(e)}, 500, {}
+
+
+def user_from_cookie(request):
+    token = request.cookies.get("token")
+    if not token:
+        return None, JSONResponse({"error": "bad token"}, 401)
+    try:
+        return proxy.decode_user_token(token), None
+    except JWTError as e:
+        return None, PlainTextResponse(str(e), 401)
+
+
+async def rate_limit(policy, user, request):
+    remote_addr = request.client.host if request.client else None
+    # общее sqlite хранилище блокирует, поэтому уходит в поток
+    if policy.rate_limit > 0 and proxy.rate_limiter.buckets.shared:
+        return await asyncio.to_thread(proxy.rate_limit, policy, user, remote_addr)
+    return proxy.rate_limit(policy, user, remote_addr)
+
+
+async def aggregate_part(request, user, method, path, query):
+    if method != "GET":
+        return aggregation.part_error(405, "only GET requests can be aggregated")
+    policy = proxy.find_client_route(path)
+    if not policy:
+        return aggregation.part_error(400, 'No route from gateway')
+
+    retry_after = await rate_limit(policy, user, request)
+    if retry_after:
+        error, status, _ = proxy.rate_limited_error(policy, retry_after)
+        return aggregation.part_error(status, error["error"], error["details"])
+
+    headers = proxy.user_headers(user) if policy.auth_required else {}
+    headers.update(proxy.last_write_headers(request.cookies))
+    try:
+        status, response_headers, body = await buffered_get(policy, path, query, user, headers)
+    except (proxy.UpstreamUnavailable, httpx.HTTPError) as e:
+        error, status, _ = upstream_error(e)
+        return aggregation.part_error(status, error["error"], error["details"])
+    return aggregation.part_result(status, response_headers, body)
+
+
+async def request_body(request):
+    length = request.headers.get("content-length")
+    if length is None:
+        if request.headers.get("transfer-encoding", "").lower() != "chunked":
+            return None
+        return request.stream()
+    if int(length) <= STREAM_BODY_BUFFER:
+        return await request.body()
+    return request.stream()
+
+
+async def request_json(request):
+    # Аналог `flask_request.json if flask_request.json else None`
+    if "json" not in request.headers.get("content-type", ""):
+        return None
+    body = await request.body()
+    if not body:
+        return None
+    return json.loads(body) or None
+
+
+async def hello_world(request):
+    return PlainTextResponse('Gateway is working')
+
+
+async def metrics(request):
+    return Response(proxy.registry.render(), headers={"Content-Type": proxy.METRICS_CONTENT_TYPE})
+
+
+async def route(request):
+    if request.method == "OPTIONS":
+        return Response(headers={"Allow": ", ".join(PROXY_METHODS)})
+
+    path = request.path_params["path"]
+    policy = proxy.find_client_route(path)
+    if not policy:
+        # без токена неизвестный путь, как и раньше, отвечает 401: маршруты не раскрываются
+        user, error_response = user_from_cookie(request)
+        if error_response:
+            return error_response
+        log.request(request.url.path, "no route")
+        return JSONResponse({"error": 'No route from gateway'}, 400)
+    request.state.route = policy.prefix
+
+    user = None
+    headers = {}
+    if policy.auth_required:
+        user, error_response = user_from_cookie(request)
+        if error_response:
+            return error_response
+        headers = proxy.user_headers(user)
+    headers.update(proxy.last_write_headers(request.cookies))
+
+    retry_after = await rate_limit(policy, user, request)
+    if retry_after:
+        error, status, error_headers = proxy.rate_limited_error(policy, retry_after)
+        return JSONResponse(error, status, headers=error_headers)
+
+    method = request.method
+    accept_encoding = request.headers.get("accept-encoding") if method != "HEAD" else None
+    try:
+        # Кэшируемые и склеиваемые GET читаются из апстрима целиком
+        if proxy.is_buffered(policy, method):
+            status, response_headers, body = await buffered_get(policy, path, request.url.query, user, headers)
+            response_headers, body = compression.encode_response(accept_encoding, status, response_headers, body)
+            return Response(body, status, headers=response_headers)
+
+        if not STREAM_PROXY:
+            try:
+                body = await request_json(request)
+            except ValueError as e:
+                return JSONResponse({"error": "bad body", "details": str(e)}, 400)
+            result = await proxy_request(policy, method, f"/{path}", json=body, headers=headers)
+        else:
+            result = await proxy_request(
+                policy,
+                method,
+                f"/{path}",
+                content=await request_body(request),
+                headers={**headers, **proxy.request_body_headers(request.headers)},
+                stream=True,
+            )
+    except (proxy.UpstreamUnavailable, httpx.HTTPError) as e:
+        error, status, error_headers = upstream_error(e)
+        return JSONResponse(error, status, headers=error_headers)
+    log.request(request.url.path, "proxied", route=policy.prefix, status=result.status_code, user_id=user and user.get("user_id"))
+
+    if method in proxy.WRITE_METHODS:
+        proxy.response_cache.invalidate(policy.invalidates)
+
+    if not STREAM_PROXY:
+        response_headers, body = compression.encode_response(
+            accept_encoding, result.status_code, proxy.decoded_response_headers(result.headers), result.content
+        )
+        return proxy.set_last_write_cookie(Response(body, result.status_code, headers=response_headers), result.headers)
+    response_headers, body = compression.encode_async_stream(
+        accept_encoding, result.status_code, proxy.response_headers(result.headers), result.aiter_raw(STREAM_CHUNK_SIZE)
+    )
+    return proxy.set_last_write_cookie(
+        ClosingStreamingResponse(closing_stream(result, body), result.status_code, headers=response_headers),
+        result.headers,
+    )
+
+
+async def closing_stream(result, body):
+    # BackgroundTask не запускается, если клиент отключился посреди тела,
+    # поэтому ответ апстрима закрывается здесь в любом случае
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        await result.aclose()
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    # при отключении клиента send бросает исключение, пока генератор тела стоит на yield:
+    # закрываем его явно, чтобы сработал finally в closing_stream
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+
+async def replicas(request):
+    request.state.route = "admin"
+    user, error_response = user_from_cookie(request)
+    if error_response:
+        return error_response
+    if not user.get("is_admin"):
+        return JSONResponse({"error": "You need to be admin"}, 403)
+    return JSONResponse(proxy.balancer.stats())
+
+
+async def availability_events(request):
+    request.state.route = "events"
+    user, error_response = user_from_cookie(request)
+    if error_response:
+        return error_response
+    if not proxy.EVENTS_ROUTE:
+        return JSONResponse({"error": 'No route from gateway'}, 400)
+    start_event_readers()
+
+    matches = events.event_filter(request.query_params)
+    queue = proxy.event_hub.subscribe(
+        asyncio.Queue(EVENTS_QUEUE_SIZE), events.parse_last_event_id(request.headers.get("last-event-id"))
+    )
+
+    async def stream():
+        try:
+            yield ": connected\n\n"
+            while not queue.closed:
+                try:
+                    event_id, event_type, data, parsed = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if matches(parsed):
+                    yield events.format_event(event_id, event_type, data)
+        finally:
+            proxy.event_hub.unsubscribe(queue)
+
+    return StreamingResponse(stream(), 200, headers={"Cache-Control": "no-cache"}, media_type="text/event-stream")
+
+
+async def aggregate(request):
+    request.state.route = "aggregate"
+    user, error_response = user_from_cookie(request)
+    if error_response:
+        return error_response
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        payload = None
+    try:
+        parts = aggregation.parse_parts(payload)
+    except aggregation.AggregateError as e:
+        return JSONResponse({"error": "bad body", "details": str(e)}, 400)
+
+    # Страница ждёт самый медленный сервис, а не сумму всех
+    results = await asyncio.gather(*(aggregate_part(request, user, *spec) for spec in parts.values()))
+    return JSONResponse({"responses": dict(zip(parts, results))})
+
+
+def add_cors(app):
+    async def _app(scope, receive, send):
+        if scope["type"] != "http":
+            return await app(scope, receive, send)
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).update(proxy.CORS_HEADERS)
+            await send(message)
+        await app(scope, receive, _send)
+    return _app
+
+
+def add_metrics(app):
+    async def _app(scope, receive, send):
+        if scope["type"] != "http":
+            return await app(scope, receive, send)
+
+        started = perf_counter()
+        state = scope.setdefault("state", {})
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        proxy.in_flight.inc()
+        try:
+            await app(scope, receive, _send)
+        finally:
+            proxy.in_flight.dec()
+            proxy.observe_request(state.get("route", "-"), scope["method"], status, started)
+    return _app
+
+
+async def check_replica(client, pool, replica):
+    try:
+        result = await client.get(f"http://{replica.address}{HEALTH_CHECK_PATH}")
+        error = f"status_code={result.status_code}" if proxy.is_upstream_failure(result.status_code) else None
+    except httpx.HTTPError as e:
+        error = e
+    proxy.balancer.record_check(pool, replica, error)
+
+
+async def check_replicas():
+    async with httpx.AsyncClient(timeout=HEALTH_CHECK_TIMEOUT) as client:
+        while True:
+            await asyncio.gather(*(
+                check_replica(client, pool, replica) for pool, replica in proxy.balancer.replicas()
+            ))
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+
+async def read_events(policy, address):
+    # подписка на одну реплику, при обрыве переподключается с Last-Event-ID
+    last_event_id = None
+    backoff = 1
+    while True:
+        headers = {"Accept": "text/event-stream"}
+        if last_event_id:
+            headers["Last-Event-ID"] = last_event_id
+        try:
+            result = await authorized_request(
+                policy.service, address, "GET", EVENTS_UPSTREAM_PATH, stream=True,
+                headers=headers, timeout=httpx.Timeout(policy.timeout, read=EVENTS_READ_TIMEOUT),
+            )
+            try:
+                if result.status_code != 200:
+                    raise httpx.HTTPError(f"status_code={result.status_code}")
+                log.info("subscribed to events", replica=address)
+                backoff = 1
+                parser = events.SSEParser()
+                async for chunk in result.aiter_text():
+                    for event_id, event_type, data in parser.feed(chunk):
+                        last_event_id = event_id
+                        proxy.event_hub.publish(event_type, data)
+            finally:
+                await result.aclose()
+        except httpx.HTTPError as e:
+            log.warning("events stream lost", replica=address, error=str(e), retry_in=backoff)
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, EVENTS_MAX_BACKOFF)
+
+
+def start_event_readers():
+    # подписка на апстрим появляется вместе с первым клиентом
+    if event_readers:
+        return
+    policy = proxy.EVENTS_ROUTE
+    for replica in proxy.balancer.get(policy.service).replicas:
+        event_readers.append(asyncio.create_task(read_events(policy, replica.address)))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    for service in proxy.ROUTER.services():
+        upstream_client(service)
+    health_checks = asyncio.create_task(check_replicas()) if HEALTH_CHECK_INTERVAL > 0 else None
+    yield
+    if health_checks:
+        health_checks.cancel()
+    for task in event_readers:
+        task.cancel()
+    for client in upstream_clients.values():
+        await client.aclose()
+    upstream_clients.clear()
+
+
+starlette_app = Starlette(
+    routes=[
+        Route('/', hello_world),
+        Route('/metrics', metrics),
+        Route('/admin/replicas', replicas),
+        Route('/events', availability_events),
+        Route('/aggregate', aggregate, methods=['POST']),
+        Route('/{path:path}', route, methods=PROXY_METHODS),
+    ],
+    lifespan=lifespan,
+)
+app = add_metrics(add_cors(starlette_app))
+
+
+# Точка входа ##############################
+
+if __name__ == '__main__':
+    PORT = os.environ.get("PORT")
+    if not PORT:
+        print("USING DEFAULT PORT 7779, не задан $PORT")
+        PORT = 7779
+    # log_config=None: журнал доступа uvicorn идёт через logger, а не свои обработчики
+    uvicorn.run(app, host="0.0.0.0", port=int(PORT), log_config=None)
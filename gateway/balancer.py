@@ -0,0 +1,118 @@
+from threading import Lock
+from time import time
+import random
+
+import logger
+
+log = logger.get("gateway.balancer")
+
+LEAST_OUTSTANDING = "least_outstanding"
+POWER_OF_TWO = "p2c"
+
+
+def split_replicas(service):
+    # "host1:7774, host2:7774" -> ["host1:7774", "host2:7774"]
+    return [address.strip() for address in service.split(",") if address.strip()]
+
+
+class Replica:
+    def __init__(self, address):
+        self.address = address
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.successes = 0
+        self.last_error = None
+        self.checked_at = None
+
+
+class ReplicaPool:
+    """Реплики одного сервиса. Запрос уходит на живую реплику с наименьшим числом
+    незавершённых запросов (least_outstanding) или на лучшую из двух случайных (p2c).
+    Если живых нет, выбираются из всех: лучше попробовать, чем сразу отказать"""
+
+    def __init__(self, service, strategy, unhealthy_threshold, healthy_threshold):
+        if strategy not in (LEAST_OUTSTANDING, POWER_OF_TWO):
+            raise ValueError(f"unknown balance strategy {strategy!r}")
+        self.service = service
+        self.replicas = [Replica(address) for address in split_replicas(service)]
+        self.strategy = strategy
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+        self.lock = Lock()
+
+    def acquire(self):
+        with self.lock:
+            candidates = [r for r in self.replicas if r.healthy] or self.replicas
+            if self.strategy == POWER_OF_TWO and len(candidates) > 2:
+                candidates = random.sample(candidates, 2)
+            least = min(r.outstanding for r in candidates)
+            replica = random.choice([r for r in candidates if r.outstanding == least])
+            replica.outstanding += 1
+            return replica
+
+    def release(self, replica, failed=False, error=None):
+        # failed=None - запрос отменён гейтвеем, о здоровье реплики он ничего не говорит
+        with self.lock:
+            replica.outstanding -= 1
+        if failed is None:
+            return
+        if failed:
+            self.on_failure(replica, error)
+        else:
+            self.on_success(replica)
+
+    def on_success(self, replica):
+        with self.lock:
+            replica.failures = 0
+            replica.successes += 1
+            replica.last_error = None
+            if not replica.healthy and replica.successes >= self.healthy_threshold:
+                log.warning("replica up", replica=replica.address)
+                replica.healthy = True
+
+    def on_failure(self, replica, error=None):
+        with self.lock:
+            replica.successes = 0
+            replica.failures += 1
+            replica.last_error = str(error) if error else None
+            if replica.healthy and replica.failures >= self.unhealthy_threshold:
+                log.warning("replica down", replica=replica.address, error=replica.last_error)
+                replica.healthy = False
+
+    def stats(self):
+        return {
+            r.address: {
+                "healthy": r.healthy,
+                "outstanding": r.outstanding,
+                "failures": r.failures,
+                "last_error": r.last_error,
+                "checked_at": r.checked_at,
+            }
+            for r in self.replicas
+        }
+
+
+class Balancer:
+    def __init__(self, services, strategy, unhealthy_threshold, healthy_threshold):
+        self.pools = {
+            service: ReplicaPool(service, strategy, unhealthy_threshold, healthy_threshold)
+            for service in services
+        }
+
+    def get(self, service):
+        return self.pools[service]
+
+    def replicas(self):
+        return [(pool, replica) for pool in self.pools.values() for replica in pool.replicas]
+
+    def record_check(self, pool, replica, error):
+        # error - None, если реплика ответила
+        replica.checked_at = time()
+        if error is None:
+            pool.on_success(replica)
+        else:
+            pool.on_failure(replica, error)
+
+    def stats(self):
+        return {service: pool.stats() for service, pool in self.pools.items()}
@@ -0,0 +1,225 @@
+import zlib
+
+from config import COMPRESS_MIN_SIZE, COMPRESS_LEVEL, COMPRESS_TYPES
+
+# brotli и zstandard необязательны: без них гейтвей сжимает только gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Порядок - предпочтение гейтвея при одинаковом q у клиента
+ENCODINGS = [e for e, lib in (("zstd", zstandard), ("br", brotli), ("gzip", zlib)) if lib is not None]
+print("COMPRESS ENCODINGS:", ENCODINGS)
+
+# 204/304 и ответы на HEAD без тела
+NO_BODY_STATUSES = {204, 304}
+
+
+def header(headers, name):
+    name = name.lower()
+    for k, v in headers.items():
+        if k.lower() == name:
+            return v
+    return None
+
+
+def without(headers, *names):
+    names = {name.lower() for name in names}
+    return {k: v for k, v in headers.items() if k.lower() not in names}
+
+
+def accepted_encodings(accept_encoding):
+    result = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[name.strip().lower()] = q
+    return result
+
+
+def is_accepted(encoding, accept_encoding):
+    accepted = accepted_encodings(accept_encoding)
+    return accepted.get(encoding, accepted.get("*", 0)) > 0
+
+
+def negotiate(accept_encoding):
+    accepted = accepted_encodings(accept_encoding)
+    best, best_q = None, 0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressor(encoding):
+    if encoding == "gzip":
+        return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "br":
+        return _BrotliCompressor()
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=COMPRESS_LEVEL).compressobj()
+    raise ValueError(f"unsupported encoding {encoding!r}")
+
+
+def decompressor(encoding):
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        # 32 + MAX_WBITS: zlib сам определит gzip или zlib заголовок
+        return zlib.decompressobj(32 + zlib.MAX_WBITS)
+    if encoding == "br" and brotli is not None:
+        return _BrotliDecompressor()
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"unsupported encoding {encoding!r}")
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=min(COMPRESS_LEVEL, 11))
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+class _BrotliDecompressor:
+    def __init__(self):
+        self.decompressor = brotli.Decompressor()
+
+    def decompress(self, data):
+        return self.decompressor.process(data)
+
+    def flush(self):
+        return b""
+
+
+def decode_body(headers, body):
+    encoding = (header(headers, "Content-Encoding") or "identity").lower()
+    if encoding == "identity":
+        return body
+    d = decompressor(encoding)
+    return d.decompress(body) + d.flush()
+
+
+def _content_encoding(headers):
+    encoding = (header(headers, "Content-Encoding") or "identity").lower()
+    return None if encoding == "identity" else encoding
+
+
+def _is_compressible(status, headers):
+    if status in NO_BODY_STATUSES:
+        return False
+    content_type = (header(headers, "Content-Type") or "").split(";")[0].strip().lower()
+    return any(content_type.startswith(t) for t in COMPRESS_TYPES)
+
+
+def _vary(headers):
+    vary = header(headers, "Vary")
+    if vary and "accept-encoding" in vary.lower():
+        return headers
+    return {**without(headers, "Vary"), "Vary": f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"}
+
+
+def encode_response(accept_encoding, status, headers, body):
+    """Тело ответа целиком: сжатое апстримом отдаётся как есть, если клиент его принимает,
+    иначе распаковывается; несжатое сжимается выбранным по Accept-Encoding способом"""
+    upstream_encoding = _content_encoding(headers)
+    if upstream_encoding:
+        # уйдёт ли тело сжатым, решает Accept-Encoding клиента
+        headers = _vary(headers)
+        if is_accepted(upstream_encoding, accept_encoding):
+            return headers, body
+        body = decode_body(headers, body)
+        headers = without(headers, "Content-Encoding", "Content-Length")
+
+    if not _is_compressible(status, headers):
+        return headers, body
+    headers = _vary(headers)
+    encoding = negotiate(accept_encoding)
+    if not encoding or len(body) < COMPRESS_MIN_SIZE:
+        return headers, body
+    c = compressor(encoding)
+    body = c.compress(body) + c.flush()
+    return {**without(headers, "Content-Length"), "Content-Encoding": encoding}, body
+
+
+def _transform(chunks, obj, method):
+    try:
+        for chunk in chunks:
+            out = getattr(obj, method)(chunk)
+            if out:
+                yield out
+        tail = obj.flush()
+        if tail:
+            yield tail
+    finally:
+        # закрывает ответ апстрима, если клиент отключился раньше
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+async def _atransform(chunks, obj, method):
+    async for chunk in chunks:
+        out = getattr(obj, method)(chunk)
+        if out:
+            yield out
+    tail = obj.flush()
+    if tail:
+        yield tail
+
+
+def _stream_plan(accept_encoding, status, headers):
+    # (заголовки ответа, распаковщик апстрима, упаковщик для клиента)
+    decoder = None
+    upstream_encoding = _content_encoding(headers)
+    if upstream_encoding:
+        headers = _vary(headers)
+        if is_accepted(upstream_encoding, accept_encoding):
+            return headers, None, None
+        decoder = decompressor(upstream_encoding)
+        headers = without(headers, "Content-Encoding", "Content-Length")
+
+    if not _is_compressible(status, headers):
+        return headers, decoder, None
+    headers = _vary(headers)
+    encoding = negotiate(accept_encoding)
+    length = header(headers, "Content-Length")
+    if not encoding or (length is not None and int(length) < COMPRESS_MIN_SIZE):
+        return headers, decoder, None
+    headers = {**without(headers, "Content-Length"), "Content-Encoding": encoding}
+    return headers, decoder, compressor(encoding)
+
+
+def encode_stream(accept_encoding, status, headers, chunks):
+    """То же для потокового ответа: тело сжимается по кускам, не собираясь целиком"""
+    headers, decoder, encoder = _stream_plan(accept_encoding, status, headers)
+    if decoder:
+        chunks = _transform(chunks, decoder, "decompress")
+    if encoder:
+        chunks = _transform(chunks, encoder, "compress")
+    return headers, chunks
+
+
+def encode_async_stream(accept_encoding, status, headers, chunks):
+    headers, decoder, encoder = _stream_plan(accept_encoding, status, headers)
+    if decoder:
+        chunks = _atransform(chunks, decoder, "decompress")
+    if encoder:
+        chunks = _atransform(chunks, encoder, "compress")
+    return headers, chunks
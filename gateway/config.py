@@ -0,0 +1,154 @@
+import os
+
+CLIENT_ID = "gateway_service"
+JWT_SECRET = "gateway_12345"
+USER_JWT_SECRET = "user_jwt_secret"
+
+FRONT_URL = os.environ.get("FRONT_URL", "localhost:7770")
+CAR_SERVICE_URL = os.environ.get("CAR_SERVICE_URL", "localhost:7774")
+OFFICE_SERVICE_URL = os.environ.get("OFFICE_SERVICE_URL", "localhost:7775")
+PAYMENT_SERVICE_URL = os.environ.get("PAYMENT_SERVICE_URL", "localhost:7776")
+BOOKING_SERVICE_URL = os.environ.get("BOOKING_SERVICE_URL", "localhost:7777")
+STATISTICS_SERVICE_URL = os.environ.get("STATISTICS_SERVICE_URL", "localhost:7778")
+
+print("FRONT_URL:", FRONT_URL)
+print("CAR_SERVICE_URL:", CAR_SERVICE_URL)
+print("OFFICE_SERVICE_URL:", OFFICE_SERVICE_URL)
+print("PAYMENT_SERVICE_URL:", PAYMENT_SERVICE_URL)
+print("BOOKING_SERVICE_URL:", BOOKING_SERVICE_URL)
+print("STATISTICS_SERVICE_URL:", STATISTICS_SERVICE_URL)
+# В *_SERVICE_URL можно перечислить реплики через запятую: "host1:7774,host2:7774"
+
+SERVICE_URLS = {
+    "CAR_SERVICE_URL": CAR_SERVICE_URL,
+    "OFFICE_SERVICE_URL": OFFICE_SERVICE_URL,
+    "PAYMENT_SERVICE_URL": PAYMENT_SERVICE_URL,
+    "BOOKING_SERVICE_URL": BOOKING_SERVICE_URL,
+    "STATISTICS_SERVICE_URL": STATISTICS_SERVICE_URL,
+}
+
+ROUTING_TABLE = {
+    "cars": CAR_SERVICE_URL,
+    "offices": OFFICE_SERVICE_URL,
+    "payment": PAYMENT_SERVICE_URL,
+    "booking": BOOKING_SERVICE_URL,
+    "reports": STATISTICS_SERVICE_URL,
+}
+
+# Политики маршрутов по умолчанию: timeout (сек), retries (для GET/HEAD),
+# cacheable, cache_ttl (сек), cache_scope ("shared" - общий кэш для всех с тем же is_admin,
+# "private" - свой для каждого user_id), invalidates (какие ещё префиксы сбрасывать
+# при записи через этот маршрут), coalesce (одинаковые одновременные GET идут
+# в апстрим одним запросом), rate_limit и rate_burst, hedge (см. ниже), auth_required.
+# Таблицу целиком можно заменить json-файлом из $ROUTES_CONFIG
+ROUTE_POLICIES = {
+    "cars": {"cacheable": True, "cache_ttl": 60, "invalidates": ["offices"], "coalesce": True, "hedge": True},
+    "offices": {"cacheable": True, "cache_ttl": 10, "invalidates": ["cars"], "coalesce": True, "hedge": True},
+    # бронирование меняет доступность машин в офисах
+    "booking": {"invalidates": ["offices"], "rate_limit": 1, "rate_burst": 10},
+    "payment": {"rate_limit": 1, "rate_burst": 10},
+    "reports": {"coalesce": True},
+}
+ROUTES_CONFIG = os.environ.get("ROUTES_CONFIG")
+# Используется, если у маршрута не задан свой timeout
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", 30))
+
+# Пул keep-alive соединений держится отдельно для каждого сервиса из ROUTING_TABLE
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", 100))
+UPSTREAM_KEEPALIVE = int(os.environ.get("UPSTREAM_KEEPALIVE", 20))
+
+print("UPSTREAM_POOL_SIZE:", UPSTREAM_POOL_SIZE)
+print("UPSTREAM_KEEPALIVE:", UPSTREAM_KEEPALIVE)
+
+# Потоковый режим: тело ответа апстрима отдаётся клиенту кусками, не декодируясь,
+# а тело запроса уходит в апстрим без разбора json
+STREAM_PROXY = int(os.environ.get("STREAM_PROXY", 1))
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 64 * 1024))
+# Тела запросов не больше этого размера читаются целиком, чтобы их можно было
+# переотправить после переавторизации
+STREAM_BODY_BUFFER = int(os.environ.get("STREAM_BODY_BUFFER", 64 * 1024))
+
+print("STREAM_PROXY:", STREAM_PROXY)
+
+# Кэш проверенных пользовательских токенов
+USER_TOKEN_CACHE_SIZE = int(os.environ.get("USER_TOKEN_CACHE_SIZE", 10000))
+USER_TOKEN_NEGATIVE_CACHE_SIZE = int(os.environ.get("USER_TOKEN_NEGATIVE_CACHE_SIZE", 1000))
+USER_TOKEN_NEGATIVE_TTL = float(os.environ.get("USER_TOKEN_NEGATIVE_TTL", 5))
+# Для токенов без exp
+USER_TOKEN_MAX_TTL = float(os.environ.get("USER_TOKEN_MAX_TTL", 300))
+
+# Кэш ответов для маршрутов с cacheable
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+
+# Circuit breaker и ограничение одновременных запросов для каждого сервиса.
+# Для отдельного сервиса значения можно переопределить в "upstreams" файла $ROUTES_CONFIG
+UPSTREAM_GUARD_DEFAULTS = {
+    "failure_threshold": int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5)),
+    "reset_timeout": float(os.environ.get("BREAKER_RESET_TIMEOUT", 10)),
+    "max_concurrent": int(os.environ.get("BULKHEAD_MAX_CONCURRENT", 50)),
+}
+
+# POST /aggregate: несколько GET за один запрос, выполняются параллельно
+AGGREGATE_MAX_PARTS = int(os.environ.get("AGGREGATE_MAX_PARTS", 16))
+AGGREGATE_WORKERS = int(os.environ.get("AGGREGATE_WORKERS", 32))
+
+# Token bucket на пару (пользователь, маршрут): rate_limit запросов в секунду, всплеск до rate_burst.
+# 0 - без ограничений; для маршрута задаётся в ROUTE_POLICIES или $ROUTES_CONFIG
+RATE_LIMIT = float(os.environ.get("RATE_LIMIT", 0))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 20))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+# Путь к sqlite файлу, общему для всех воркеров гейтвея на машине; без него лимиты в памяти процесса
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE")
+
+print("RATE_LIMIT_STORE:", RATE_LIMIT_STORE or "memory")
+
+# Сжатие ответов по Accept-Encoding клиента (gzip, а также br и zstd, если установлены brotli и zstandard)
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+COMPRESS_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+# Что гейтвей просит у сервисов: сжатые ими ответы проходят к клиенту без пересжатия
+UPSTREAM_ACCEPT_ENCODING = os.environ.get("UPSTREAM_ACCEPT_ENCODING", "gzip, deflate")
+
+# Балансировка между репликами сервиса: least_outstanding или p2c (лучшая из двух случайных)
+BALANCE_STRATEGY = os.environ.get("BALANCE_STRATEGY", "least_outstanding")
+# Фоновая проверка реплик; 0 - не проверять
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", 5))
+HEALTH_CHECK_PATH = os.environ.get("HEALTH_CHECK_PATH", "/")
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("HEALTH_CHECK_TIMEOUT", 2))
+# Сколько ошибок подряд выводят реплику из ротации и сколько успешных проверок возвращают
+HEALTH_UNHEALTHY_THRESHOLD = int(os.environ.get("HEALTH_UNHEALTHY_THRESHOLD", 2))
+HEALTH_HEALTHY_THRESHOLD = int(os.environ.get("HEALTH_HEALTHY_THRESHOLD", 1))
+
+print("BALANCE_STRATEGY:", BALANCE_STRATEGY)
+
+# Хеджирование GET для маршрутов с hedge: если ответа нет дольше HEDGE_PERCENTILE-го перцентиля
+# недавних задержек маршрута, уходит второй запрос (на другую реплику, если она есть), побеждает первый ответ.
+# Лишних запросов не больше HEDGE_BUDGET от общего числа (плюс всплеск HEDGE_BUDGET_BURST)
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+HEDGE_INITIAL_DELAY = float(os.environ.get("HEDGE_INITIAL_DELAY", 0.1))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", 0.01))
+HEDGE_WINDOW = int(os.environ.get("HEDGE_WINDOW", 500))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))
+HEDGE_BUDGET = float(os.environ.get("HEDGE_BUDGET", 0.05))
+HEDGE_BUDGET_BURST = float(os.environ.get("HEDGE_BUDGET_BURST", 10))
+# Потоковый гейтвей: одновременных хеджей на сервис (не больше его max_concurrent), сверх них хедж не отправляется
+HEDGE_WORKERS = int(os.environ.get("HEDGE_WORKERS", 8))
+
+# Сервисы отвечают на запрос с записью заголовком X-Last-Write. Гейтвей хранит его в cookie
+# LAST_WRITE_COOKIE_MAX_AGE секунд (не меньше READ_YOUR_WRITES_WINDOW сервисов) и передаёт
+# с запросами пользователя: чтения после записи идут в основную базу в любом процессе сервиса
+LAST_WRITE_COOKIE_MAX_AGE = int(os.environ.get("LAST_WRITE_COOKIE_MAX_AGE", 5))
+
+print("LAST_WRITE_COOKIE_MAX_AGE:", LAST_WRITE_COOKIE_MAX_AGE)
+
+# GET /events: изменения доступности машин (SSE). Гейтвей подписывается на EVENTS_UPSTREAM_PATH
+# каждой реплики сервиса офисов и раздаёт события клиентам
+EVENTS_UPSTREAM_PATH = os.environ.get("EVENTS_UPSTREAM_PATH", "/offices/events")
+EVENTS_BUFFER = int(os.environ.get("EVENTS_BUFFER", 1000))
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))
+EVENTS_HEARTBEAT = float(os.environ.get("EVENTS_HEARTBEAT", 15))
+# Апстрим шлёт ping раз в 15 секунд, дольше тишины - соединение мёртвое
+EVENTS_READ_TIMEOUT = float(os.environ.get("EVENTS_READ_TIMEOUT", 45))
+EVENTS_MAX_BACKOFF = float(os.environ.get("EVENTS_MAX_BACKOFF", 30))
@@ -0,0 +1,115 @@
+from collections import deque
+from threading import Lock
+import json
+
+# GET /events: гейтвей держит по одной подписке на каждую реплику сервиса офисов
+# и раздаёт изменения доступности всем своим клиентам
+
+
+class SSEParser:
+    """Разбирает поток text/event-stream, куски могут резать строки где угодно"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.event_id = None
+        self.event_type = "message"
+        self.data = []
+
+    def feed(self, text):
+        events = []
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            line = line.rstrip("\r")
+            if not line:
+                if self.data:
+                    events.append((self.event_id, self.event_type, "\n".join(self.data)))
+                self.event_type = "message"
+                self.data = []
+                continue
+            if line.startswith(":"):
+                continue
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "id":
+                self.event_id = value
+            elif field == "event":
+                self.event_type = value
+            elif field == "data":
+                self.data.append(value)
+        return events
+
+
+def format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+def parse_last_event_id(value):
+    return int(value) if value and value.isdigit() else None
+
+
+def event_filter(args):
+    # ?office_id=1&car_uuid=... - только события этого офиса или этой машины
+    office_id = args.get("office_id")
+    office_id = int(office_id) if office_id and office_id.isdigit() else None
+    car_uuid = args.get("car_uuid")
+
+    def matches(data):
+        if office_id is None and car_uuid is None:
+            return True
+        return office_id in data.get("office_ids", ()) or (car_uuid is not None and data.get("car_uuid") == car_uuid)
+    return matches
+
+
+class EventHub:
+    """Нумерует события заново (у реплик свои счётчики) и хранит последние max_events
+    для клиентов, переподключившихся с Last-Event-ID. Подписчик - очередь с put_nowait;
+    если она переполнена, подписчик отключается и переподключится сам"""
+
+    def __init__(self, max_events, on_event=None):
+        self.events = deque(maxlen=max_events)
+        self.subscribers = set()
+        self.on_event = on_event
+        self.last_id = 0
+        self.upstream_events = 0
+        self.dropped = 0
+        self.lock = Lock()
+
+    def publish(self, event_type, data):
+        try:
+            parsed = json.loads(data)
+        except ValueError:
+            parsed = {}
+        with self.lock:
+            self.last_id += 1
+            self.upstream_events += 1
+            event = (self.last_id, event_type, data, parsed)
+            self.events.append(event)
+            subscribers = list(self.subscribers)
+        if self.on_event:
+            self.on_event(event)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(event)
+            except Exception:
+                # queue.Full или asyncio.QueueFull
+                self.unsubscribe(queue)
+                queue.closed = True
+                self.dropped += 1
+
+    def subscribe(self, queue, last_event_id=None):
+        queue.closed = False
+        with self.lock:
+            if last_event_id is not None:
+                missed = [event for event in self.events if event[0] > last_event_id]
+                for event in missed[-queue.maxsize:]:
+                    queue.put_nowait(event)
+            self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers.discard(queue)
+
+    def stats(self):
+        return {"subscribers": len(self.subscribers), "events": self.upstream_events, "dropped": self.dropped}
@@ -1,65 +1,351 @@
-from functools import wraps
+from codecs import getincrementaldecoder
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.cookiejar import DefaultCookiePolicy
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import perf_counter, sleep
 import os
 
-from requests import request, RequestException
+from requests import Session, ConnectionError, RequestException, Timeout
 
-from jose import jwt, JWTError, ExpiredSignatureError
-from flask import Flask
+from flask import Flask, Response, g
 from flask import request as flask_request
 from flask_cors import CORS
 
+from config import CLIENT_ID, JWT_SECRET, UPSTREAM_POOL_SIZE, UPSTREAM_ACCEPT_ENCODING
+from config import HEALTH_CHECK_INTERVAL, HEALTH_CHECK_PATH, HEALTH_CHECK_TIMEOUT
+from config import EVENTS_UPSTREAM_PATH, EVENTS_QUEUE_SIZE, EVENTS_HEARTBEAT, EVENTS_READ_TIMEOUT, EVENTS_MAX_BACKOFF
+from config import STREAM_PROXY, STREAM_CHUNK_SIZE, STREAM_BODY_BUFFER, AGGREGATE_WORKERS, HEDGE_WORKERS
+from abortable import AbortableAdapter, Attempt
+from balancer import split_replicas
+from hedging import DelayedCalls, HedgeLane
+from jwt_backend import JWTError, ExpiredSignatureError
+from singleflight import SingleFlight
+import abortable
+import aggregation
+import compression
+import events
+import logger
+import proxy
+
+log = logger.setup("gateway")
+
 # Экземпляр приложения
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
-CLIENT_ID = "gateway_service"
-JWT_SECRET = "gateway_12345"
-USER_JWT_SECRET = "user_jwt_secret"
 current_token = {}
 
-FRONT_URL = os.environ.get("FRONT_URL", "localhost:7770")
-CAR_SERVICE_URL = os.environ.get("CAR_SERVICE_URL", "localhost:7774")
-OFFICE_SERVICE_URL = os.environ.get("OFFICE_SERVICE_URL", "localhost:7775")
-PAYMENT_SERVICE_URL = os.environ.get("PAYMENT_SERVICE_URL", "localhost:7776")
-BOOKING_SERVICE_URL = os.environ.get("BOOKING_SERVICE_URL", "localhost:7777")
-STATISTICS_SERVICE_URL = os.environ.get("STATISTICS_SERVICE_URL", "localhost:7778")
-
-print("FRONT_URL:", FRONT_URL)
-print("CAR_SERVICE_URL:", CAR_SERVICE_URL)
-print("OFFICE_SERVICE_URL:", OFFICE_SERVICE_URL)
-print("PAYMENT_SERVICE_URL:", PAYMENT_SERVICE_URL)
-print("BOOKING_SERVICE_URL:", BOOKING_SERVICE_URL)
-print("STATISTICS_SERVICE_URL:", STATISTICS_SERVICE_URL)
-
-ROUTING_TABLE = {
-    "cars": CAR_SERVICE_URL,
-    "offices": OFFICE_SERVICE_URL,
-    "payment": PAYMENT_SERVICE_URL,
-    "booking": BOOKING_SERVICE_URL,
-    "reports": STATISTICS_SERVICE_URL,
+
+def create_upstream_session(replicas=1):
+    session = Session()
+    # cookie апстрима не должны сохраняться между запросами разных пользователей
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.mount("http://", AbortableAdapter(pool_connections=replicas, pool_maxsize=UPSTREAM_POOL_SIZE))
+    session.headers["Accept-Encoding"] = UPSTREAM_ACCEPT_ENCODING
+    return session
+
+
+# Для каждого сервиса свой пул соединений, чтобы не открывать TCP на каждый запрос
+upstream_sessions = {
+    service: create_upstream_session(len(split_replicas(service))) for service in proxy.ROUTER.services()
+}
+coalescer = SingleFlight()
+aggregate_pool = ThreadPoolExecutor(max_workers=AGGREGATE_WORKERS)
+# Основной запрос хеджированного GET идёт в потоке запроса, в эти потоки - только хедж.
+# У каждого сервиса свои, не больше его bulkhead: медленный сервис не занимает чужие
+hedge_lanes = {
+    service: HedgeLane(service, min(HEDGE_WORKERS, proxy.upstream_guards.get(service).bulkhead.max_concurrent))
+    for service in proxy.ROUTER.services()
 }
+hedge_timers = DelayedCalls()
+proxy.register_stats("gateway_coalescing", "Single-flight upstream calls and saved calls", coalescer.stats)
 
 
-def authorized_request(domain, *args, **kwargs):
+def refresh_token(session, domain, address):
+    # токен общий для всех реплик сервиса
+    log.info("re-auth", domain=domain, replica=address)
+    proxy.reauth_total.inc(domain)
+    credentials = {"client_id": CLIENT_ID, "client_secret": JWT_SECRET}
+    token_response = session.request("POST", f"http://{address}/token", json=credentials)
+    current_token[domain] = token_response.json()["token"]
+
+
+def authorized_request(domain, address, method, path, **kwargs):
     global current_token
 
+    session = upstream_sessions.get(domain)
+    if session is None:
+        session = upstream_sessions.setdefault(domain, create_upstream_session())
+
+    # Потоковое тело нельзя отправить второй раз, поэтому токен получаем заранее
+    replayable = proxy.is_replayable(kwargs.get("data"))
+    if not replayable and domain not in current_token:
+        refresh_token(session, domain, address)
+
     kwargs["headers"] = {
         **kwargs.get('headers', {}),
         "Authorization": f"Bearer {current_token.get(domain)}"
     }
 
-    result = request(*args, **kwargs)
+    url = f"http://{address}{path}"
+    result = session.request(method, url, **kwargs)
     if result.status_code != 401:
         return result
 
-    print("re-auth in domain", domain)
-    credentials = {"client_id": CLIENT_ID, "client_secret": JWT_SECRET}
-    token_response = request("POST", f"http://{domain}/token", json=credentials)
-    current_token[domain] = token_response.json()["token"]
+    refresh_token(session, domain, address)
+    if not replayable:
+        return result
+    result.close()
 
     kwargs["headers"]["Authorization"] = f"Bearer {current_token.get(domain)}"
-    return request(*args, **kwargs)
+    return session.request(method, url, **kwargs)
+
+
+class BodyStream:
+    # requests узнаёт Content-Length через len(), иначе отправляет тело chunked
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(lambda: self.stream.read(STREAM_CHUNK_SIZE), b"")
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+
+def request_body():
+    length = flask_request.content_length
+    if length is None:
+        if flask_request.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            return None
+        return iter(lambda: flask_request.stream.read(STREAM_CHUNK_SIZE), b"")
+    if length <= STREAM_BODY_BUFFER:
+        return flask_request.get_data(cache=False)
+    return BodyStream(flask_request.stream, length)
+
+
+def guarded_request(policy, method, path, **kwargs):
+    guard = proxy.upstream_guards.get(policy.service)
+    guard.enter()
+    pool = proxy.balancer.get(policy.service)
+    replica = pool.acquire()
+    started = perf_counter()
+    try:
+        result = authorized_request(policy.service, replica.address, method, path, timeout=policy.timeout, **kwargs)
+    except Exception as e:
+        attempt = abortable.current()
+        if attempt is not None and attempt.aborted:
+            # проигравший хедж оборван гейтвеем, сервис тут ни при чём
+            pool.release(replica, failed=None)
+            guard.exit(failed=None)
+            raise
+        # реплику выводит из ротации только невозможность соединиться
+        pool.release(replica, failed=isinstance(e, ConnectionError), error=e)
+        guard.exit(failed=True)
+        proxy.observe_upstream(policy.service, "error", started)
+        raise
+    # потоковый ответ ещё читается, но заголовки получены и реплика ответила
+    pool.release(replica)
+    guard.exit(failed=proxy.is_upstream_failure(result.status_code))
+    proxy.observe_upstream(policy.service, result.status_code, started)
+    return result
+
+
+def proxy_request(policy, method, path, **kwargs):
+    tries = proxy.attempts(policy, method, kwargs.get("data"))
+    for attempt in range(tries):
+        try:
+            return guarded_request(policy, method, path, **kwargs)
+        except RequestException as e:
+            aborted = abortable.current() is not None and abortable.current().aborted
+            if attempt == tries - 1 or aborted:
+                raise
+            log.warning("upstream retry", method=method, path=path, attempt=attempt + 1, error=str(e))
+
+
+def read_body(result, deadline, decode_content):
+    # Тело читается целиком, но не дольше timeout маршрута: read1 возвращает то, что уже пришло,
+    # поэтому срок проверяется и у апстрима, который шлёт данные понемногу, но бесконечно
+    try:
+        if proxy.is_event_stream(result.headers):
+            raise RequestException("upstream returned an event stream to a buffered GET")
+        chunks = []
+        for chunk in iter(lambda: result.raw.read1(STREAM_CHUNK_SIZE, decode_content=decode_content), b""):
+            chunks.append(chunk)
+            if perf_counter() > deadline:
+                raise Timeout("upstream response body was not read in time")
+        return b"".join(chunks)
+    finally:
+        result.close()
+
+
+def read_upstream(policy, path, headers):
+    started = perf_counter()
+    result = proxy_request(policy, "GET", path, headers=headers, stream=True)
+    # в потоковом режиме сжатое апстримом тело не распаковывается
+    body = read_body(result, started + policy.timeout, decode_content=not STREAM_PROXY)
+    if STREAM_PROXY:
+        response_headers = proxy.response_headers(result.headers)
+    else:
+        response_headers = proxy.decoded_response_headers(result.headers)
+    if policy.hedge:
+        proxy.hedger.observe(policy, perf_counter() - started)
+    return result.status_code, response_headers, body
+
+
+class HedgeRace:
+    """Основной запрос и, если он не ответил за delay, хедж; первый ответ побеждает,
+    соединение проигравшего обрывается"""
+
+    def __init__(self, policy, path, headers):
+        self.policy = policy
+        self.path = path
+        self.headers = headers
+        self.primary = Attempt()
+        self.hedge = None
+        self.hedge_future = None
+        self.winner = None
+        self.finished = False
+        self.lock = Lock()
+
+    def launch_hedge(self):
+        # вызывается hedge_timers, пока основной запрос ещё идёт
+        with self.lock:
+            if self.finished:
+                return
+        if not proxy.hedger.try_hedge():
+            return
+        attempt = Attempt()
+        with self.lock:
+            if self.finished:
+                proxy.hedger.cancel_hedge()
+                return
+            self.hedge = attempt
+            self.hedge_future = hedge_lanes[self.policy.service].try_submit(self.run_hedge, attempt)
+            if self.hedge_future is None:
+                self.hedge = None
+                proxy.hedger.on_hedge_rejected()
+
+    def run_hedge(self, attempt):
+        result = abortable.run(attempt, read_upstream, self.policy, self.path, self.headers)
+        with self.lock:
+            if self.finished:
+                return result
+            self.finished = True
+            self.winner = result
+        self.primary.abort()
+        return result
+
+    def run_primary(self):
+        try:
+            result = abortable.run(self.primary, read_upstream, self.policy, self.path, self.headers)
+        except Exception as error:
+            with self.lock:
+                hedge_won = self.winner is not None
+                self.finished = self.finished or self.hedge_future is None
+                future = self.hedge_future
+            if hedge_won:
+                proxy.hedger.on_hedge_win()
+                return self.winner
+            if future is None:
+                raise
+            # основной упал, ждём уже отправленный хедж
+            try:
+                result = future.result()
+            except Exception:
+                raise error from None
+            proxy.hedger.on_hedge_win()
+            return result
+        with self.lock:
+            self.finished = True
+            hedge = self.hedge
+        if hedge is not None:
+            hedge.abort()
+        return result
+
+
+def hedged_read(policy, path, headers):
+    if not policy.hedge:
+        return read_upstream(policy, path, headers)
+    race = HedgeRace(policy, path, headers)
+    timer = hedge_timers.call_later(proxy.hedger.delay(policy), race.launch_hedge)
+    try:
+        return race.run_primary()
+    finally:
+        hedge_timers.cancel(timer)
+
+
+def fetch_buffered(policy, path, headers, cache_key, generation):
+    status, response_headers, body = hedged_read(policy, path, headers)
+    if cache_key and status == 200:
+        proxy.response_cache.put(
+            cache_key, policy.prefix, policy.cache_ttl, generation, status, response_headers, body
+        )
+    return status, response_headers, body
+
+
+def buffered_get(policy, path, query, user, headers):
+    # после недавней записи ответ не берётся из кэша и не делится с чужими запросами
+    fresh = proxy.LAST_WRITE_HEADER in headers
+    cache_key = None if fresh else proxy.cache_key(policy, "GET", path, user)
+    if cache_key:
+        cached = proxy.response_cache.get(cache_key)
+        if cached:
+            return cached.status, {**cached.headers, "X-Cache": "HIT"}, cached.body
+    generation = proxy.response_cache.generation
+    coalesce_key = None if fresh else proxy.coalesce_key(policy, "GET", path, query, user)
+
+    fetch = partial(fetch_buffered, policy, f"/{path}", headers, cache_key, generation)
+    if coalesce_key:
+        status, response_headers, body = coalescer.do(coalesce_key, fetch)
+    else:
+        status, response_headers, body = fetch()
+    if cache_key:
+        response_headers = {**response_headers, "X-Cache": "MISS"}
+    return status, response_headers, body
+
+
+def upstream_error(e):
+    if isinstance(e, proxy.UpstreamUnavailable):
+        return {"error": "service is unavailable", "details": str(e)}, 503, {"Retry-After": str(e.retry_after)}
+    if isinstance(e, Timeout):
+        return {"error": "service timeout", "details": str(e)}, 504, {}
+    return {"error": "service is unavailable", "details": str(e)}, 500, {}
+
+
+def aggregate_part(remote_addr, user, last_write_headers, method, path, query):
+    if method != "GET":
+        return aggregation.part_error(405, "only GET requests can be aggregated")
+    policy = proxy.find_client_route(path)
+    if not policy:
+        return aggregation.part_error(400, 'No route from gateway')
+
+    retry_after = proxy.rate_limit(policy, user, remote_addr)
+    if retry_after:
+        error, status, _ = proxy.rate_limited_error(policy, retry_after)
+        return aggregation.part_error(status, error["error"], error["details"])
+
+    headers = {**(proxy.user_headers(user) if policy.auth_required else {}), **last_write_headers}
+    try:
+        status, response_headers, body = buffered_get(policy, path, query, user, headers)
+    except (proxy.UpstreamUnavailable, RequestException) as e:
+        error, status, _ = upstream_error(e)
+        return aggregation.part_error(status, error["error"], error["details"])
+    return aggregation.part_result(status, response_headers, body)
+
+
+def stream_response_body(result):
+    try:
+        yield from result.raw.stream(STREAM_CHUNK_SIZE, decode_content=False)
+    finally:
+        result.close()
 
 
 class RoleError(Exception):
@@ -68,20 +354,33 @@ class RoleError(Exception):
 
 def verify_token_from_cookie():
     auth_header = flask_request.cookies.get("token")
-    print("cookies:", flask_request.cookies)
     if auth_header:
-        body = jwt.decode(auth_header, USER_JWT_SECRET, algorithms=['HS256'])
+        body = proxy.decode_user_token(auth_header)
         return body
     return None
 
 
+@app.before_request
+def start_request():
+    g.started = perf_counter()
+    g.route = "-"
+    proxy.in_flight.inc()
+
+
+@app.teardown_request
+def finish_request(error):
+    proxy.in_flight.dec()
+
+
+@app.after_request
+def record_metrics(response):
+    proxy.observe_request(g.route, flask_request.method, response.status_code, g.started)
+    return response
+
+
 @app.after_request
 def add_cors(response):
-    header = response.headers
-    header['Access-Control-Allow-Origin'] = f'http://{FRONT_URL}'
-    header['Access-Control-Allow-Headers'] = 'Origin, Content-Type, Authorization'
-    header['Access-Control-Allow-Credentials'] = 'true'
-    header['Access-Control-Allow-Methods'] = 'HEAD, GET, POST, DELETE, PUT, PATCH, OPTIONS'
+    response.headers.update(proxy.CORS_HEADERS)
     return response
 
 
@@ -102,32 +401,206 @@ def hello_world():
     return 'Gateway is working'
 
 
-@app.route('/<path:path>', methods=['GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'PATCH'])
-def route(path):
+@app.route('/metrics')
+def metrics():
+    return proxy.registry.render(), 200, {"Content-Type": proxy.METRICS_CONTENT_TYPE}
+
+
+@app.route('/admin/replicas')
+def replicas():
+    g.route = "admin"
     user = verify_token_from_cookie()
-    print("USER:", user)
     if not user:
         return {"error": "bad token"}, 401
+    if not user.get("is_admin"):
+        return {"error": "You need to be admin"}, 403
+    return proxy.balancer.stats(), 200
 
-    headers = {"user_id": str(user.get("user_id")), "is_admin": str(int(user.get("is_admin")))}
 
-    print("FINDING ROUTE")
-    for route, service in ROUTING_TABLE.items():
-        if path.startswith(route):
+@app.route('/events')
+def availability_events():
+    g.route = "events"
+    user = verify_token_from_cookie()
+    if not user:
+        return {"error": "bad token"}, 401
+    if not proxy.EVENTS_ROUTE:
+        return {"error": 'No route from gateway'}, 400
+    start_event_readers()
+
+    matches = events.event_filter(flask_request.args)
+    queue = proxy.event_hub.subscribe(
+        Queue(EVENTS_QUEUE_SIZE), events.parse_last_event_id(flask_request.headers.get("Last-Event-ID"))
+    )
+
+    def stream():
+        try:
+            yield ": connected\n\n"
+            while not queue.closed:
+                try:
+                    event_id, event_type, data, parsed = queue.get(timeout=EVENTS_HEARTBEAT)
+                except Empty:
+                    yield ": ping\n\n"
+                    continue
+                if matches(parsed):
+                    yield events.format_event(event_id, event_type, data)
+        finally:
+            proxy.event_hub.unsubscribe(queue)
+
+    return Response(stream(), 200, {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+
+
+@app.route('/aggregate', methods=['POST'])
+def aggregate():
+    g.route = "aggregate"
+    user = verify_token_from_cookie()
+    if not user:
+        return {"error": "bad token"}, 401
+    try:
+        parts = aggregation.parse_parts(flask_request.get_json(silent=True))
+    except aggregation.AggregateError as e:
+        return {"error": "bad body", "details": str(e)}, 400
+
+    # части читаются в пуле потоков, где запроса Flask уже нет
+    last_write_headers = proxy.last_write_headers(flask_request.cookies)
+    # Страница ждёт самый медленный сервис, а не сумму всех
+    futures = {
+        name: aggregate_pool.submit(aggregate_part, flask_request.remote_addr, user, last_write_headers, *spec)
+        for name, spec in parts.items()
+    }
+    return {"responses": {name: future.result() for name, future in futures.items()}}, 200
+
+
+@app.route('/<path:path>', methods=['GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'PATCH'])
+def route(path):
+    policy = proxy.find_client_route(path)
+    if not policy:
+        # без токена неизвестный путь, как и раньше, отвечает 401: маршруты не раскрываются
+        if not verify_token_from_cookie():
+            return {"error": "bad token"}, 401
+        log.request(flask_request.path, "no route")
+        return {"error": 'No route from gateway'}, 400
+    g.route = policy.prefix
+
+    user = None
+    headers = {}
+    if policy.auth_required:
+        user = verify_token_from_cookie()
+        if not user:
+            return {"error": "bad token"}, 401
+        headers = proxy.user_headers(user)
+    headers.update(proxy.last_write_headers(flask_request.cookies))
+
+    retry_after = proxy.rate_limit(policy, user, flask_request.remote_addr)
+    if retry_after:
+        return proxy.rate_limited_error(policy, retry_after)
+
+    method = flask_request.method
+    accept_encoding = flask_request.headers.get("Accept-Encoding") if method != "HEAD" else None
+    try:
+        # Кэшируемые и склеиваемые GET читаются из апстрима целиком
+        if proxy.is_buffered(policy, method):
+            status, response_headers, body = buffered_get(policy, path, flask_request.query_string, user, headers)
+            response_headers, body = compression.encode_response(accept_encoding, status, response_headers, body)
+            return Response(body, status, response_headers)
+
+        if not STREAM_PROXY:
+            result = proxy_request(
+                policy,
+                method,
+                f"/{path}",
+                json=flask_request.json if flask_request.json else None,
+                headers=headers,
+            )
+        else:
+            result = proxy_request(
+                policy,
+                method,
+                f"/{path}",
+                data=request_body(),
+                headers={**headers, **proxy.request_body_headers(flask_request.headers)},
+                stream=True,
+            )
+    except (proxy.UpstreamUnavailable, RequestException) as e:
+        return upstream_error(e)
+    log.request(flask_request.path, "proxied", route=policy.prefix, status=result.status_code, user_id=user and user.get("user_id"))
+
+    if method in proxy.WRITE_METHODS:
+        proxy.response_cache.invalidate(policy.invalidates)
+
+    if not STREAM_PROXY:
+        response_headers, body = compression.encode_response(
+            accept_encoding, result.status_code, proxy.decoded_response_headers(result.headers), result.content
+        )
+        return proxy.set_last_write_cookie(Response(body, result.status_code, response_headers), result.headers)
+    response_headers, body = compression.encode_stream(
+        accept_encoding, result.status_code, proxy.response_headers(result.headers), stream_response_body(result)
+    )
+    return proxy.set_last_write_cookie(Response(body, result.status_code, response_headers), result.headers)
+
+
+def check_replicas():
+    session = Session()
+    while True:
+        for pool, replica in proxy.balancer.replicas():
             try:
-                result = authorized_request(
-                    service,
-                    flask_request.method,
-                    f"http://{service}/{path}",
-                    json=flask_request.json if flask_request.json else None,
-                    headers=headers,
-                )
+                result = session.get(f"http://{replica.address}{HEALTH_CHECK_PATH}", timeout=HEALTH_CHECK_TIMEOUT)
+                result.close()
+                error = f"status_code={result.status_code}" if proxy.is_upstream_failure(result.status_code) else None
             except RequestException as e:
-                return {"error": "service is unavailable", "details": str(e)}, 500
-            print("FOUND ROUTE", service)
-            return result.text, result.status_code, result.headers.items()
-    print("NO ROUTE")
-    return {"error": 'No route from gateway'}, 400
+                error = e
+            proxy.balancer.record_check(pool, replica, error)
+        sleep(HEALTH_CHECK_INTERVAL)
+
+
+if HEALTH_CHECK_INTERVAL > 0:
+    Thread(target=check_replicas, daemon=True).start()
+
+
+def read_events(policy, address):
+    # подписка на одну реплику, при обрыве переподключается с Last-Event-ID
+    last_event_id = None
+    backoff = 1
+    while True:
+        headers = {"Accept": "text/event-stream"}
+        if last_event_id:
+            headers["Last-Event-ID"] = last_event_id
+        try:
+            result = authorized_request(
+                policy.service, address, "GET", EVENTS_UPSTREAM_PATH,
+                headers=headers, stream=True, timeout=(policy.timeout, EVENTS_READ_TIMEOUT),
+            )
+            with result:
+                if result.status_code != 200:
+                    raise RequestException(f"status_code={result.status_code}")
+                log.info("subscribed to events", replica=address)
+                backoff = 1
+                parser = events.SSEParser()
+                decoder = getincrementaldecoder("utf-8")()
+                # read1 отдаёт то, что уже пришло: поток без chunked не ждёт конца ответа
+                for chunk in iter(lambda: result.raw.read1(STREAM_CHUNK_SIZE), b""):
+                    for event_id, event_type, data in parser.feed(decoder.decode(chunk)):
+                        last_event_id = event_id
+                        proxy.event_hub.publish(event_type, data)
+        except RequestException as e:
+            log.warning("events stream lost", replica=address, error=str(e), retry_in=backoff)
+        sleep(backoff)
+        backoff = min(backoff * 2, EVENTS_MAX_BACKOFF)
+
+
+event_readers_lock = Lock()
+event_readers_started = False
+
+
+def start_event_readers():
+    # подписка на апстрим появляется вместе с первым клиентом
+    global event_readers_started
+    with event_readers_lock:
+        if event_readers_started:
+            return
+        event_readers_started = True
+    policy = proxy.EVENTS_ROUTE
+    for replica in proxy.balancer.get(policy.service).replicas:
+        Thread(target=read_events, args=(policy, replica.address), daemon=True).start()
 
 
 # Точка входа ##############################
@@ -0,0 +1,172 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from heapq import heappop, heappush
+from itertools import count
+from threading import BoundedSemaphore, Condition, Lock, Thread
+from time import monotonic
+
+import logger
+
+log = logger.get("gateway.hedging")
+
+
+class LatencyWindow:
+    """Последние max_samples задержек маршрута для оценки перцентиля"""
+
+    def __init__(self, max_samples):
+        self.samples = deque(maxlen=max_samples)
+        self.lock = Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p, min_samples):
+        with self.lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class HedgeBudget:
+    """Каждый запрос добавляет ratio токена (не больше burst), повторный запрос тратит целый:
+    дополнительная нагрузка не превышает ratio от основной"""
+
+    def __init__(self, ratio, burst):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.lock = Lock()
+
+    def on_request(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def refund(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+
+class Hedger:
+    def __init__(self, percentile, initial_delay, min_delay, window, min_samples, budget_ratio, budget_burst):
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.budget = HedgeBudget(budget_ratio, budget_burst)
+        self.latencies = {}
+        self.lock = Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.denied = 0
+        self.rejected = 0
+
+    def _window(self, route):
+        window = self.latencies.get(route.prefix)
+        if window is None:
+            with self.lock:
+                window = self.latencies.setdefault(route.prefix, LatencyWindow(self.window))
+        return window
+
+    def delay(self, route):
+        """Сколько ждать первый ответ, прежде чем отправить второй запрос"""
+        self.requests += 1
+        self.budget.on_request()
+        delay = self._window(route).percentile(self.percentile, self.min_samples)
+        return self.initial_delay if delay is None else max(self.min_delay, delay)
+
+    def observe(self, route, seconds):
+        self._window(route).add(seconds)
+
+    def try_hedge(self):
+        if self.budget.try_spend():
+            self.hedged += 1
+            return True
+        self.denied += 1
+        return False
+
+    def on_hedge_win(self):
+        self.hedge_wins += 1
+
+    def cancel_hedge(self):
+        # токен потрачен, но хедж так и не ушёл: возвращаем токен в бюджет
+        self.budget.refund()
+        self.hedged -= 1
+
+    def on_hedge_rejected(self):
+        # бюджет разрешил, но все потоки хеджирования сервиса заняты
+        self.cancel_hedge()
+        self.rejected += 1
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "budget_denied": self.denied,
+            "workers_busy": self.rejected,
+            "budget_tokens": self.budget.tokens,
+        }
+
+
+class DelayedCalls:
+    """Один фоновый поток вызывает fn через delay секунд, если вызов не отменили раньше"""
+
+    def __init__(self):
+        self.calls = []
+        self.order = count()
+        self.condition = Condition()
+        self.thread = None
+
+    def call_later(self, delay, fn):
+        call = [monotonic() + delay, next(self.order), fn]
+        with self.condition:
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+            heappush(self.calls, call)
+            self.condition.notify()
+        return call
+
+    @staticmethod
+    def cancel(call):
+        call[2] = None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.calls or self.calls[0][0] > monotonic():
+                    self.condition.wait(self.calls[0][0] - monotonic() if self.calls else None)
+                _, _, fn = heappop(self.calls)
+            if fn is None:
+                continue
+            try:
+                fn()
+            except Exception:
+                log.exception("delayed call failed")
+
+
+class HedgeLane:
+    """Потоки для хеджирующих запросов одного сервиса: не больше workers одновременно,
+    лишний хедж не ставится в очередь, а не отправляется вовсе"""
+
+    def __init__(self, service, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"hedge-{service}")
+        self.slots = BoundedSemaphore(workers)
+
+    def try_submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            return None
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
@@ -0,0 +1,141 @@
+from time import perf_counter, time
+import argparse
+import json
+import tracemalloc
+
+import jwt_backend
+
+# Сравнение реализаций JWT на токенах, которые реально выпускает система:
+#   python3 jwt_bench.py [--backends hs256,jose,pyjwt] [--iterations 20000] [--json]
+# Сначала проверяется совместимость: токен любой реализации читается всеми остальными,
+# испорченный, просроченный и с неверными aud, iat, sub, jti отклоняются.
+# Несовместимая реализация в замеры не попадает
+
+SECRET = "car_12345"
+USER_SECRET = "user_jwt_secret"
+
+
+def token_shapes():
+    now = int(time())
+    return {
+        # auth.create_jwt_token: межсервисные вызовы
+        "service": ({"client_id": "booking_service", "iat": now, "exp": now + 3600}, SECRET),
+        # session.get_token: cookie пользователя, проверяется гейтвеем и сессией
+        "user": ({"user_id": 42, "is_admin": False, "user": "ivan.petrov", "exp": now + 3600}, USER_SECRET),
+    }
+
+
+def available_backends(names):
+    backends = {}
+    for name in names:
+        try:
+            backends[name] = jwt_backend.get_backend(name)
+        except ImportError as e:
+            print(f"{name}: не установлен ({e})")
+    return backends
+
+
+def check_compliance(backends):
+    failures = {name: [] for name in backends}
+    for shape, (claims, secret) in token_shapes().items():
+        expired = {**claims, "exp": int(time()) - 10}
+        for issuer_name, issuer in backends.items():
+            token = issuer.encode(claims, secret)
+            bad_signature = token[:-4] + ("AAAA" if not token.endswith("AAAA") else "BBBB")
+            for name, backend in backends.items():
+                try:
+                    if backend.decode(token, secret) != claims:
+                        failures[name].append(f"{shape}/{issuer_name}: claims differ")
+                except jwt_backend.JWTError as e:
+                    failures[name].append(f"{shape}/{issuer_name}: rejected valid token ({e})")
+                for label, bad_token, bad_secret, error in (
+                    ("bad signature", bad_signature, secret, jwt_backend.JWTError),
+                    ("wrong secret", token, secret + "x", jwt_backend.JWTError),
+                    ("expired", issuer.encode(expired, secret), secret, jwt_backend.ExpiredSignatureError),
+                    ("foreign audience", issuer.encode({**claims, "aud": "other_service"}, secret), secret, jwt_backend.JWTError),
+                    ("non-integer iat", issuer.encode({**claims, "iat": "yesterday"}, secret), secret, jwt_backend.JWTError),
+                    ("non-string sub", issuer.encode({**claims, "sub": 42}, secret), secret, jwt_backend.JWTError),
+                    ("non-string jti", issuer.encode({**claims, "jti": 42}, secret), secret, jwt_backend.JWTError),
+                    ("garbage", "not.a.token", secret, jwt_backend.JWTError),
+                ):
+                    try:
+                        backend.decode(bad_token, bad_secret)
+                        failures[name].append(f"{shape}/{issuer_name}: accepted {label}")
+                    except error:
+                        pass
+                    except Exception as e:
+                        failures[name].append(f"{shape}/{issuer_name}: {label} raised {type(e).__name__}")
+    return failures
+
+
+def ops_per_second(operation, iterations):
+    for _ in range(min(iterations, 1000)):
+        operation()
+    started = perf_counter()
+    for _ in range(iterations):
+        operation()
+    return iterations / (perf_counter() - started)
+
+
+def peak_bytes(operation, samples=200):
+    # сколько памяти операция занимает на пике сверх уже занятой
+    tracemalloc.start()
+    try:
+        operation()
+        worst = 0
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            operation()
+            worst = max(worst, tracemalloc.get_traced_memory()[1] - current)
+        return worst
+    finally:
+        tracemalloc.stop()
+
+
+def run(backends, iterations):
+    results = []
+    for shape, (claims, secret) in token_shapes().items():
+        for name, backend in backends.items():
+            token = backend.encode(claims, secret)
+            encode = lambda: backend.encode(claims, secret)
+            verify = lambda: backend.decode(token, secret)
+            results.append({
+                "backend": name,
+                "token": shape,
+                "encode_ops": round(ops_per_second(encode, iterations)),
+                "verify_ops": round(ops_per_second(verify, iterations)),
+                "encode_peak_bytes": peak_bytes(encode),
+                "verify_peak_bytes": peak_bytes(verify),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JWT backends benchmark")
+    parser.add_argument("--backends", default=",".join(jwt_backend.BACKENDS))
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--json", action="store_true", help="результат одной строкой json")
+    args = parser.parse_args()
+
+    backends = available_backends([name.strip() for name in args.backends.split(",") if name.strip()])
+    failures = check_compliance(backends)
+    for name, problems in failures.items():
+        if problems:
+            print(f"{name}: несовместим, в замерах не участвует")
+            for problem in problems:
+                print("   ", problem)
+            del backends[name]
+
+    results = run(backends, args.iterations)
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(f"{'backend':8} {'token':8} {'encode/s':>10} {'verify/s':>10} {'encode B':>9} {'verify B':>9}")
+    for r in results:
+        print(f"{r['backend']:8} {r['token']:8} {r['encode_ops']:>10} {r['verify_ops']:>10} "
+              f"{r['encode_peak_bytes']:>9} {r['verify_peak_bytes']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+from bisect import bisect_left
+from threading import Lock, current_thread, local
+
+# Верхние границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Словари завершившихся потоков сворачиваются, когда потоков со словарями набирается столько
+# (и вдвое больше живых после прошлой свёртки), даже если /metrics никто не читает
+SHARD_FOLD_THRESHOLD = 64
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+def _labels(names, values):
+    return tuple(zip(names, (str(v) for v in values)))
+
+
+def _format_labels(labels, extra=()):
+    labels = (*labels, *extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Registry:
+    """Метрики пишутся в словарь текущего потока без блокировок; при сборе
+    словари всех потоков суммируются. Словари завершившихся потоков сворачиваются
+    в общий при сборе и при появлении новых потоков, чтобы их число не росло
+    с каждым потоком werkzeug"""
+
+    def __init__(self):
+        self.local = local()
+        self.shards = []
+        self.retired = {}
+        self.fold_at = SHARD_FOLD_THRESHOLD
+        self.lock = Lock()
+        self.families = {}
+        self.buckets = {}
+        self.callbacks = []
+
+    def _shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards.append((current_thread(), shard))
+                if len(self.shards) >= self.fold_at:
+                    self._fold_finished()
+                    self.fold_at = max(SHARD_FOLD_THRESHOLD, 2 * len(self.shards))
+        return shard
+
+    def _fold_finished(self):
+        # под self.lock; завершившийся поток в свой словарь уже не пишет
+        alive = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self.retired, shard)
+        self.shards = alive
+
+    def _family(self, name, kind, help_text, label_names):
+        self.families[name] = (kind, help_text)
+        return name, tuple(label_names)
+
+    def counter(self, name, help_text, label_names=()):
+        return Counter(self, *self._family(name, COUNTER, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return Counter(self, *self._family(name, GAUGE, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.buckets[name] = buckets
+        return Histogram(self, *self._family(name, HISTOGRAM, help_text, label_names), buckets)
+
+    def callback(self, name, kind, help_text, fn):
+        # fn() -> {(("label", "value"), ...): число}
+        self.families[name] = (kind, help_text)
+        self.callbacks.append((name, fn))
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in shard.items():
+            if isinstance(value, list):
+                total = into.get(key)
+                if total is None:
+                    into[key] = list(value)
+                else:
+                    for i, v in enumerate(value):
+                        total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def collect(self):
+        with self.lock:
+            self._fold_finished()
+            totals = {}
+            self._merge(totals, self.retired)
+            for _, shard in self.shards:
+                self._merge(totals, shard.copy())
+        for name, fn in self.callbacks:
+            for labels, value in fn().items():
+                totals[(name, labels)] = value
+        return totals
+
+    def render(self):
+        totals = self.collect()
+        by_family = {}
+        for (name, labels), value in totals.items():
+            by_family.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, help_text) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_family.get(name, [])):
+                if kind != HISTOGRAM:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                total_sum, count = value[0], value[1]
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets[name], value[2:]):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total_sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    def __init__(self, registry, name, label_names):
+        self.registry = registry
+        self.name = name
+        self.label_names = label_names
+
+    def inc(self, *label_values, amount=1):
+        shard = self.registry._shard()
+        key = (self.name, _labels(self.label_names, label_values))
+        shard[key] = shard.get(key, 0) + amount
+
+    def dec(self, *label_values):
+        self.inc(*label_values, amount=-1)
+
+
+class Histogram:
+    def __init__(self, registry, name, label_names, buckets):
+        self.registry = registry
+        self.name = name
+        self.label_names = label_names
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        shard = self.registry._shard()
+        key = (self.name, _labels(self.label_names, label_values))
+        data = shard.get(key)
+        if data is None:
+            # [сумма, количество, счётчики корзин..., больше последней границы]
+            data = shard[key] = [0.0, 0] + [0] * (len(self.buckets) + 1)
+        data[0] += value
+        data[1] += 1
+        data[2 + bisect_left(self.buckets, value)] += 1
@@ -0,0 +1,289 @@
+from math import ceil
+from time import perf_counter
+
+from config import FRONT_URL, USER_JWT_SECRET
+from config import USER_TOKEN_CACHE_SIZE, USER_TOKEN_NEGATIVE_CACHE_SIZE
+from config import USER_TOKEN_NEGATIVE_TTL, USER_TOKEN_MAX_TTL
+from config import UPSTREAM_GUARD_DEFAULTS
+from config import BALANCE_STRATEGY, HEALTH_UNHEALTHY_THRESHOLD, HEALTH_HEALTHY_THRESHOLD
+from config import RATE_LIMIT_MAX_KEYS, RATE_LIMIT_STORE
+from config import HEDGE_PERCENTILE, HEDGE_INITIAL_DELAY, HEDGE_MIN_DELAY, HEDGE_WINDOW, HEDGE_MIN_SAMPLES
+from config import HEDGE_BUDGET, HEDGE_BUDGET_BURST
+from config import EVENTS_BUFFER, EVENTS_UPSTREAM_PATH
+from config import LAST_WRITE_COOKIE_MAX_AGE
+from config import RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_ENTRY_BYTES
+from balancer import Balancer
+from events import EventHub
+from hedging import Hedger
+from metrics import Registry, GAUGE
+from ratelimit import MemoryBuckets, RateLimiter, SqliteBuckets
+from resilience import UpstreamGuards, UpstreamUnavailable
+from response_cache import ResponseCache
+from token_cache import TokenCache
+import jwt_backend
+import router
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': f'http://{FRONT_URL}',
+    'Access-Control-Allow-Headers': 'Origin, Content-Type, Authorization',
+    'Access-Control-Allow-Credentials': 'true',
+    'Access-Control-Allow-Methods': 'HEAD, GET, POST, DELETE, PUT, PATCH, OPTIONS',
+}
+
+
+def _decode_user_token(token):
+    return jwt_backend.decode(token, USER_JWT_SECRET)
+
+
+user_tokens = TokenCache(
+    _decode_user_token,
+    max_size=USER_TOKEN_CACHE_SIZE,
+    negative_size=USER_TOKEN_NEGATIVE_CACHE_SIZE,
+    negative_ttl=USER_TOKEN_NEGATIVE_TTL,
+    max_ttl=USER_TOKEN_MAX_TTL,
+)
+
+
+def decode_user_token(token):
+    return user_tokens.get(token)
+
+
+def user_headers(user):
+    return {"user_id": str(user.get("user_id")), "is_admin": str(int(user.get("is_admin")))}
+
+
+LAST_WRITE_HEADER = "X-Last-Write"
+LAST_WRITE_COOKIE = "last_write"
+
+
+def last_write_headers(cookies):
+    # метка недавней записи пользователя уходит сервисам вместе с запросом
+    last_write = cookies.get(LAST_WRITE_COOKIE)
+    return {LAST_WRITE_HEADER: last_write} if last_write else {}
+
+
+def set_last_write_cookie(response, upstream_headers):
+    # response - ответ Flask или Starlette, у обоих set_cookie с одинаковыми параметрами
+    last_write = upstream_headers.get(LAST_WRITE_HEADER)
+    if last_write:
+        response.set_cookie(LAST_WRITE_COOKIE, last_write, max_age=LAST_WRITE_COOKIE_MAX_AGE, httponly=True)
+    return response
+
+
+# Собирается один раз при старте
+ROUTER = router.load_router()
+# Только для них действует retries из политики маршрута
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+# Запросы с этими методами сбрасывают кэш ответов своего маршрута
+WRITE_METHODS = {"POST", "PUT", "DELETE", "PATCH"}
+
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    max_entry_bytes=RESPONSE_CACHE_MAX_ENTRY_BYTES,
+)
+
+
+upstream_guards = UpstreamGuards(UPSTREAM_GUARD_DEFAULTS, router.load_upstream_policies())
+# Breaker и bulkhead общие на сервис, здоровье отслеживается для каждой реплики
+balancer = Balancer(ROUTER.services(), BALANCE_STRATEGY, HEALTH_UNHEALTHY_THRESHOLD, HEALTH_HEALTHY_THRESHOLD)
+
+
+rate_limiter = RateLimiter(
+    SqliteBuckets(RATE_LIMIT_STORE) if RATE_LIMIT_STORE else MemoryBuckets(RATE_LIMIT_MAX_KEYS)
+)
+
+
+hedger = Hedger(
+    percentile=HEDGE_PERCENTILE,
+    initial_delay=HEDGE_INITIAL_DELAY,
+    min_delay=HEDGE_MIN_DELAY,
+    window=HEDGE_WINDOW,
+    min_samples=HEDGE_MIN_SAMPLES,
+    budget_ratio=HEDGE_BUDGET,
+    budget_burst=HEDGE_BUDGET_BURST,
+)
+
+
+def rate_limit(route, user, remote_addr):
+    # анонимные запросы ограничиваются по адресу клиента
+    client = f"user:{user.get('user_id')}" if user else f"addr:{remote_addr}"
+    return rate_limiter.check(route, client)
+
+
+def rate_limited_error(route, retry_after):
+    return (
+        {"error": "too many requests", "details": f"rate limit for /{route.prefix} exceeded"},
+        429,
+        {"Retry-After": str(ceil(retry_after))},
+    )
+
+
+def is_upstream_failure(status_code):
+    return status_code >= 500
+
+
+def find_route(path):
+    return ROUTER.match(path)
+
+
+# Маршрут, через который гейтвей подписан на события; его invalidates сбрасываются на каждое событие
+EVENTS_ROUTE = find_route(EVENTS_UPSTREAM_PATH)
+
+
+def find_client_route(path):
+    # Поток событий апстрима бесконечен: его нельзя ни буферизовать, ни кэшировать,
+    # ни хеджировать. Клиенты получают его через /events гейтвея
+    if EVENTS_ROUTE and path.strip("/") == EVENTS_UPSTREAM_PATH.strip("/"):
+        return None
+    return find_route(path)
+
+
+def is_event_stream(headers):
+    content_type = headers.get("Content-Type") or headers.get("content-type") or ""
+    return content_type.split(";")[0].strip().lower() == "text/event-stream"
+
+
+def _on_availability_event(event):
+    if EVENTS_ROUTE:
+        response_cache.invalidate(EVENTS_ROUTE.invalidates)
+
+
+event_hub = EventHub(EVENTS_BUFFER, on_event=_on_availability_event)
+
+
+def request_scope(route, user):
+    # Ответ общего кэшируемого маршрута одинаков для всех с тем же is_admin,
+    # остальные зависят от пользователя
+    if user is None:
+        return "anonymous"
+    is_admin = int(bool(user.get('is_admin')))
+    if route.cacheable and route.cache_scope == "shared":
+        return f"admin:{is_admin}"
+    return f"user:{user.get('user_id')}:admin:{is_admin}"
+
+
+def cache_key(route, method, path, user):
+    if not route.cacheable or method != "GET":
+        return None
+    return route.prefix, request_scope(route, user), path
+
+
+def coalesce_key(route, method, path, query, user):
+    if not route.coalesce or method != "GET":
+        return None
+    return method, path, query, request_scope(route, user)
+
+
+def is_buffered(route, method):
+    return method == "GET" and (route.cacheable or route.coalesce or route.hedge)
+
+
+def attempts(route, method, body=None):
+    if method in IDEMPOTENT_METHODS and is_replayable(body):
+        return route.retries + 1
+    return 1
+
+
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade",
+}
+# Их выставляет сам сервер гейтвея
+SERVER_HEADERS = {"date", "server"}
+
+
+# Тело уже распаковано клиентом апстрима, длину выставит сервер гейтвея
+DECODED_BODY_HEADERS = {"content-length", "content-encoding"}
+
+
+def response_headers(headers):
+    return {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP_HEADERS | SERVER_HEADERS}
+
+
+def decoded_response_headers(headers):
+    return {k: v for k, v in response_headers(headers).items() if k.lower() not in DECODED_BODY_HEADERS}
+
+
+def request_body_headers(headers):
+    result = {}
+    for name in ("Content-Type", "Content-Length"):
+        if headers.get(name):
+            result[name] = headers.get(name)
+    return result
+
+
+def is_replayable(body):
+    return body is None or isinstance(body, bytes)
+
+
+# Метрики (/metrics) ##############################
+
+registry = Registry()
+request_latency = registry.histogram(
+    "gateway_request_duration_seconds", "Request latency by route prefix", ("route",)
+)
+requests_total = registry.counter(
+    "gateway_requests_total", "Responses by route prefix, method and status", ("route", "method", "status")
+)
+in_flight = registry.gauge("gateway_in_flight_requests", "Requests being handled by the gateway")
+upstream_latency = registry.histogram(
+    "gateway_upstream_duration_seconds", "Upstream call latency by service", ("service",)
+)
+upstream_responses = registry.counter(
+    "gateway_upstream_responses_total", "Upstream responses by service and status", ("service", "status")
+)
+reauth_total = registry.counter(
+    "gateway_reauth_total", "Service token re-authentications by service", ("service",)
+)
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def observe_request(route, method, status, started):
+    request_latency.observe(perf_counter() - started, route)
+    requests_total.inc(route, method, status)
+
+
+def observe_upstream(service, status, started):
+    upstream_latency.observe(perf_counter() - started, service)
+    upstream_responses.inc(service, status)
+
+
+def register_stats(name, help_text, stats):
+    registry.callback(name, GAUGE, help_text, lambda: {(("stat", k),): v for k, v in stats().items()})
+
+
+def _upstream_stats():
+    result = {}
+    for service, stats in upstream_guards.stats().items():
+        stats = {**stats, "state": BREAKER_STATES[stats["state"]]}
+        for k, v in stats.items():
+            result[(("service", service), ("stat", k))] = v
+    return result
+
+
+def _replica_stats():
+    result = {}
+    for service, replicas in balancer.stats().items():
+        for address, stats in replicas.items():
+            for k in ("healthy", "outstanding", "failures"):
+                result[(("service", service), ("replica", address), ("stat", k))] = int(stats[k])
+    return result
+
+
+register_stats("gateway_user_token_cache", "User token cache counters", user_tokens.stats)
+register_stats("gateway_response_cache", "Response cache counters", response_cache.stats)
+register_stats("gateway_hedging", "Hedged GET requests, hedge wins and budget", hedger.stats)
+register_stats("gateway_events", "Availability event subscribers, events received and dropped subscribers",
+               event_hub.stats)
+register_stats("gateway_rate_limit", "Rate limiter decisions and tracked buckets", rate_limiter.stats)
+registry.callback(
+    "gateway_upstream_guard", GAUGE,
+    "Upstream in-flight requests, bulkhead rejections and breaker state (0 closed, 1 half-open, 2 open)",
+    _upstream_stats,
+)
+registry.callback(
+    "gateway_upstream_replica", GAUGE, "Replica health (1 in rotation), outstanding requests and failures in a row",
+    _replica_stats,
+)
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+from threading import Lock, local
+from time import monotonic, time
+import sqlite3
+
+import logger
+
+log = logger.get("gateway.ratelimit")
+
+
+class MemoryBuckets:
+    """Token bucket в памяти процесса, самые давно не использованные ключи вытесняются"""
+
+    shared = False
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = Lock()
+
+    def take(self, key, rate, burst):
+        now = monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def size(self):
+        return len(self.buckets)
+
+
+class SqliteBuckets:
+    """Token bucket в общем sqlite файле: воркеры гейтвея на одной машине видят одни лимиты.
+    Если файл недоступен, запрос пропускается"""
+
+    shared = True
+
+    def __init__(self, path, idle_timeout=3600, cleanup_every=1000):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.cleanup_every = cleanup_every
+        self.calls = 0
+        self.local = local()
+        with self.connection() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+        return db
+
+    def take(self, key, rate, burst):
+        # часы общие для всех процессов, поэтому time(), а не monotonic()
+        now = time()
+        try:
+            db = self.connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (burst, now)
+                tokens = min(burst, tokens + max(0, now - updated) * rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                db.execute("INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)", (key, tokens, now))
+                self.calls += 1
+                if self.calls % self.cleanup_every == 0:
+                    db.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - self.idle_timeout,))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            log.error("rate limit store error", error=str(e))
+            return True, 0
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def size(self):
+        try:
+            return self.connection().execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+        except sqlite3.Error:
+            return -1
+
+
+class RateLimiter:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.allowed = 0
+        self.limited = 0
+
+    def check(self, route, client):
+        """Возвращает 0, если запрос можно пропустить, иначе через сколько секунд повторить"""
+        if route.rate_limit <= 0:
+            return 0
+        allowed, retry_after = self.buckets.take(f"{route.prefix}:{client}", route.rate_limit, route.rate_burst)
+        if allowed:
+            self.allowed += 1
+            return 0
+        self.limited += 1
+        return retry_after
+
+    def stats(self):
+        return {"allowed": self.allowed, "limited": self.limited, "keys": self.buckets.size()}
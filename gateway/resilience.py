@@ -0,0 +1,142 @@
+from math import ceil
+from threading import Lock
+from time import monotonic
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """closed -> open после failure_threshold ошибок подряд; через reset_timeout
+    пропускается half_open_calls пробных запросов: успех закрывает, ошибка снова открывает.
+    Успехи в состоянии open не учитываются"""
+
+    def __init__(self, failure_threshold, reset_timeout, half_open_calls=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probes = 0
+        self.lock = Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True, 0
+            if self.state == OPEN:
+                wait = self.opened_at + self.reset_timeout - monotonic()
+                if wait > 0:
+                    return False, wait
+                self.state = HALF_OPEN
+                self.probes = 0
+            if self.probes >= self.half_open_calls:
+                return False, self.reset_timeout
+            self.probes += 1
+            return True, 0
+
+    def cancel_probe(self):
+        # пробный запрос так и не был отправлен
+        with self.lock:
+            if self.state == HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def on_success(self):
+        with self.lock:
+            # запоздалый ответ на запрос, пропущенный до срабатывания, не сокращает остывание
+            if self.state == OPEN:
+                return
+            self.state = CLOSED
+            self.failures = 0
+
+    def on_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = monotonic()
+
+
+class Bulkhead:
+    """Не больше max_concurrent одновременных запросов к сервису, лишние отклоняются сразу"""
+
+    def __init__(self, max_concurrent):
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.rejected = 0
+        self.lock = Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            if self.active >= self.max_concurrent:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+
+class UpstreamGuard:
+    def __init__(self, service, failure_threshold, reset_timeout, max_concurrent):
+        self.service = service
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.bulkhead = Bulkhead(max_concurrent)
+
+    def enter(self):
+        allowed, wait = self.breaker.allow()
+        if not allowed:
+            raise UpstreamUnavailable(f"circuit for {self.service} is open", ceil(wait))
+        if not self.bulkhead.try_acquire():
+            self.breaker.cancel_probe()
+            raise UpstreamUnavailable(f"too many concurrent requests to {self.service}", 1)
+
+    def exit(self, failed):
+        # failed=None - запрос отменён, исхода нет: освобождается только место в bulkhead
+        self.bulkhead.release()
+        if failed is None:
+            self.breaker.cancel_probe()
+        elif failed:
+            self.breaker.on_failure()
+        else:
+            self.breaker.on_success()
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "failures": self.breaker.failures,
+            "active": self.bulkhead.active,
+            "max_concurrent": self.bulkhead.max_concurrent,
+            "rejected": self.bulkhead.rejected,
+        }
+
+
+class UpstreamGuards:
+    def __init__(self, defaults, overrides):
+        self.defaults = defaults
+        self.overrides = overrides
+        self.guards = {}
+        self.lock = Lock()
+
+    def get(self, service):
+        guard = self.guards.get(service)
+        if guard is None:
+            with self.lock:
+                guard = self.guards.get(service)
+                if guard is None:
+                    params = {**self.defaults, **self.overrides.get(service, {})}
+                    guard = self.guards[service] = UpstreamGuard(service, **params)
+        return guard
+
+    def stats(self):
+        return {service: guard.stats() for service, guard in list(self.guards.items())}
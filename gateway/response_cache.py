@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class CachedResponse:
+    __slots__ = ("status", "headers", "body", "prefix", "expires_at")
+
+    def __init__(self, status, headers, body, prefix, expires_at):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.prefix = prefix
+        self.expires_at = expires_at
+
+
+def prefix_matches(prefix, invalidated):
+    return prefix == invalidated or prefix.startswith(invalidated + "/")
+
+
+class ResponseCache:
+    """LRU ответов апстримов с TTL и ограничением по числу записей и байтам.
+
+    Запись, которая сходила в апстрим до инвалидации, не сохраняется: put()
+    сверяет поколение, снятое перед запросом, с текущим
+    """
+
+    def __init__(self, max_entries, max_bytes, max_entry_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= len(entry.body)
+
+    def get(self, key):
+        now = time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, prefix, ttl, generation, status, headers, body):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = CachedResponse(status, headers, body, prefix, time() + ttl)
+            self.size += len(body)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, prefixes):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            for key in [k for k, e in self.entries.items()
+                        if any(prefix_matches(e.prefix, p) for p in prefixes)]:
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
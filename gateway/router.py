@@ -0,0 +1,119 @@
+from string import Template
+import json
+import os
+
+from config import ROUTING_TABLE, ROUTE_POLICIES, ROUTES_CONFIG, SERVICE_URLS, UPSTREAM_TIMEOUT
+from config import RATE_LIMIT, RATE_LIMIT_BURST
+
+
+class RoutePolicy:
+    def __init__(self, prefix, service, timeout=UPSTREAM_TIMEOUT, retries=0, cacheable=False, cache_ttl=30,
+                 cache_scope="shared", invalidates=(), coalesce=False, auth_required=True,
+                 rate_limit=RATE_LIMIT, rate_burst=RATE_LIMIT_BURST, hedge=False):
+        if cache_scope not in ("shared", "private"):
+            raise ValueError(f"unknown cache_scope {cache_scope!r} for route {prefix!r}")
+        self.prefix = "/".join(split_path(prefix))
+        self.service = service
+        self.timeout = timeout
+        self.retries = retries
+        self.cacheable = cacheable
+        self.cache_ttl = cache_ttl
+        self.cache_scope = cache_scope
+        self.invalidates = [self.prefix, *invalidates]
+        self.coalesce = coalesce
+        self.auth_required = auth_required
+        self.rate_limit = rate_limit
+        self.rate_burst = max(1, rate_burst)
+        self.hedge = hedge
+
+    def __repr__(self):
+        return f"RoutePolicy({self.prefix!r} -> {self.service})"
+
+
+class _Node:
+    __slots__ = ("children", "route")
+
+    def __init__(self):
+        self.children = {}
+        self.route = None
+
+
+def split_path(path):
+    return [segment for segment in path.split("/") if segment]
+
+
+class Router:
+    """Префиксное дерево по сегментам пути: побеждает самый длинный совпавший префикс"""
+
+    def __init__(self, routes=()):
+        self.root = _Node()
+        self.routes = []
+        for route in routes:
+            self.add(route)
+
+    def add(self, route):
+        node = self.root
+        for segment in split_path(route.prefix):
+            node = node.children.setdefault(segment, _Node())
+        node.route = route
+        self.routes.append(route)
+
+    def match(self, path):
+        node = self.root
+        found = node.route
+        for segment in split_path(path):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.route is not None:
+                found = node.route
+        return found
+
+    def services(self):
+        return {route.service for route in self.routes}
+
+
+def expand_service(service):
+    # адрес сервиса можно задать через переменную окружения: "${CAR_SERVICE_URL}"
+    return Template(service).substitute({**os.environ, **SERVICE_URLS})
+
+
+def load_routes(config_path):
+    with open(config_path) as f:
+        config = json.load(f)
+    routes = []
+    for prefix, params in config["routes"].items():
+        params = dict(params)
+        service = params.pop("service")
+        # реплики можно задать списком
+        if isinstance(service, list):
+            service = ",".join(service)
+        service = expand_service(service)
+        routes.append(RoutePolicy(prefix, service, **params))
+    return routes
+
+
+def load_upstream_policies():
+    if not ROUTES_CONFIG:
+        return {}
+    with open(ROUTES_CONFIG) as f:
+        config = json.load(f)
+    return {expand_service(service): params for service, params in config.get("upstreams", {}).items()}
+
+
+def default_routes():
+    return [
+        RoutePolicy(prefix, service, **ROUTE_POLICIES.get(prefix, {}))
+        for prefix, service in ROUTING_TABLE.items()
+    ]
+
+
+def load_router():
+    if ROUTES_CONFIG:
+        print("LOADING ROUTES FROM", ROUTES_CONFIG)
+        router = Router(load_routes(ROUTES_CONFIG))
+    else:
+        router = Router(default_routes())
+    for route in router.routes:
+        print("ROUTE:", route.prefix, "->", route.service)
+    return router
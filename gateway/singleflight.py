@@ -0,0 +1,83 @@
+from threading import Event, Lock
+import asyncio
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Одинаковые одновременные вызовы выполняются один раз, результат получают все"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = Lock()
+        self.upstream_calls = 0
+        self.saved_calls = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.upstream_calls += 1
+            else:
+                self.saved_calls += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self.lock:
+            return {
+                "in_flight": len(self.calls),
+                "upstream_calls": self.upstream_calls,
+                "saved_calls": self.saved_calls,
+            }
+
+
+class AsyncSingleFlight:
+    """То же для asyncio: вызов идёт отдельной задачей, поэтому отмена одного
+    из ожидающих (например, клиент отключился) не отменяет его для остальных"""
+
+    def __init__(self):
+        self.calls = {}
+        self.upstream_calls = 0
+        self.saved_calls = 0
+
+    async def do(self, key, fn):
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+            self.upstream_calls += 1
+        else:
+            self.saved_calls += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self.calls),
+            "upstream_calls": self.upstream_calls,
+            "saved_calls": self.saved_calls,
+        }
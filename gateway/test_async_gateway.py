@@ -0,0 +1,106 @@
+import asyncio
+import os
+
+# гейтвей импортируется целиком, проверка реплик в фоне тестам не нужна
+os.environ.setdefault("HEALTH_CHECK_INTERVAL", "0")
+
+import httpx
+import pytest
+from starlette.requests import ClientDisconnect
+from starlette.testclient import TestClient
+
+from config import USER_JWT_SECRET
+import async_gateway
+import jwt_backend
+
+
+class UpstreamResponse:
+    """Ответ апстрима, который отдал один кусок тела и дальше молчит"""
+
+    def __init__(self):
+        self.closed = False
+
+    async def body(self):
+        yield b"first"
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+def stream(result, body):
+    return async_gateway.ClosingStreamingResponse(async_gateway.closing_stream(result, body), 200)
+
+
+def test_upstream_closed_when_client_disconnects():
+    # ASGI 2.0: отключение приходит через receive, пока тело ещё отдаётся
+    result = UpstreamResponse()
+    first_chunk = asyncio.Event()
+
+    async def send(message):
+        if message.get("body"):
+            first_chunk.set()
+
+    async def receive():
+        await first_chunk.wait()
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.0"}}
+    asyncio.run(asyncio.wait_for(stream(result, result.body())(scope, receive, send), 1))
+    assert result.closed
+
+
+def test_upstream_closed_when_send_fails():
+    # ASGI 2.4: отключение видно как ошибка send, генератор тела в этот момент стоит на yield
+    result = UpstreamResponse()
+
+    async def send(message):
+        if message.get("body"):
+            raise OSError("client went away")
+
+    async def receive():
+        return {"type": "http.request"}
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(asyncio.wait_for(stream(result, result.body())(scope, receive, send), 1))
+    assert result.closed
+
+
+def test_upstream_closed_after_full_body():
+    result = UpstreamResponse()
+
+    async def body():
+        yield b"only"
+
+    async def read():
+        return [chunk async for chunk in async_gateway.closing_stream(result, body())]
+
+    assert asyncio.run(read()) == [b"only"]
+    assert result.closed
+
+
+def test_unknown_path_without_token_is_unauthorized():
+    client = TestClient(async_gateway.app)
+    assert client.get("/nothing").status_code == 401
+    token = jwt_backend.encode({"user_id": 1, "is_admin": False}, USER_JWT_SECRET)
+    client.cookies.set("token", token)
+    assert client.get("/nothing").status_code == 400
+
+
+def test_last_write_marker_travels_with_the_user(monkeypatch):
+    # ответ с записью оставляет cookie, следующий запрос несёт метку в сервис
+    seen = []
+
+    async def proxy_request(policy, method, path, **kwargs):
+        seen.append(kwargs["headers"])
+        return httpx.Response(201, headers={"X-Last-Write": "123.000"}, stream=httpx.ByteStream(b"{}"))
+
+    monkeypatch.setattr(async_gateway, "proxy_request", proxy_request)
+    client = TestClient(async_gateway.app)
+    client.cookies.set("token", jwt_backend.encode({"user_id": 1, "is_admin": False}, USER_JWT_SECRET))
+    response = client.post("/booking", json={})
+    assert "X-Last-Write" not in seen[0]
+    assert "last_write=123.000" in response.headers["set-cookie"]
+    client.post("/booking", json={})
+    assert seen[1]["X-Last-Write"] == "123.000"
@@ -0,0 +1,239 @@
+from threading import Event, Thread
+from time import monotonic, sleep
+import io
+import os
+import socket
+
+# гейтвей импортируется целиком, проверка реплик в фоне тестам не нужна
+os.environ.setdefault("HEALTH_CHECK_INTERVAL", "0")
+
+import pytest
+import requests
+from urllib3 import HTTPResponse
+
+from abortable import AbortableAdapter, Attempt
+from config import USER_JWT_SECRET
+from hedging import DelayedCalls, HedgeBudget, HedgeLane, Hedger, LatencyWindow
+from router import RoutePolicy
+import abortable
+import gateway
+import jwt_backend
+import proxy
+
+
+def test_latency_window_percentile():
+    window = LatencyWindow(max_samples=100)
+    assert window.percentile(95, min_samples=1) is None
+    for ms in range(1, 101):
+        window.add(ms / 1000)
+    assert window.percentile(50, min_samples=100) == pytest.approx(0.051)
+    assert window.percentile(95, min_samples=100) == pytest.approx(0.096)
+    assert window.percentile(95, min_samples=101) is None
+
+
+def test_budget_limits_extra_load():
+    budget = HedgeBudget(ratio=0.25, burst=2)
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    for _ in range(3):
+        budget.on_request()
+    assert not budget.try_spend()
+    budget.on_request()
+    assert budget.try_spend()
+    budget.refund()
+    assert budget.try_spend()
+
+
+def test_delay_follows_observed_latency():
+    hedger = Hedger(percentile=90, initial_delay=0.5, min_delay=0.02, window=5, min_samples=5,
+                    budget_ratio=0.1, budget_burst=1)
+    route = RoutePolicy("/cars", "car:1", hedge=True)
+    assert hedger.delay(route) == 0.5
+    for seconds in (0.01, 0.01, 0.01, 0.01, 0.2):
+        hedger.observe(route, seconds)
+    assert hedger.delay(route) == 0.2
+    # окно скользящее: старые задержки вытесняются новыми
+    for _ in range(5):
+        hedger.observe(route, 0.001)
+    assert hedger.delay(route) == 0.02
+
+
+def test_delayed_calls_fire_in_order_and_can_be_cancelled():
+    calls = DelayedCalls()
+    fired = []
+    done = Event()
+    calls.call_later(0.04, lambda: (fired.append("late"), done.set()))
+    cancelled = calls.call_later(0.02, lambda: fired.append("cancelled"))
+    calls.call_later(0.01, lambda: fired.append("early"))
+    calls.cancel(cancelled)
+    assert done.wait(1)
+    assert fired == ["early", "late"]
+
+
+def test_lane_rejects_when_all_workers_busy():
+    lane = HedgeLane("car:1", workers=1)
+    release = Event()
+    first = lane.try_submit(release.wait, 1)
+    assert first is not None
+    assert lane.try_submit(lambda: None) is None
+    release.set()
+    first.result(1)
+    sleep(0.01)
+    assert lane.try_submit(lambda: "ok").result(1) == "ok"
+
+
+def test_abort_breaks_blocking_read():
+    # апстрим принимает соединение и молчит: без abort запрос ждал бы таймаута
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    address = "127.0.0.1:%d" % server.getsockname()[1]
+    session = requests.Session()
+    session.mount("http://", AbortableAdapter())
+    attempt = Attempt()
+    Thread(target=lambda: (sleep(0.1), attempt.abort()), daemon=True).start()
+    started = monotonic()
+    try:
+        with pytest.raises(requests.ConnectionError):
+            abortable.run(attempt, session.get, f"http://{address}/", timeout=5)
+    finally:
+        server.close()
+    assert monotonic() - started < 2
+    assert attempt.aborted
+
+
+# Гонка основного запроса и хеджа ##########
+
+SERVICE = sorted(gateway.hedge_lanes)[0]
+
+
+def answer(body, after=0):
+    def behaviour(attempt):
+        sleep(after)
+        return 200, {}, body
+    return behaviour
+
+
+def fail(after=0):
+    def behaviour(attempt):
+        sleep(after)
+        raise requests.ConnectionError("upstream failed")
+    return behaviour
+
+
+def hang(seen):
+    # отвечает, только если попытку не оборвали за секунду
+    def behaviour(attempt):
+        seen.append(attempt)
+        deadline = monotonic() + 1
+        while monotonic() < deadline:
+            if attempt.aborted:
+                raise requests.ConnectionError("aborted")
+            sleep(0.005)
+        return 200, {}, b"too late"
+    return behaviour
+
+
+@pytest.fixture
+def race(monkeypatch):
+    hedger = Hedger(percentile=95, initial_delay=0.05, min_delay=0.01, window=100, min_samples=1000,
+                    budget_ratio=1, budget_burst=10)
+    monkeypatch.setattr(proxy, "hedger", hedger)
+
+    def run(*behaviours, policy=None):
+        pending = list(behaviours)
+        monkeypatch.setattr(gateway, "read_upstream", lambda *args: pending.pop(0)(abortable.current()))
+        return gateway.hedged_read(policy or RoutePolicy("/test/hedge", SERVICE, hedge=True), "test/hedge", {})
+
+    run.hedger = hedger
+    return run
+
+
+def test_fast_primary_sends_no_hedge(race):
+    assert race(answer(b"primary")) == (200, {}, b"primary")
+    assert race.hedger.stats()["hedged"] == 0
+
+
+def test_hedge_wins_and_aborts_primary(race):
+    primary = []
+    assert race(hang(primary), answer(b"hedge")) == (200, {}, b"hedge")
+    assert primary[0].aborted
+    assert race.hedger.stats()["hedge_wins"] == 1
+
+
+def test_primary_wins_and_aborts_hedge(race):
+    hedge = []
+    assert race(answer(b"primary", after=0.1), hang(hedge)) == (200, {}, b"primary")
+    assert race.hedger.stats()["hedged"] == 1
+    assert hedge[0].aborted
+    assert race.hedger.stats()["hedge_wins"] == 0
+
+
+def test_failed_primary_waits_for_sent_hedge(race):
+    assert race(fail(after=0.1), answer(b"hedge", after=0.1)) == (200, {}, b"hedge")
+    assert race.hedger.stats()["hedge_wins"] == 1
+
+
+def test_primary_error_raised_when_hedge_also_fails(race):
+    with pytest.raises(requests.ConnectionError, match="upstream failed"):
+        race(fail(after=0.1), fail())
+
+
+def test_no_hedge_without_budget(race):
+    race.hedger.budget.tokens = race.hedger.budget.burst = 0
+    assert race(answer(b"primary", after=0.1)) == (200, {}, b"primary")
+    assert race.hedger.stats()["budget_denied"] == 1
+
+
+def test_no_hedge_when_lane_is_full(race, monkeypatch):
+    lane = HedgeLane(SERVICE, workers=1)
+    release = Event()
+    lane.try_submit(release.wait, 1)
+    monkeypatch.setitem(gateway.hedge_lanes, SERVICE, lane)
+    tokens = race.hedger.budget.tokens
+    try:
+        assert race(answer(b"primary", after=0.1)) == (200, {}, b"primary")
+    finally:
+        release.set()
+    stats = race.hedger.stats()
+    assert stats["workers_busy"] == 1 and stats["hedged"] == 0
+    # хедж не ушёл, значит и токен бюджета не потрачен
+    assert stats["budget_tokens"] == tokens
+
+
+def test_route_without_hedge_reads_directly(race):
+    policy = RoutePolicy("/test/plain", SERVICE)
+    assert race(answer(b"primary", after=0.1), policy=policy) == (200, {}, b"primary")
+    assert race.hedger.stats()["requests"] == 0
+
+
+# Неизвестный путь ##########
+
+def test_unknown_path_without_token_is_unauthorized():
+    client = gateway.app.test_client()
+    assert client.get("/nothing").status_code == 401
+    token = jwt_backend.encode({"user_id": 1, "is_admin": False}, USER_JWT_SECRET)
+    client.set_cookie("localhost", "token", token)
+    assert client.get("/nothing").status_code == 400
+
+
+def test_last_write_marker_travels_with_the_user(monkeypatch):
+    # ответ с записью оставляет cookie, следующий запрос несёт метку в сервис
+    seen = []
+
+    def proxy_request(policy, method, path, **kwargs):
+        seen.append(kwargs["headers"])
+        response = requests.Response()
+        response.status_code = 201
+        response.headers["X-Last-Write"] = "123.000"
+        response.raw = HTTPResponse(io.BytesIO(b"{}"), preload_content=False)
+        return response
+
+    monkeypatch.setattr(gateway, "proxy_request", proxy_request)
+    client = gateway.app.test_client()
+    client.set_cookie("localhost", "token", jwt_backend.encode({"user_id": 1, "is_admin": False}, USER_JWT_SECRET))
+    response = client.post("/booking", json={})
+    assert "X-Last-Write" not in seen[0]
+    assert "last_write=123.000" in response.headers["Set-Cookie"]
+    client.post("/booking", json={})
+    assert seen[1]["X-Last-Write"] == "123.000"
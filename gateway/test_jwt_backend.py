@@ -0,0 +1,100 @@
+from time import time
+import os
+
+import pytest
+from jose import jwt as jose_jwt
+
+import jwt_backend
+from jwt_backend import ExpiredSignatureError, HS256Backend, JoseBackend, JWTError
+
+SECRET = "car_12345"
+
+# токены, выпущенные python-jose: встроенная реализация должна читать их так же
+NOW = int(time())
+VECTORS = [
+    {"client_id": "booking_service", "iat": NOW, "exp": NOW + 3600},
+    {"user_id": 42, "is_admin": False, "user": "иван", "exp": NOW + 3600},
+    {"sub": "42", "jti": "a1", "nbf": NOW - 10, "scope": ["read", "write"]},
+]
+
+
+@pytest.fixture
+def hs256():
+    return HS256Backend()
+
+
+@pytest.mark.parametrize("claims", VECTORS)
+def test_decodes_jose_tokens(hs256, claims):
+    token = jose_jwt.encode(claims, SECRET, algorithm="HS256")
+    assert hs256.decode(token, SECRET) == claims
+
+
+@pytest.mark.parametrize("claims", VECTORS)
+def test_jose_decodes_hs256_tokens(hs256, claims):
+    token = hs256.encode(claims, SECRET)
+    assert jose_jwt.decode(token, SECRET, algorithms=["HS256"]) == claims
+    assert jose_jwt.get_unverified_header(token) == {"alg": "HS256", "typ": "JWT"}
+
+
+def test_jose_header_with_kid_accepted(hs256):
+    claims = VECTORS[0]
+    token = jose_jwt.encode(claims, SECRET, algorithm="HS256", headers={"kid": "k1"})
+    assert hs256.decode(token, SECRET) == claims
+
+
+def jose_rejects(token, secret=SECRET):
+    with pytest.raises(jose_jwt.JWTError):
+        jose_jwt.decode(token, secret, algorithms=["HS256"])
+
+
+@pytest.mark.parametrize("claims, error", [
+    ({"exp": NOW - 1}, ExpiredSignatureError),
+    ({"nbf": NOW + 60}, JWTError),
+    ({"iat": "yesterday"}, JWTError),
+    ({"exp": "tomorrow"}, JWTError),
+    ({"aud": "office_service"}, JWTError),
+    ({"sub": 42}, JWTError),
+    ({"jti": 42}, JWTError),
+])
+def test_rejects_claims_jose_rejects(hs256, claims, error):
+    token = jose_jwt.encode(claims, SECRET, algorithm="HS256")
+    jose_rejects(token)
+    with pytest.raises(error):
+        hs256.decode(token, SECRET)
+
+
+def test_rejects_bad_signature_and_wrong_secret(hs256):
+    token = jose_jwt.encode(VECTORS[0], SECRET, algorithm="HS256")
+    tampered = token[:-4] + ("AAAA" if not token.endswith("AAAA") else "BBBB")
+    for bad_token, secret in ((tampered, SECRET), (token, SECRET + "x")):
+        jose_rejects(bad_token, secret)
+        with pytest.raises(JWTError):
+            hs256.decode(bad_token, secret)
+
+
+@pytest.mark.parametrize("token", ["", "not.a.token", "a.b", "a.b.c.d", None])
+def test_rejects_garbage(hs256, token):
+    with pytest.raises(JWTError):
+        hs256.decode(token, SECRET)
+
+
+def test_rejects_other_algorithms(hs256):
+    token = jose_jwt.encode(VECTORS[0], SECRET, algorithm="HS512")
+    with pytest.raises(JWTError, match="alg"):
+        hs256.decode(token, SECRET)
+
+
+def test_mac_cache_is_bounded(hs256, monkeypatch):
+    monkeypatch.setattr(jwt_backend, "MAC_CACHE_SIZE", 4)
+    for i in range(10):
+        token = hs256.encode(VECTORS[0], f"secret-{i}")
+        assert hs256.decode(token, f"secret-{i}") == VECTORS[0]
+        assert len(hs256.macs) <= 4
+
+
+@pytest.mark.skipif("JWT_BACKEND" in os.environ, reason="реализация задана явно")
+def test_default_backend_is_jose():
+    assert jwt_backend.JWT_BACKEND == "jose"
+    assert isinstance(jwt_backend.backend, JoseBackend)
+    with pytest.raises(ValueError):
+        jwt_backend.get_backend("none")
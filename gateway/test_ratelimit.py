@@ -0,0 +1,87 @@
+import pytest
+
+import ratelimit
+from ratelimit import MemoryBuckets, RateLimiter, SqliteBuckets
+from router import RoutePolicy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "monotonic", clock)
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def buckets(request, tmp_path, clock):
+    if request.param == "memory":
+        return MemoryBuckets(max_keys=100)
+    return SqliteBuckets(str(tmp_path / "buckets.db"))
+
+
+def test_burst_then_limited(buckets):
+    assert [buckets.take("k", rate=2, burst=3)[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after = buckets.take("k", rate=2, burst=3)
+    assert not allowed and retry_after == pytest.approx(0.5)
+
+
+def test_refills_at_rate_up_to_burst(buckets, clock):
+    for _ in range(3):
+        buckets.take("k", rate=2, burst=3)
+    clock.now += 1
+    assert [buckets.take("k", rate=2, burst=3)[0] for _ in range(3)] == [True, True, False]
+    clock.now += 100
+    assert [buckets.take("k", rate=2, burst=3)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_keys_are_independent(buckets):
+    assert buckets.take("a", rate=1, burst=1)[0]
+    assert not buckets.take("a", rate=1, burst=1)[0]
+    assert buckets.take("b", rate=1, burst=1)[0]
+    assert buckets.size() == 2
+
+
+def test_memory_buckets_evict_least_recent(clock):
+    buckets = MemoryBuckets(max_keys=2)
+    buckets.take("a", rate=1, burst=1)
+    buckets.take("b", rate=1, burst=1)
+    buckets.take("a", rate=1, burst=1)
+    buckets.take("c", rate=1, burst=1)
+    assert buckets.size() == 2
+    # вытеснен b: его ведро снова полное
+    assert buckets.take("b", rate=1, burst=1)[0]
+    assert not buckets.take("c", rate=1, burst=1)[0]
+
+
+def test_sqlite_buckets_shared_between_instances(tmp_path, clock):
+    path = str(tmp_path / "buckets.db")
+    first, second = SqliteBuckets(path), SqliteBuckets(path)
+    assert first.take("k", rate=1, burst=1)[0]
+    assert not second.take("k", rate=1, burst=1)[0]
+
+
+def test_limiter_keys_by_route_and_client(clock):
+    limiter = RateLimiter(MemoryBuckets(max_keys=100))
+    cars = RoutePolicy("/cars", "car:1", rate_limit=1, rate_burst=1)
+    offices = RoutePolicy("/offices", "office:1", rate_limit=1, rate_burst=1)
+    assert limiter.check(cars, "user:1") == 0
+    assert limiter.check(cars, "user:1") == pytest.approx(1)
+    assert limiter.check(cars, "user:2") == 0
+    assert limiter.check(offices, "user:1") == 0
+    assert limiter.stats() == {"allowed": 3, "limited": 1, "keys": 3}
+
+
+def test_limiter_disabled_route(clock):
+    limiter = RateLimiter(MemoryBuckets(max_keys=100))
+    route = RoutePolicy("/cars", "car:1", rate_limit=0)
+    assert all(limiter.check(route, "user:1") == 0 for _ in range(100))
+    assert limiter.stats()["keys"] == 0
@@ -0,0 +1,131 @@
+import pytest
+
+import resilience
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, UpstreamGuard, UpstreamGuards, UpstreamUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience, "monotonic", clock)
+    return clock
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow() == (True, 0)
+        breaker.on_failure()
+    assert breaker.state == OPEN
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    breaker.on_failure()
+    breaker.on_failure()
+    breaker.on_success()
+    breaker.on_failure()
+    breaker.on_failure()
+    assert breaker.state == CLOSED
+    breaker.on_failure()
+    assert breaker.state == OPEN
+    clock.now += 4
+    allowed, wait = breaker.allow()
+    assert not allowed and wait == pytest.approx(6)
+
+
+def test_half_open_probe_closes_on_success(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 10
+    assert breaker.allow() == (True, 0)
+    assert breaker.state == HALF_OPEN
+    # пробный запрос один, остальные ждут его исхода
+    assert breaker.allow() == (False, 10)
+    breaker.on_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow() == (True, 0)
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 10
+    assert breaker.allow() == (True, 0)
+    breaker.on_failure()
+    assert breaker.state == OPEN
+    assert breaker.allow()[0] is False
+    clock.now += 10
+    assert breaker.allow() == (True, 0)
+
+
+def test_late_success_while_open_keeps_cooldown(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    open_breaker(breaker)
+    breaker.on_success()
+    assert breaker.state == OPEN
+    assert breaker.allow()[0] is False
+
+
+def test_cancelled_probe_frees_the_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 10
+    assert breaker.allow() == (True, 0)
+    breaker.cancel_probe()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() == (True, 0)
+
+
+def test_guard_bulkhead_rejects_over_limit(clock):
+    guard = UpstreamGuard("car:1", failure_threshold=5, reset_timeout=10, max_concurrent=2)
+    guard.enter()
+    guard.enter()
+    with pytest.raises(UpstreamUnavailable) as e:
+        guard.enter()
+    assert e.value.retry_after == 1
+    guard.exit(failed=False)
+    guard.enter()
+    assert guard.stats()["active"] == 2 and guard.stats()["rejected"] == 1
+
+
+def test_guard_open_circuit_reports_retry_after(clock):
+    guard = UpstreamGuard("car:1", failure_threshold=1, reset_timeout=10, max_concurrent=2)
+    guard.enter()
+    guard.exit(failed=True)
+    clock.now += 2.5
+    with pytest.raises(UpstreamUnavailable) as e:
+        guard.enter()
+    assert e.value.retry_after == 8
+    assert guard.stats()["active"] == 0
+
+
+def test_guard_cancelled_request_is_neutral(clock):
+    guard = UpstreamGuard("car:1", failure_threshold=1, reset_timeout=10, max_concurrent=1)
+    guard.enter()
+    guard.exit(failed=True)
+    clock.now += 10
+    guard.enter()
+    guard.exit(failed=None)
+    # отменённая проба не закрывает и не открывает цепь, зато следующая может пройти
+    assert guard.breaker.state == HALF_OPEN
+    guard.enter()
+    guard.exit(failed=False)
+    assert guard.breaker.state == CLOSED
+
+
+def test_guards_apply_overrides_per_service():
+    guards = UpstreamGuards(
+        {"failure_threshold": 5, "reset_timeout": 10, "max_concurrent": 50},
+        {"office:1": {"max_concurrent": 3}},
+    )
+    assert guards.get("office:1").bulkhead.max_concurrent == 3
+    assert guards.get("car:1").bulkhead.max_concurrent == 50
+    assert guards.get("car:1") is guards.get("car:1")
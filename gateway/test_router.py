@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from router import RoutePolicy, Router, load_routes
+
+
+def make_router():
+    return Router([
+        RoutePolicy("/cars", "car:1"),
+        RoutePolicy("/offices", "office:1"),
+        RoutePolicy("/offices/cars", "office:2"),
+        RoutePolicy("/offices/1/cars/special", "office:3"),
+    ])
+
+
+def test_longest_prefix_wins():
+    router = make_router()
+    assert router.match("/offices/cars/uuid").service == "office:2"
+    assert router.match("/offices/1/cars").service == "office:1"
+    assert router.match("/offices/1/cars/special/x").service == "office:3"
+
+
+def test_matches_whole_segments_only():
+    router = make_router()
+    assert router.match("/cars").service == "car:1"
+    assert router.match("/cars/").service == "car:1"
+    assert router.match("//cars//123").service == "car:1"
+    assert router.match("/carsharing") is None
+    assert router.match("/nothing") is None
+    assert router.match("/") is None
+
+
+def test_root_route_is_fallback():
+    router = Router([RoutePolicy("/", "front:1"), RoutePolicy("/cars", "car:1")])
+    assert router.match("/anything/else").service == "front:1"
+    assert router.match("/cars/1").service == "car:1"
+
+
+def test_later_route_replaces_same_prefix():
+    router = Router([RoutePolicy("/cars", "car:1"), RoutePolicy("cars/", "car:2")])
+    assert router.match("/cars/1").service == "car:2"
+    assert router.services() == {"car:1", "car:2"}
+
+
+def test_policy_defaults_and_validation():
+    policy = RoutePolicy("/offices/cars/", "office:1", invalidates=["/offices"])
+    assert policy.prefix == "offices/cars"
+    assert policy.invalidates == ["offices/cars", "/offices"]
+    assert RoutePolicy("/cars", "car:1", rate_burst=0).rate_burst == 1
+    with pytest.raises(ValueError):
+        RoutePolicy("/cars", "car:1", cache_scope="public")
+
+
+def test_load_routes(tmp_path, monkeypatch):
+    monkeypatch.setenv("CAR_HOST", "cars.local:7774")
+    config = tmp_path / "routes.json"
+    config.write_text(json.dumps({"routes": {
+        "/cars": {"service": "${CAR_HOST}", "cacheable": True, "cache_ttl": 5},
+        "/offices": {"service": ["office-a:7775", "office-b:7775"], "hedge": True},
+    }}))
+    routes = {route.prefix: route for route in load_routes(config)}
+    assert routes["cars"].service == "cars.local:7774"
+    assert routes["cars"].cacheable and routes["cars"].cache_ttl == 5
+    assert routes["offices"].service == "office-a:7775,office-b:7775"
+    assert routes["offices"].hedge
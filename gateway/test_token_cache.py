@@ -0,0 +1,113 @@
+from time import time
+
+import pytest
+
+from jwt_backend import JWTError
+import token_cache
+from token_cache import TokenCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Decoder:
+    def __init__(self, claims):
+        self.claims = claims
+        self.calls = 0
+
+    def __call__(self, token):
+        self.calls += 1
+        if token not in self.claims:
+            raise JWTError(f"bad token {token}")
+        return self.claims[token]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(token_cache, "time", clock)
+    return clock
+
+
+def make_cache(decode, max_size=2, negative_size=2, negative_ttl=5, max_ttl=60):
+    return TokenCache(decode, max_size, negative_size, negative_ttl, max_ttl)
+
+
+def test_valid_token_decoded_once(clock):
+    decode = Decoder({"a": {"user_id": 1, "exp": 2000}})
+    cache = make_cache(decode)
+    assert cache.get("a") == {"user_id": 1, "exp": 2000}
+    assert cache.get("a") == {"user_id": 1, "exp": 2000}
+    assert decode.calls == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_entry_lives_until_exp_but_not_longer_than_max_ttl(clock):
+    decode = Decoder({"soon": {"exp": 1010}, "later": {"exp": 5000}})
+    cache = make_cache(decode)
+    cache.get("soon")
+    cache.get("later")
+    clock.now = 1010
+    cache.get("soon")
+    assert decode.calls == 3
+    clock.now = 1059
+    cache.get("later")
+    assert decode.calls == 3
+    clock.now = 1060
+    cache.get("later")
+    assert decode.calls == 4
+
+
+def test_bad_token_cached_for_negative_ttl(clock):
+    decode = Decoder({})
+    cache = make_cache(decode)
+    for _ in range(3):
+        with pytest.raises(JWTError):
+            cache.get("garbage")
+    assert decode.calls == 1
+    assert cache.stats()["negative_hits"] == 2
+    clock.now += 5
+    with pytest.raises(JWTError):
+        cache.get("garbage")
+    assert decode.calls == 2
+
+
+def test_least_recently_used_evicted(clock):
+    decode = Decoder({token: {"exp": 2000} for token in "abc"})
+    cache = make_cache(decode)
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")
+    cache.get("c")
+    assert cache.stats()["size"] == 2
+    cache.get("a")
+    assert decode.calls == 3
+    cache.get("b")
+    assert decode.calls == 4
+
+
+def test_clear_forgets_valid_and_invalid(clock):
+    decode = Decoder({"a": {"exp": 2000}})
+    cache = make_cache(decode)
+    cache.get("a")
+    with pytest.raises(JWTError):
+        cache.get("b")
+    cache.clear()
+    cache.get("a")
+    with pytest.raises(JWTError):
+        cache.get("b")
+    assert decode.calls == 4
+
+
+def test_expired_token_not_served_from_cache():
+    # запись с уже истёкшим exp не отдаётся повторно
+    decode = Decoder({"old": {"exp": int(time()) - 1}})
+    cache = make_cache(decode)
+    cache.get("old")
+    cache.get("old")
+    assert decode.calls == 2
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from jwt_backend import JWTError
+
+
+class TokenCache:
+    """LRU проверенных токенов -> claims.
+
+    Запись живёт до exp токена, плохие токены запоминаются на negative_ttl секунд,
+    чтобы не проверять HMAC одного и того же мусора на каждом запросе
+    """
+
+    def __init__(self, decode, max_size, negative_size, negative_ttl, max_ttl):
+        self.decode = decode
+        self.max_size = max_size
+        self.negative_size = negative_size
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+        self.valid = OrderedDict()
+        self.invalid = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    def _lookup(self, entries, token, now):
+        entry = entries.get(token)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del entries[token]
+            return None
+        entries.move_to_end(token)
+        return entry
+
+    def _store(self, entries, max_size, token, entry):
+        entries[token] = entry
+        entries.move_to_end(token)
+        while len(entries) > max_size:
+            entries.popitem(last=False)
+
+    def get(self, token):
+        now = time()
+        with self.lock:
+            entry = self._lookup(self.valid, token, now)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+            entry = self._lookup(self.invalid, token, now)
+            if entry is not None:
+                self.negative_hits += 1
+                raise entry[1].with_traceback(None)
+            self.misses += 1
+
+        try:
+            claims = self.decode(token)
+        except JWTError as e:
+            with self.lock:
+                self._store(self.invalid, self.negative_size, token, (now + self.negative_ttl, e))
+            raise
+
+        expires_at = now + self.max_ttl
+        if isinstance(claims.get("exp"), (int, float)):
+            expires_at = min(expires_at, claims["exp"])
+        with self.lock:
+            self._store(self.valid, self.max_size, token, (expires_at, claims))
+        return claims
+
+    def clear(self):
+        with self.lock:
+            self.valid.clear()
+            self.invalid.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.valid),
+                "negative_size": len(self.invalid),
+                "hits": self.hits,
+                "misses": self.misses,
+                "negative_hits": self.negative_hits,
+            }
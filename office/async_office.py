@@ -0,0 +1,64 @@
+import os
+
+from a2wsgi import WSGIMiddleware
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import auth
+import database
+import office
+from office import JWT_SECRET, RentOffice
+
+# Асинхронный режим сервиса офисов (ASGI): `python3 async_office.py` или `uvicorn async_office:app`.
+# Доступность машин читается через asyncio-движок и не держит поток на время запроса к базе,
+# остальные маршруты обслуживает то же Flask-приложение office.app в пуле потоков
+
+database.init_async()
+
+
+@auth.requires_auth_async(JWT_SECRET)
+async def get_cars_list(request):
+    office_id = request.path_params["office_id"]
+    async with database.AsyncReadSession(request) as s:
+        rent_office = await s.get(RentOffice, office_id)
+        if not rent_office:
+            return JSONResponse({"error": "office not found"}, 404)
+        car_availabilities = (await s.scalars(office.office_cars_query(office_id))).all()
+    result = office.office_cars(rent_office, car_availabilities)
+
+    if car_availabilities:
+        # клиент сервиса машин синхронный (токены, повторы), его вызов уходит в пул потоков
+        await run_in_threadpool(office.add_car_names, result, request.headers)
+    return JSONResponse(result)
+
+
+@auth.requires_auth_async(JWT_SECRET)
+async def get_car_availability_in_office(request):
+    office_id = request.path_params["office_id"]
+    car_uuid = request.path_params["car_uuid"]
+    async with database.AsyncReadSession(request) as s:
+        car_availabilities = (await s.scalars(office.car_in_office_query(office_id, car_uuid))).all()
+    if not car_availabilities:
+        return JSONResponse({"error": "car not available in that office"}, 404)
+    return JSONResponse(office.car_availabilities_json(car_availabilities))
+
+
+app = Starlette(routes=[
+    Route("/offices/{office_id:int}/cars", get_cars_list, methods=["GET"]),
+    Route("/offices/{office_id:int}/cars/{car_uuid:str}", get_car_availability_in_office, methods=["GET"]),
+    Mount("/", WSGIMiddleware(office.app)),
+])
+
+
+if __name__ == '__main__':
+    database.create_schema()
+
+    PORT = os.environ.get("PORT")
+    if not PORT:
+        print("USING DEFAULT PORT 7775, не задан $PORT")
+        PORT = 7775
+    # log_config=None: журнал доступа uvicorn идёт через logger, а не свои обработчики
+    uvicorn.run(app, host="0.0.0.0", port=int(PORT), log_config=None)
@@ -0,0 +1,62 @@
+from collections import deque
+from queue import Queue, Empty, Full
+from threading import Lock
+import json
+
+
+class EventBus:
+    """Изменения доступности машин для подписчиков /offices/events.
+    Последние max_events событий хранятся, чтобы переподключившийся клиент
+    получил пропущенное по Last-Event-ID"""
+
+    def __init__(self, max_events=1000, queue_size=100):
+        self.events = deque(maxlen=max_events)
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.last_id = 0
+        self.lock = Lock()
+
+    def publish(self, event_type, data):
+        with self.lock:
+            self.last_id += 1
+            event = (self.last_id, event_type, json.dumps(data, ensure_ascii=False))
+            self.events.append(event)
+            subscribers = list(self.subscribers)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(event)
+            except Full:
+                # не успевает читать - отключаем, клиент переподключится с Last-Event-ID
+                self.unsubscribe(queue)
+                queue.closed = True
+
+    def subscribe(self, last_event_id=None):
+        queue = Queue(self.queue_size)
+        queue.closed = False
+        with self.lock:
+            if last_event_id is not None:
+                # пропущенных может быть больше, чем влезает в очередь: отдаём самые свежие
+                missed = [event for event in self.events if event[0] > last_event_id]
+                for event in missed[-queue.maxsize:]:
+                    queue.put_nowait(event)
+            self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers.discard(queue)
+
+    def stream(self, last_event_id, heartbeat):
+        queue = self.subscribe(last_event_id)
+        try:
+            # сразу отдаём заголовки и первый кусок, чтобы клиент знал, что подписка есть
+            yield ": connected\n\n"
+            while not queue.closed:
+                try:
+                    event_id, event_type, data = queue.get(timeout=heartbeat)
+                except Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+        finally:
+            self.unsubscribe(queue)
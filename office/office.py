@@ -4,26 +4,43 @@ import os
 from datetime import datetime
 
 from requests import RequestException
-from flask import Flask
+from flask import Flask, Response
 from flask import request as flask_request, jsonify
-from sqlalchemy import Column, Integer, Text
+from sqlalchemy import Column, Index, Integer, Text, select
 
+from events import EventBus
 import database
 import auth
+import logger
+
+log = logger.setup("office")
 
 # Экземпляр приложения
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
+database.instrument(app)
 CLIENT_ID = "office_service"
 JWT_SECRET = auth.KNOWN_CLIENTS["office_service"]
 current_token = None
 
 CAR_SERVICE_URL = os.environ.get("CAR_SERVICE_URL", "localhost:7774")
 MINIMAL_MODE = int(os.environ.get("MINIMAL_MODE", 0))
+# /offices/events: сколько событий помнить для переподключений и как часто слать ping
+EVENTS_BUFFER = int(os.environ.get("EVENTS_BUFFER", 1000))
+EVENTS_HEARTBEAT = float(os.environ.get("EVENTS_HEARTBEAT", 15))
 
 print("MINIMAL_MODE:", MINIMAL_MODE)
 print("CAR_SERVICE_URL:", CAR_SERVICE_URL)
 
+# Изменения AvailableCar; отправляются после коммита
+availability_events = EventBus(max_events=EVENTS_BUFFER)
+
+
+def publish_availability(change, car_uuid, office_ids, **details):
+    availability_events.publish("availability", {
+        "change": change, "car_uuid": car_uuid, "office_ids": office_ids, **details
+    })
+
 class RentOffice(database.Base):
     __tablename__ = 'rent_office'
     id = Column(Integer, primary_key=True)
@@ -38,10 +55,80 @@ class AvailableCar(database.Base):
     available_from = Column(Integer, nullable=False)
     available_to = Column(Integer, nullable=True)
 
+    __table_args__ = (
+        # история машины по времени и поиск её текущего слота (available_to IS NULL)
+        Index("ix_available_car_car_uuid_from", "car_uuid", "available_from"),
+        Index("ix_available_car_car_uuid_to", "car_uuid", "available_to"),
+        # машины офиса по времени
+        Index("ix_available_car_office_from", "office_id", "available_from"),
+    )
+
+
+@database.migration(1, "available_car indexes")
+def add_available_car_indexes(connection):
+    database.create_indexes(connection, AvailableCar)
+
 
 def strip_headers(headers):
-    allowed_headers = ["Authorization", "Cookie", "Content-Type", "User-Id", "Is-Admin", "Is-Service"]
-    return {k: v for k, v in headers.items() if k in allowed_headers}
+    # регистр имён не важен: заголовки Flask и Starlette (async_office.py)
+    allowed_headers = ["Authorization", "Cookie", "Content-Type", "User-Id", "Is-Admin", "Is-Service", "X-Last-Write"]
+    return {k: headers[k] for k in allowed_headers if k in headers}
+
+
+def office_cars_query(office_id):
+    return (
+        select(AvailableCar)
+        .where(AvailableCar.office_id == office_id)
+        .order_by(AvailableCar.available_from.desc())
+    )
+
+
+def car_in_office_query(office_id, car_uuid):
+    return (
+        select(AvailableCar)
+        .where(AvailableCar.office_id == office_id)
+        .where(AvailableCar.car_uuid == car_uuid)
+        .order_by(AvailableCar.available_from.desc())
+    )
+
+
+def office_cars(office, car_availabilities):
+    result = {}
+    result["office_location"] = office.location
+    result["available_cars"] = [{
+        "car_uuid": c.car_uuid, "from": c.available_from
+    } for c in car_availabilities if not c.available_to]
+
+    result["unavailable_cars"] = []
+    for a in car_availabilities:
+        if a.available_to:
+            result["unavailable_cars"].append(
+                {"car_uuid": a.car_uuid, "from": a.available_from, "to": a.available_to}
+            )
+    return result
+
+
+def add_car_names(result, headers):
+    # названия машин из сервиса машин; без него ответ остаётся без name
+    try:
+        cars_response = auth.authorized_request(
+            CLIENT_ID, JWT_SECRET,
+            "GET", f"http://{CAR_SERVICE_URL}/cars",
+            headers=strip_headers(headers),
+        )
+    except RequestException:
+        return result
+    if cars_response.ok:
+        names = {c["uuid"]: f'{c["brand"]} - {c["model"]}' for c in cars_response.json()}
+        for car in result["available_cars"]:
+            car["name"] = names[car["car_uuid"]]
+        for car in result["unavailable_cars"]:
+            car["name"] = names[car["car_uuid"]]
+    return result
+
+
+def car_availabilities_json(car_availabilities):
+    return [{"id": a.id, "from": a.available_from, "to": a.available_to} for a in car_availabilities]
 
 
 
@@ -55,10 +142,31 @@ def get_token():
     return {"token": token, "expire": expire}, 200
 
 
+@app.route('/token/cache', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_token_cache_stats():
+    return auth.verified_tokens.stats(), 200
+
+
+@app.route('/db/stats', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_db_stats():
+    return database.pool_stats(), 200
+
+
+@app.route('/client/stats', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_client_stats():
+    return auth.service_client.stats(), 200
+
+
 @app.route('/offices', methods=["GET"])
 @auth.requires_auth(JWT_SECRET)
 def get_offices_list():
-    with database.Session() as s:
+    with database.ReadSession() as s:
         offices = s.query(RentOffice).all()
         return jsonify([{"id": o.id, "location": o.location} for o in offices])
 
@@ -76,77 +184,42 @@ def create_office():
     return {}, 201
 
 
+@app.route('/offices/events', methods=["GET"])
+@auth.requires_auth(JWT_SECRET)
+def availability_event_stream():
+    last_event_id = flask_request.headers.get("Last-Event-ID")
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    return Response(
+        availability_events.stream(last_event_id, EVENTS_HEARTBEAT),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 @app.route('/offices/<int:office_id>/cars', methods=["GET"])
 @auth.requires_auth(JWT_SECRET)
 def get_cars_list(office_id):
-    with database.Session() as s:
-        office = s.query(RentOffice).filter(RentOffice.id == office_id).one_or_none()
+    with database.ReadSession() as s:
+        office = s.get(RentOffice, office_id)
         if not office:
             return {"error": "office not found"}, 404
+        car_availabilities = s.scalars(office_cars_query(office_id)).all()
+        result = office_cars(office, car_availabilities)
 
-        car_availabilities = (
-            s.query(AvailableCar)
-            .filter(AvailableCar.office_id == office_id)
-            .order_by(AvailableCar.available_from.desc())
-            .all()
-        )
-        if not car_availabilities:
-            return {"office_location": office.location,
-                    "available_cars": [],
-                    "unavailable_cars": []}, 200
-
-        result = {}
-        result["office_location"] = office.location
-        result["available_cars"] = [{
-            "car_uuid": c.car_uuid, "from": c.available_from
-        } for c in car_availabilities if not c.available_to]
-
-        result["unavailable_cars"] = []
-        for a in car_availabilities:
-            if a.available_to:
-                result["unavailable_cars"].append(
-                    {"car_uuid": a.car_uuid, "from": a.available_from, "to": a.available_to}
-                )
-
-
-        try:
-            cars_response = auth.authorized_request(
-                CLIENT_ID, JWT_SECRET,
-                "GET", f"http://{CAR_SERVICE_URL}/cars",
-                headers=strip_headers(flask_request.headers),
-            )
-        except RequestException:
-            pass
-        else:
-            if cars_response.ok:
-                names = {c["uuid"]: f'{c["brand"]} - {c["model"]}' for c in cars_response.json()}
-                for car in result["available_cars"]:
-                    car["name"] = names[car["car_uuid"]]
-                for car in result["unavailable_cars"]:
-                    car["name"] = names[car["car_uuid"]]
-
-
-        return jsonify(dict(result))
+    if car_availabilities:
+        add_car_names(result, flask_request.headers)
+    return jsonify(result)
 
 
 @app.route('/offices/<int:office_id>/cars/<string:car_uuid>', methods=["GET"])
 @auth.requires_auth(JWT_SECRET)
 def get_car_availability_in_office(office_id, car_uuid):
-    with database.Session() as s:
-        car_availabilities = (
-            s.query(AvailableCar)
-            .filter(AvailableCar.office_id == office_id)
-            .filter(AvailableCar.car_uuid == car_uuid)
-            .order_by(AvailableCar.available_from.desc())
-            .all()
-        )
+    with database.ReadSession() as s:
+        car_availabilities = s.scalars(car_in_office_query(office_id, car_uuid)).all()
         if not car_availabilities:
             return {"error": "car not available in that office"}, 404
 
-        return jsonify([
-            {"id": a.id, "from": a.available_from, "to": a.available_to}
-            for a in car_availabilities
-        ])
+        return jsonify(car_availabilities_json(car_availabilities))
 
 
 @app.route('/offices/cars/<string:car_uuid>', methods=["GET"])
@@ -165,7 +238,7 @@ def get_car_availability(car_uuid):
         if car_info_response.ok:
             car_info = car_info_response.json()
 
-    with database.Session() as s:
+    with database.ReadSession() as s:
         car_availabilities = (
             s.query(AvailableCar)
             .filter(AvailableCar.car_uuid == car_uuid)
@@ -196,26 +269,28 @@ def add_car_to_office(office_id, car_uuid):
     except Exception as e:
         return {"error": "bad body", "details": str(e)}, 400
 
+    # сервис машин спрашиваем до транзакции: иначе блокировка записи держится на время HTTP-запроса
+    if not MINIMAL_MODE:
+        check_car_response = auth.authorized_request(
+            CLIENT_ID, JWT_SECRET,
+            "GET",
+            f"http://{CAR_SERVICE_URL}/cars",
+            headers=strip_headers(flask_request.headers)
+        )
+        if car_uuid not in [c["uuid"] for c in check_car_response.json()]:
+            return {"error": "несуществующий car_uuid"}, 400
+
     with database.Session() as s:
-        if not list(s.query(RentOffice).filter(RentOffice.id == office_id).all()):
+        if s.get(RentOffice, office_id) is None:
             return {"error": "несуществующий office_id"}, 400
 
-        if not MINIMAL_MODE:
-            check_car_response = auth.authorized_request(
-                CLIENT_ID, JWT_SECRET,
-                "GET",
-                f"http://{CAR_SERVICE_URL}/cars",
-                headers=strip_headers(flask_request.headers)
-            )
-            if car_uuid not in [c["uuid"] for c in check_car_response.json()]:
-                return {"error": "несуществующий car_uuid"}, 400
-
         s.add(AvailableCar(
             office_id=office_id,
             car_uuid=car_uuid,
             available_from=available_from,
             available_to=None,
         ))
+    publish_availability("added", car_uuid, [office_id], available_from=available_from)
     return {}, 201
 
 
@@ -232,6 +307,7 @@ def delete_car_from_office(office_id, car_uuid):
         )
         if not car:
             return {"error": "car not found"}, 404
+    publish_availability("removed", car_uuid, [office_id])
     return {}, 201
 
 
@@ -248,6 +324,10 @@ def delete_car_completely(car_uuid):
     if not del_car_response.ok:
         return {"error": "несуществующий car_uuid"}, 404
     with database.Session() as s:
+        office_ids = [
+            office_id for (office_id,) in
+            s.query(AvailableCar.office_id).filter(AvailableCar.car_uuid == car_uuid).distinct()
+        ]
         car = (
             s.query(AvailableCar)
             .filter(AvailableCar.car_uuid == car_uuid)
@@ -255,6 +335,7 @@ def delete_car_completely(car_uuid):
         )
         if not car:
             return {"error": "car not found"}, 404
+    publish_availability("removed", car_uuid, office_ids)
     return {}, 201
 
 
@@ -305,6 +386,10 @@ def book(car_uuid):
             available_from=end_time,
             available_to=None,
         ))
+    publish_availability(
+        "booked", car_uuid, sorted({taken_from, taken_to}),
+        taken_from=taken_from, taken_to=taken_to, available_to=start_time, available_from=end_time
+    )
     return {}, 201
 
 
@@ -329,6 +414,7 @@ def delete_car_availability(car_uuid):
             s.delete(availability)
         else:
             return {"error": "not found"}, 404
+    publish_availability("cancelled", car_uuid, [taken_from], start_time=start_time)
     return {}, 200
 
 
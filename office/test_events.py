@@ -0,0 +1,64 @@
+from itertools import islice
+import importlib.util
+import os
+
+# у гейтвея свой модуль events: при общем запуске тестов он мог быть импортирован первым,
+# поэтому events.py сервиса офисов загружается по пути
+_spec = importlib.util.spec_from_file_location(
+    "office_events", os.path.join(os.path.dirname(os.path.abspath(__file__)), "events.py")
+)
+office_events = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(office_events)
+EventBus = office_events.EventBus
+
+
+def publish(bus, count):
+    for i in range(count):
+        bus.publish("availability", {"car_uuid": f"car-{i}"})
+
+
+def test_new_subscriber_gets_only_new_events():
+    bus = EventBus(max_events=10, queue_size=5)
+    publish(bus, 3)
+    queue = bus.subscribe()
+    assert queue.empty()
+    publish(bus, 1)
+    assert queue.get_nowait()[0] == 4
+
+
+def test_reconnect_replays_missed_events():
+    bus = EventBus(max_events=10, queue_size=5)
+    publish(bus, 4)
+    queue = bus.subscribe(last_event_id=2)
+    assert [queue.get_nowait()[0] for _ in range(2)] == [3, 4]
+    assert queue.empty()
+
+
+def test_reconnect_after_more_than_queue_size_events():
+    # пропущено больше, чем вмещает очередь подписчика: приходят самые свежие, без ошибки
+    bus = EventBus(max_events=1000, queue_size=100)
+    publish(bus, 150)
+    queue = bus.subscribe(last_event_id=10)
+    assert queue.qsize() == 100
+    assert [queue.get_nowait()[0] for _ in range(100)] == list(range(51, 151))
+    assert queue in bus.subscribers
+
+
+def test_slow_subscriber_disconnected():
+    bus = EventBus(max_events=10, queue_size=2)
+    queue = bus.subscribe()
+    publish(bus, 3)
+    assert queue.closed and queue not in bus.subscribers
+
+
+def test_stream_formats_sse():
+    bus = EventBus()
+    publish(bus, 1)
+    stream = bus.stream(last_event_id=0, heartbeat=0.01)
+    assert list(islice(stream, 3)) == [
+        ": connected\n\n",
+        'id: 1\nevent: availability\ndata: {"car_uuid": "car-0"}\n\n',
+        ": ping\n\n",
+    ]
+    stream.close()
+    assert not bus.subscribers
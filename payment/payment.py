@@ -8,10 +8,14 @@ from sqlalchemy import Column, Integer, Text
 
 import database
 import auth
+import logger
+
+log = logger.setup("payment")
 
 # Экземпляр приложения
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
+database.instrument(app)
 JWT_SECRET = auth.KNOWN_CLIENTS["payment_service"]
 
 
@@ -33,6 +37,20 @@ def get_token():
     return {"token": token, "expire": expire}, 200
 
 
+@app.route('/token/cache', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_token_cache_stats():
+    return auth.verified_tokens.stats(), 200
+
+
+@app.route('/db/stats', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_db_stats():
+    return database.pool_stats(), 200
+
+
 @app.route('/payment/pay', methods=["POST"])
 @auth.requires_auth(JWT_SECRET)
 def pay():
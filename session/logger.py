@@ -0,0 +1,144 @@
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+import atexit
+import copy
+import json
+import logging
+import os
+import random
+import sys
+
+# Структурированные логи: обработчик запроса только кладёт запись в очередь,
+# форматирует и пишет в stdout фоновый поток
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# json - одна запись на строку, text - для чтения глазами
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Доля запросов, попадающих в журнал запросов (access log сервера и log.request)
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 1))
+# Пути, для которых журнал запросов выключен, префиксы через запятую: "/metrics,/events"
+LOG_SKIP_ROUTES = tuple(p.strip() for p in os.environ.get("LOG_SKIP_ROUTES", "").split(",") if p.strip())
+
+SERVICE = None
+_listener = None
+
+
+def should_log_request(path):
+    if LOG_SKIP_ROUTES and path.startswith(LOG_SKIP_ROUTES):
+        return False
+    return LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "service": SERVICE,
+            "logger": record.name,
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        line = f"{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()} {fields}"
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line.rstrip()
+
+
+class _QueueHandler(QueueHandler):
+    # В потоке запроса только подставляются аргументы, json собирает фоновый поток
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _access_path(record):
+    # werkzeug: '"%s" %s %s' % ("GET /cars HTTP/1.1", 200, size)
+    # uvicorn: '%s - "%s %s HTTP/%s" %d' % (client, method, path, http_version, status)
+    try:
+        if record.name == "werkzeug":
+            return record.args[0].split()[1]
+        if record.name == "uvicorn.access":
+            return record.args[2]
+    except (IndexError, TypeError, AttributeError):
+        pass
+    return None
+
+
+class AccessLogFilter(logging.Filter):
+    def filter(self, record):
+        path = _access_path(record)
+        return path is None or should_log_request(path)
+
+
+class Logger:
+    """log.info("booking created", car_uuid=..., user_id=...): поля попадают в запись как есть"""
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def _log(self, level, event, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+    def request(self, path, event, **fields):
+        # подробности обработки запроса: подчиняются LOG_SAMPLE_RATE и LOG_SKIP_ROUTES
+        if self.logger.isEnabledFor(logging.DEBUG) and should_log_request(path):
+            self._log(logging.DEBUG, event, {"path": path, **fields})
+
+
+def get(name):
+    return Logger(name)
+
+
+def setup(service):
+    global SERVICE, _listener
+    if _listener is None:
+        SERVICE = service
+        records = SimpleQueue()
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        _listener = QueueListener(records, handler)
+
+        root = logging.getLogger()
+        root.handlers = [_QueueHandler(records)]
+        root.setLevel(LOG_LEVEL)
+        for name in ("werkzeug", "uvicorn.access"):
+            logging.getLogger(name).addFilter(AccessLogFilter())
+        # HTTP-клиенты пишут строку на каждый исходящий запрос
+        for name in ("httpx", "httpcore", "urllib3"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        print("LOG_LEVEL:", LOG_LEVEL, "LOG_FORMAT:", LOG_FORMAT, "LOG_SAMPLE_RATE:", LOG_SAMPLE_RATE)
+        _listener.start()
+        # дописать очередь при остановке процесса
+        atexit.register(_listener.stop)
+    return get(service)
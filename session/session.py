@@ -7,16 +7,20 @@ import os
 from flask import Flask
 from flask import request, _request_ctx_stack
 from flask_cors import CORS, cross_origin
-from jose import jwt
-from jose.exceptions import JWTError
 from sqlalchemy import Column, Integer, Text
 
+from jwt_backend import JWTError
 import database
+import jwt_backend
+import logger
 
 
+log = logger.setup("session")
+
 # Экземпляр приложения
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
+database.instrument(app)
 cors = CORS(app, support_credentials=True)
 
 JWT_SECRET = "user_jwt_secret"
@@ -55,7 +59,7 @@ def requires_auth(f):
         auth_data = auth_data[len("bearer"):].strip()
 
         try:
-            jwt_claims = jwt.decode(auth_data, JWT_SECRET, algorithms=['HS256'])
+            jwt_claims = jwt_backend.decode(auth_data, JWT_SECRET)
         except JWTError as e:
             return {"error": "bad token", "details": str(e)}, 401
 
@@ -76,9 +80,8 @@ def requires_admin(f):
 
 @app.route("/auth", methods=["POST"])
 def get_token():
-    print("[headers]", request.headers)
-    print("[body]", request.data)
-    print("[json]", request.json)
+    # тело не пишем: в нём пароль
+    log.request(request.path, "sign in", content_type=request.content_type, size=request.content_length)
 
     # auth_data = request.headers.get("Authorization")
     # if not auth_data:
@@ -96,7 +99,7 @@ def get_token():
     except Exception as e:
         return {"error": "bad body", "details": str(e)}, 400
 
-    with database.Session() as s:
+    with database.ReadSession() as s:
         user = s.query(User).filter(User.login == username).one_or_none()
         if not user:
             return {"error": "user not found"}, 400
@@ -111,7 +114,7 @@ def get_token():
             'user': username,
             'exp': int(time()) + TOKEN_EXPIRE,
         }
-    token = jwt.encode(claims, JWT_SECRET, algorithm='HS256')
+    token = jwt_backend.encode(claims, JWT_SECRET)
     return {"auth_token": token, "is_admin": int(is_admin)}
 
 
@@ -122,6 +125,13 @@ def verify_token():
     return {"user": decoded_jwt.get("user"), "user_id": decoded_jwt.get("user_id")}
 
 
+@app.route("/db/stats", methods=["GET"])
+@requires_auth
+@requires_admin
+def get_db_stats():
+    return database.pool_stats(), 200
+
+
 @app.route("/users", methods=["POST"])
 @requires_auth
 @requires_admin
@@ -0,0 +1,61 @@
+import importlib.util
+import os
+import sys
+
+from a2wsgi import WSGIMiddleware
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import auth
+import database
+
+# Модуль сервиса называется так же, как statistics из стандартной библиотеки, и import statistics
+# получил бы тот, что загрузили раньше. Поэтому он загружается по пути под своим именем
+_spec = importlib.util.spec_from_file_location(
+    "statistics_service", os.path.join(os.path.dirname(os.path.abspath(__file__)), "statistics.py")
+)
+statistics_service = importlib.util.module_from_spec(_spec)
+sys.modules["statistics_service"] = statistics_service
+_spec.loader.exec_module(statistics_service)
+JWT_SECRET = statistics_service.JWT_SECRET
+Record = statistics_service.Record
+
+# Асинхронный режим сервиса статистики (ASGI): `python3 async_statistics.py` или `uvicorn async_statistics:app`.
+# Записи статистики принимаются через asyncio-движок,
+# отчёты и остальные маршруты обслуживает то же Flask-приложение statistics_service.app в пуле потоков
+
+database.init_async()
+
+
+@auth.requires_auth_async(JWT_SECRET)
+async def create_record(request):
+    try:
+        body = await request.json()
+        car_uuid = body["car_uuid"]
+        office_id = body["office_id"]
+    except Exception as e:
+        return JSONResponse({"error": "bad body", "details": str(e)}, 400)
+
+    async with database.AsyncSession(request) as s:
+        s.add(Record(car_uuid=car_uuid, office_id=office_id))
+
+    return JSONResponse({}, 201, headers=database.last_write_headers(request))
+
+
+app = Starlette(routes=[
+    Route("/reports/create_record", create_record, methods=["POST"]),
+    Mount("/", WSGIMiddleware(statistics_service.app)),
+])
+
+
+if __name__ == '__main__':
+    database.create_schema()
+
+    PORT = os.environ.get("PORT")
+    if not PORT:
+        print("USING DEFAULT PORT 7778, не задан $PORT")
+        PORT = 7778
+    # log_config=None: журнал доступа uvicorn идёт через logger, а не свои обработчики
+    uvicorn.run(app, host="0.0.0.0", port=int(PORT), log_config=None)
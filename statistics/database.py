@@ -1,36 +1,667 @@
+from collections import Counter, OrderedDict
+from itertools import count
+from threading import Lock
+from time import monotonic, perf_counter, time
 import os
+import re
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import TimeoutError as PoolTimeout
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import Session as ORMSession
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.schema import CreateColumn
+
+import logger
 
 Base = declarative_base()
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if not DATABASE_URL:
     print("USING TEMP DB, не задан $DATABASE_URL")
     DATABASE_URL = "sqlite:///temp.db"
-engine = create_engine(DATABASE_URL)
+
+# Пул соединений одного процесса. На Postgres с N репликами сервиса занято
+# до N * (DB_POOL_SIZE + DB_MAX_OVERFLOW) соединений из max_connections
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+# Сколько ждать свободное соединение, прежде чем запрос упадёт
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+# Соединения старше DB_POOL_RECYCLE секунд переоткрываются (-1 - никогда)
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+# Проверять соединение перед выдачей: переживает рестарт базы ценой короткого запроса
+DB_POOL_PRE_PING = int(os.environ.get("DB_POOL_PRE_PING", 1))
+
+# SQLite (temp.db и небольшие инсталляции): в WAL читатели не ждут писателя,
+# а busy_timeout заставляет писателей ждать друг друга вместо "database is locked"
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000))  # мс
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", -64 * 1024))  # < 0 - в КиБ
+# Пул соединений только для чтения (ReadSession)
+DB_READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", DB_POOL_SIZE))
+
+# Реплики для чтения через запятую. ReadSession распределяет по ним чтения, но после
+# записи чтения той же цепочки запросов READ_YOUR_WRITES_WINDOW секунд идут в основную базу.
+# Процессы сервиса за балансировщиком не видят записей друг друга, поэтому метка записи
+# ходит с цепочкой: ответ с записью несёт заголовок X-Last-Write (time() записи), гейтвей
+# хранит его в cookie и передаёт дальше в каждом запросе пользователя
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+READ_YOUR_WRITES_WINDOW = float(os.environ.get("READ_YOUR_WRITES_WINDOW", 5))
+READ_YOUR_WRITES_MAX_KEYS = int(os.environ.get("READ_YOUR_WRITES_MAX_KEYS", 10000))
+
+# asyncio-движок для сервисов под ASGI (async_office.py и т.п.), создаётся init_async().
+# По умолчанию тот же DATABASE_URL с асинхронным драйвером (нужны aiosqlite/asyncpg и greenlet)
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "postgres": "asyncpg"}
+DATABASE_ASYNC_URL = os.environ.get("DATABASE_ASYNC_URL")
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+# sqlite в памяти живёт в одном соединении, пул ему не нужен
+IN_MEMORY = DATABASE_URL in ("sqlite://", "sqlite:///:memory:")
+
+# Учёт SQL на запрос Flask (database.instrument(app)): число запросов, время и строки
+# уходят в заголовок Server-Timing. Запрос одной формы, повторённый SQL_REPEAT_THRESHOLD
+# раз за обработку (N+1), и транзакция, простоявшая без запросов SQL_IDLE_IN_TRANSACTION
+# секунд (внутри неё ходили по сети), пишутся в лог предупреждением
+SQL_INSTRUMENT = int(os.environ.get("SQL_INSTRUMENT", 1))
+SQL_REPEAT_THRESHOLD = int(os.environ.get("SQL_REPEAT_THRESHOLD", 2))
+SQL_IDLE_IN_TRANSACTION = float(os.environ.get("SQL_IDLE_IN_TRANSACTION", 0.2))
+
+log = logger.get("database")
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.lock = Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.opened = {}  # id(dbapi connection) -> время открытия
+        self.closed = 0
+        self.lifetime_total = 0.0
+        self.lifetime_max = 0.0
+
+    def on_checkout(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def on_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.opened[id(dbapi_connection)] = time()
+
+    def on_close(self, dbapi_connection, *args):
+        with self.lock:
+            created = self.opened.pop(id(dbapi_connection), None)
+            if created is not None:
+                lifetime = time() - created
+                self.closed += 1
+                self.lifetime_total += lifetime
+                self.lifetime_max = max(self.lifetime_max, lifetime)
+
+
+class TimedQueuePool(QueuePool):
+    metrics = None
+
+    # время ожидания соединения из пула (вместе с открытием нового, если пул не заполнен)
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            self.metrics.on_timeout()
+            raise
+        self.metrics.on_checkout(perf_counter() - started)
+        return connection
+
+
+class RequestSQL:
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.shapes = Counter()
+        self.idle_in_transaction = []
+
+
+def request_sql():
+    try:
+        from flask import g, has_request_context
+    except ImportError:
+        return None
+    if not has_request_context():
+        return None
+    return g.get("sql")
+
+
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SQL_PARAM_LISTS = re.compile(r"\(\s*(?:\?|%\(\w+\)s)(?:\s*,\s*(?:\?|%\(\w+\)s))+\s*\)")
+# служебные команды транзакций не считаются
+_SQL_SKIP = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA")
+
+
+def statement_shape(statement):
+    # форма запроса: без литералов и с IN (...) любой длины
+    shape = _SQL_LITERALS.sub("?", " ".join(statement.split()))
+    return _SQL_PARAM_LISTS.sub("(...)", shape)
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    now = perf_counter()
+    transaction = connection.info.get("sql_transaction")
+    if transaction is not None:
+        transaction["idle"] = max(transaction["idle"], now - transaction["last"])
+    connection.info["sql_started"] = now
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    now = perf_counter()
+    elapsed = now - connection.info.pop("sql_started", now)
+    transaction = connection.info.get("sql_transaction")
+    if transaction is not None:
+        transaction["last"] = now
+    state = request_sql()
+    if state is None or statement.lstrip().upper().startswith(_SQL_SKIP):
+        return
+    state.statements += 1
+    state.seconds += elapsed
+    # для SELECT у большинства драйверов rowcount = -1, загруженные строки считает _on_load
+    if cursor.rowcount > 0:
+        state.rows += cursor.rowcount
+    state.shapes[statement_shape(statement)] += 1
+
+
+def _on_begin(connection):
+    now = perf_counter()
+    connection.info["sql_transaction"] = {"last": now, "idle": 0.0}
+
+
+def _on_transaction_end(connection):
+    transaction = connection.info.pop("sql_transaction", None)
+    state = request_sql()
+    if transaction is None or state is None:
+        return
+    idle = max(transaction["idle"], perf_counter() - transaction["last"])
+    if idle >= SQL_IDLE_IN_TRANSACTION:
+        state.idle_in_transaction.append(round(idle, 3))
+
+
+def _on_load(session, instance):
+    state = request_sql()
+    if state is not None:
+        state.rows += 1
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "begin", _on_begin)
+    event.listen(engine, "commit", _on_transaction_end)
+    event.listen(engine, "rollback", _on_transaction_end)
+
+
+def instrument(app):
+    if not SQL_INSTRUMENT:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def start_sql_accounting():
+        g.sql = RequestSQL()
+
+    @app.after_request
+    def report_sql(response):
+        state = g.pop("sql", None)
+        if state is None:
+            return response
+        response.headers.add(
+            "Server-Timing", f'db;dur={1000 * state.seconds:.1f};desc="{state.statements} queries, {state.rows} rows"'
+        )
+        repeated = [
+            {"count": n, "statement": shape} for shape, n in state.shapes.most_common() if n >= SQL_REPEAT_THRESHOLD
+        ]
+        if repeated or state.idle_in_transaction:
+            log.warning(
+                "sql pattern", endpoint=request.endpoint, method=request.method, path=request.path,
+                statements=state.statements, repeated=repeated, idle_in_transaction=state.idle_in_transaction,
+            )
+        log.request(request.path, "sql", statements=state.statements, ms=round(1000 * state.seconds, 1), rows=state.rows)
+        return response
+
+
+def create_pooled_engine(url, metrics, pool_size, asynchronous=False):
+    # asynchronous=True - AsyncEngine, события и метрики вешаются на его sync_engine
+    options = {"pool_pre_ping": bool(DB_POOL_PRE_PING)}
+    if not IN_MEMORY:
+        pool_bases = (TimedQueuePool, AsyncAdaptedQueuePool) if asynchronous else (TimedQueuePool,)
+        options.update(
+            poolclass=type("TimedQueuePool", pool_bases, {"metrics": metrics}),
+            pool_size=pool_size,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    if asynchronous:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        async_engine = create_async_engine(url, **options)
+        engine = async_engine.sync_engine
+    else:
+        engine = create_engine(url, **options)
+    engine.metrics = metrics
+    event.listen(engine, "connect", metrics.on_connect)
+    event.listen(engine, "close", metrics.on_close)
+    event.listen(engine, "close_detached", metrics.on_close)
+    if SQL_INSTRUMENT:
+        instrument_engine(engine)
+    return async_engine if asynchronous else engine
+
+
+def sqlite_pragmas(read_only):
+    def on_connect(dbapi_connection, connection_record):
+        # транзакции начинает on_begin, а не pysqlite перед первой записью
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}")
+        if not read_only:
+            cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size = {SQLITE_CACHE_SIZE}")
+        if read_only:
+            cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+    return on_connect
+
+
+def sqlite_begin(statement):
+    def on_begin(connection):
+        connection.exec_driver_sql(statement)
+    return on_begin
+
+
+engine = create_pooled_engine(DATABASE_URL, PoolMetrics(), DB_POOL_SIZE)
+read_engine = engine
+if IS_SQLITE and not IN_MEMORY:
+    # Пишущая транзакция сразу берёт блокировку записи (BEGIN IMMEDIATE): иначе чтение,
+    # за которым следует запись (office.book), в WAL получает SQLITE_BUSY без ожидания.
+    # Чтения идут через отдельный пул с query_only и не стоят в этой очереди
+    event.listen(engine, "connect", sqlite_pragmas(read_only=False))
+    event.listen(engine, "begin", sqlite_begin("BEGIN IMMEDIATE"))
+    read_engine = create_pooled_engine(DATABASE_URL, PoolMetrics(), DB_READ_POOL_SIZE)
+    event.listen(read_engine, "connect", sqlite_pragmas(read_only=True))
+    event.listen(read_engine, "begin", sqlite_begin("BEGIN"))
+
+replica_engines = [create_pooled_engine(url, PoolMetrics(), DB_READ_POOL_SIZE) for url in DATABASE_REPLICA_URLS]
+
+# фабрики сессий одни на процесс
+session_factory = sessionmaker(bind=engine)
+read_session_factory = sessionmaker(bind=read_engine)
+replica_session_factories = [sessionmaker(bind=replica) for replica in replica_engines]
+
+print("DB POOL:", engine.pool.__class__.__name__, "size", DB_POOL_SIZE, "overflow", DB_MAX_OVERFLOW,
+      "recycle", DB_POOL_RECYCLE, "pre_ping", DB_POOL_PRE_PING)
+if read_engine is not engine:
+    print("SQLITE:", SQLITE_JOURNAL_MODE, "synchronous", SQLITE_SYNCHRONOUS, "busy_timeout", SQLITE_BUSY_TIMEOUT,
+          "read pool", DB_READ_POOL_SIZE)
+for replica in replica_engines:
+    print("DB REPLICA:", replica.url.render_as_string(hide_password=True))
+print("SQL_INSTRUMENT:", SQL_INSTRUMENT, "repeat threshold", SQL_REPEAT_THRESHOLD,
+      "idle in transaction", SQL_IDLE_IN_TRANSACTION)
+
+
+LAST_WRITE_HEADER = "X-Last-Write"
+
+
+def chain_key():
+    # Цепочка запросов одного пользователя: гейтвей кладёт user_id в заголовки,
+    # сервисы пробрасывают их дальше. Без пользователя - адрес вызывающего
+    try:
+        from flask import has_request_context, request
+    except ImportError:
+        return None
+    if not has_request_context():
+        return None
+    return request.headers.get("user_id") or request.remote_addr
+
+
+def chain_last_write():
+    # метка записи, которую цепочка принесла из другого процесса
+    try:
+        from flask import has_request_context, request
+    except ImportError:
+        return None
+    if not has_request_context():
+        return None
+    return request.headers.get(LAST_WRITE_HEADER)
+
+
+def mark_chain_write():
+    # Ответ на запрос с записью получает X-Last-Write: так о записи узнают и другие процессы
+    try:
+        from flask import after_this_request, g, has_request_context
+    except ImportError:
+        return
+    if not has_request_context():
+        return
+    first = "last_write" not in g
+    g.last_write = time()
+    if first:
+        @after_this_request
+        def add_last_write(response):
+            response.headers[LAST_WRITE_HEADER] = f"{g.last_write:.3f}"
+            return response
+
+
+class ReadYourWrites:
+    """Когда цепочка запросов последний раз писала в базу"""
+
+    def __init__(self, window, max_keys):
+        self.window = window
+        self.max_keys = max_keys
+        self.writes = OrderedDict()
+        self.lock = Lock()
+        self.primary_reads = 0
+
+    def on_write(self, key):
+        with self.lock:
+            self.writes[key] = monotonic() + self.window
+            self.writes.move_to_end(key)
+            while len(self.writes) > self.max_keys:
+                self.writes.popitem(last=False)
+
+    def wrote_recently(self, key, last_write=None):
+        # last_write - X-Last-Write запроса: запись могла быть в другом процессе.
+        # Часы машин могут немного расходиться, окно должно это покрывать
+        with self.lock:
+            try:
+                if time() - float(last_write) <= self.window:
+                    self.primary_reads += 1
+                    return True
+            except (TypeError, ValueError):
+                pass
+            until = self.writes.get(key)
+            if until is None:
+                return False
+            if until < monotonic():
+                del self.writes[key]
+                return False
+            self.primary_reads += 1
+            return True
+
+
+recent_writes = ReadYourWrites(READ_YOUR_WRITES_WINDOW, READ_YOUR_WRITES_MAX_KEYS)
+replica_turn = count()
+
+
+def read_session_factory_for_request():
+    if not replica_session_factories or recent_writes.wrote_recently(chain_key(), chain_last_write()):
+        return read_session_factory
+    return replica_session_factories[next(replica_turn) % len(replica_session_factories)]
+
+
+def async_chain_key(request):
+    # chain_key для запроса Starlette
+    if request is None:
+        return None
+    return request.headers.get("user_id") or (request.client.host if request.client else None)
+
+
+def last_write_headers(request):
+    # Обработчик Starlette добавляет их к ответу: X-Last-Write, если AsyncSession(request) писала
+    last_write = getattr(request.state, "last_write", None) if request is not None else None
+    return {LAST_WRITE_HEADER: f"{last_write:.3f}"} if last_write is not None else {}
+
+
+def _mark_flush(session, flush_context):
+    session.info["wrote"] = True
+
+
+def _mark_bulk_write(orm_execute_state):
+    # query(...).delete() и update() идут мимо flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        orm_execute_state.session.info["wrote"] = True
+
+
+event.listen(session_factory, "after_flush", _mark_flush)
+event.listen(session_factory, "do_orm_execute", _mark_bulk_write)
+
+
+class AsyncORMSession(ORMSession):
+    """Синхронная часть AsyncSession: отмечает записи так же, как session_factory"""
+
+
+event.listen(AsyncORMSession, "after_flush", _mark_flush)
+event.listen(AsyncORMSession, "do_orm_execute", _mark_bulk_write)
+if SQL_INSTRUMENT:
+    event.listen(ORMSession, "loaded_as_persistent", _on_load)
+
+
+# Миграции сервиса: (версия, описание, функция от connection), регистрируются через @migration.
+# Применённые версии хранятся в schema_migrations; каждая миграция должна выдерживать
+# базу, где create_all уже создал её индексы и колонки (новая установка)
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(apply):
+        if any(m[0] == version for m in MIGRATIONS):
+            raise ValueError(f"migration {version} is already registered")
+        MIGRATIONS.append((version, description, apply))
+        return apply
+    return register
+
+
+def create_indexes(connection, model):
+    for index in model.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def add_column(connection, model, name):
+    # у новой NOT NULL колонки должен быть server_default, иначе существующие строки не пройдут
+    table = model.__table__
+    existing = {c["name"] for c in inspect(connection).get_columns(table.name)}
+    if name not in existing:
+        ddl = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+        connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+
+
+def migrate():
+    applied = []
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS schema_migrations "
+            "(version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at INTEGER NOT NULL)"
+        )
+        if connection.dialect.name == "postgresql":
+            # реплики, стартующие одновременно, применяют миграции по очереди
+            connection.exec_driver_sql("LOCK TABLE schema_migrations IN EXCLUSIVE MODE")
+        done = {version for (version,) in connection.exec_driver_sql("SELECT version FROM schema_migrations")}
+        for version, description, apply in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version in done:
+                continue
+            apply(connection)
+            connection.execute(
+                text("INSERT INTO schema_migrations VALUES (:version, :description, :applied_at)"),
+                {"version": version, "description": description, "applied_at": int(time())},
+            )
+            applied.append((version, description))
+    for version, description in applied:
+        print("MIGRATION APPLIED:", version, description)
+    return applied
+
+
+async_engine = None
+async_read_engine = None
+async_replica_engines = []
+async_session_factory = None
+async_read_session_factory = None
+async_replica_session_factories = []
+
+
+def async_url(url):
+    scheme, _, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"no asyncio driver for {dialect!r}, set $DATABASE_ASYNC_URL")
+    return f"{dialect}+{ASYNC_DRIVERS[dialect]}://{rest}"
+
+
+def init_async():
+    # Пулы asyncio-движка отдельные от синхронных: Flask-часть того же процесса
+    # (всё, что не переведено на async) продолжает работать через engine
+    global async_engine, async_read_engine, async_session_factory, async_read_session_factory
+    global async_replica_engines, async_replica_session_factories
+    if async_engine is not None:
+        return
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    url = DATABASE_ASYNC_URL or async_url(DATABASE_URL)
+    async_engine = create_pooled_engine(url, PoolMetrics(), DB_POOL_SIZE, asynchronous=True)
+    async_read_engine = async_engine
+    if IS_SQLITE and not IN_MEMORY:
+        event.listen(async_engine.sync_engine, "connect", sqlite_pragmas(read_only=False))
+        event.listen(async_engine.sync_engine, "begin", sqlite_begin("BEGIN IMMEDIATE"))
+        async_read_engine = create_pooled_engine(url, PoolMetrics(), DB_READ_POOL_SIZE, asynchronous=True)
+        event.listen(async_read_engine.sync_engine, "connect", sqlite_pragmas(read_only=True))
+        event.listen(async_read_engine.sync_engine, "begin", sqlite_begin("BEGIN"))
+    async_replica_engines = [
+        create_pooled_engine(async_url(replica), PoolMetrics(), DB_READ_POOL_SIZE, asynchronous=True)
+        for replica in DATABASE_REPLICA_URLS
+    ]
+
+    # expire_on_commit=False: ленивой подгрузки в async нет, объекты должны читаться и после выхода из сессии
+    async_session_factory = async_sessionmaker(
+        bind=async_engine, sync_session_class=AsyncORMSession, expire_on_commit=False
+    )
+    async_read_session_factory = async_sessionmaker(bind=async_read_engine, expire_on_commit=False)
+    async_replica_session_factories = [
+        async_sessionmaker(bind=replica, expire_on_commit=False) for replica in async_replica_engines
+    ]
+    print("DB ASYNC:", async_engine.url.render_as_string(hide_password=True))
 
 
 def create_schema():
     Base.metadata.create_all(engine, checkfirst=True)
+    return migrate()
+
+
+def engine_stats(engine):
+    pool = engine.pool
+    pool_metrics = engine.metrics
+    now = time()
+    with pool_metrics.lock:
+        stats = {
+            "pool": pool.__class__.__name__,
+            "checkouts": pool_metrics.checkouts,
+            "checkout_wait_avg_ms": round(1000 * pool_metrics.wait_total / max(pool_metrics.checkouts, 1), 3),
+            "checkout_wait_max_ms": round(1000 * pool_metrics.wait_max, 3),
+            "checkout_timeouts": pool_metrics.timeouts,
+            "connections_open": len(pool_metrics.opened),
+            "oldest_connection_age": round(now - min(pool_metrics.opened.values()), 1) if pool_metrics.opened else None,
+            "connections_closed": pool_metrics.closed,
+            "connection_lifetime_avg": round(pool_metrics.lifetime_total / max(pool_metrics.closed, 1), 1),
+            "connection_lifetime_max": round(pool_metrics.lifetime_max, 1),
+        }
+    if isinstance(pool, QueuePool):
+        limit = pool.size() + max(DB_MAX_OVERFLOW, 0)
+        stats.update(
+            pool_size=pool.size(),
+            max_overflow=DB_MAX_OVERFLOW,
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+            # доля занятых соединений от предела пула; 1 - новые запросы ждут
+            saturation=round(pool.checkedout() / limit, 3) if DB_MAX_OVERFLOW >= 0 else None,
+        )
+    return stats
+
+
+def pool_stats():
+    stats = engine_stats(engine)
+    if read_engine is not engine:
+        stats["read"] = engine_stats(read_engine)
+    if replica_engines:
+        stats["replicas"] = {
+            replica.url.render_as_string(hide_password=True): engine_stats(replica) for replica in replica_engines
+        }
+        stats["read_your_writes_primary_reads"] = recent_writes.primary_reads
+    if async_engine is not None:
+        stats["async"] = engine_stats(async_engine.sync_engine)
+        if async_read_engine is not async_engine:
+            stats["async"]["read"] = engine_stats(async_read_engine.sync_engine)
+    return stats
 
 
 class Session:
     session = None
-
-    def __init__(self) -> None:
-        self.session_class = sessionmaker(bind=engine)
+    factory = session_factory
 
     def __enter__(self) -> ORMSession:
-        self.session = self.session_class()
+        self.session = self.factory()
         return self.session
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
         if not exc_type:
             self.session.commit()
+            if self.session.info.pop("wrote", False):
+                mark_chain_write()
+                if replica_session_factories:
+                    recent_writes.on_write(chain_key())
         else:
             self.session.rollback()
         self.session.close()
-        self.session = None
\ No newline at end of file
+        self.session = None
+
+
+class ReadSession(Session):
+    """Сессия для обработчиков, которые только читают: реплика из DATABASE_REPLICA_URLS
+    (по очереди), основная база сразу после записи, на SQLite - пул с query_only"""
+
+    def __enter__(self) -> ORMSession:
+        self.session = read_session_factory_for_request()()
+        return self.session
+
+
+class AsyncSession:
+    """async with database.AsyncSession(request) as s: то же, что Session, для обработчиков
+    Starlette. request нужен только для read-your-writes при репликах"""
+
+    def __init__(self, request=None):
+        self.request = request
+        self.session = None
+
+    def factory(self):
+        return async_session_factory()
+
+    async def __aenter__(self):
+        self.session = self.factory()
+        return self.session
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        if not exc_type:
+            await self.session.commit()
+            if self.session.sync_session.info.pop("wrote", False):
+                if self.request is not None:
+                    self.request.state.last_write = time()
+                if async_replica_session_factories:
+                    recent_writes.on_write(async_chain_key(self.request))
+        else:
+            await self.session.rollback()
+        await self.session.close()
+        self.session = None
+
+
+class AsyncReadSession(AsyncSession):
+    def factory(self):
+        last_write = self.request.headers.get(LAST_WRITE_HEADER) if self.request is not None else None
+        if not async_replica_session_factories or \
+                recent_writes.wrote_recently(async_chain_key(self.request), last_write):
+            return async_read_session_factory()
+        return async_replica_session_factories[next(replica_turn) % len(async_replica_session_factories)]()
@@ -1,18 +1,21 @@
 from functools import wraps
-from collections import defaultdict
 import os
 
 from requests import request
 from flask import Flask
 from flask import request as flask_request, jsonify
-from sqlalchemy import Column, Integer, Text
+from sqlalchemy import Column, Index, Integer, Text, func
 
 import database
 import auth
+import logger
+
+log = logger.setup("statistics")
 
 # Экземпляр приложения
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
+database.instrument(app)
 JWT_SECRET = auth.KNOWN_CLIENTS["statistics_service"]
 
 
@@ -22,6 +25,17 @@ class Record(database.Base):
     car_uuid = Column(Text, nullable=False)
     office_id = Column(Text, nullable=False)
 
+    __table_args__ = (
+        # отчёты считаются GROUP BY по индексу, без чтения таблицы
+        Index("ix_stat_record_car_uuid", "car_uuid"),
+        Index("ix_stat_record_office_id", "office_id"),
+    )
+
+
+@database.migration(1, "stat_record indexes")
+def add_stat_record_indexes(connection):
+    database.create_indexes(connection, Record)
+
 
 @app.route('/token', methods=["POST"])
 def get_token():
@@ -33,6 +47,20 @@ def get_token():
     return {"token": token, "expire": expire}, 200
 
 
+@app.route('/token/cache', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_token_cache_stats():
+    return auth.verified_tokens.stats(), 200
+
+
+@app.route('/db/stats', methods=["GET"])
+@auth.check_for_service
+@auth.requires_auth(JWT_SECRET)
+def get_db_stats():
+    return database.pool_stats(), 200
+
+
 @app.route('/reports/create_record', methods=["POST"])
 @auth.requires_auth(JWT_SECRET)
 def create_record():
@@ -54,12 +82,8 @@ def create_record():
 @auth.check_for_admin
 @auth.requires_auth(JWT_SECRET)
 def booking_by_uuids():
-    with database.Session() as s:
-        records = s.query(Record).all()
-
-        result = defaultdict(lambda: 0)
-        for rec in records:
-            result[rec.car_uuid] += 1
+    with database.ReadSession() as s:
+        result = dict(s.query(Record.car_uuid, func.count()).group_by(Record.car_uuid))
 
     return result, 200
 
@@ -68,12 +92,8 @@ def booking_by_uuids():
 @auth.check_for_admin
 @auth.requires_auth(JWT_SECRET)
 def booking_by_offices():
-    with database.Session() as s:
-        records = s.query(Record).all()
-
-        result = defaultdict(lambda: 0)
-        for rec in records:
-            result[rec.office_id] += 1
+    with database.ReadSession() as s:
+        result = dict(s.query(Record.office_id, func.count()).group_by(Record.office_id))
 
     return result, 200
 